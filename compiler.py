@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 #Karantias Konstantinos 2454 cse32454 Goulioumis Ioannis 2232 cse32232
 import argparse
+import hashlib
+import json
+import mmap
+import operator
 import os
 import re
+import signal
+import socketserver
+import struct
 import sys
+import tempfile
+import threading
+import time
 from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pprint import pformat
 
 INVALID_TOKENS = [
@@ -43,8 +55,8 @@ VALID_TOKENS = [
      ('gt', re.compile(r'\A>')), ('lt', re.compile(r'\A<')),
      ('eq', re.compile(r'\A='))]
 
-EXTRA_VALIDATORS = defaultdict(lambda: lambda x: True)
-EXTRA_VALIDATORS['int'] = lambda x: -32767 <= int(x) <= 32767
+# tokens that match their regex must also pass these, if they have one
+EXTRA_VALIDATORS = {'int': lambda x: -32767 <= int(x) <= 32767}
 
 Token = namedtuple('Token', ['type', 'value', 'pos'])
 
@@ -120,7 +132,8 @@ class Lexer:
 
                 for name, regex in VALID_TOKENS:
                     match = regex.search(self.source())
-                    if match and EXTRA_VALIDATORS[name](match.group()):
+                    if match and (name not in EXTRA_VALIDATORS or
+                                  EXTRA_VALIDATORS[name](match.group())):
                         found_token = True
 
                         value = match.group() if len(
@@ -180,36 +193,96 @@ CursorPosition = namedtuple('CursorPosition', ['row', 'col'])
 
 Quad = namedtuple('quad', ['id', 'op', 'term0', 'term1', 'target'])
 
+ARITHMETIC_OPS = ('+', '-', '*', '/')
+RELOPS = ('=', '<>', '<', '<=', '>', '>=')
+
+
+def is_variable(term):
+    return term != '_' and not term.lstrip('-').isdigit()
+
+
+def quad_uses(quad):
+    if quad.op in ARITHMETIC_OPS or quad.op in RELOPS:
+        terms = [quad.term0, quad.term1]
+    elif quad.op in (':=', 'retv', 'out', 'jtable') or (
+            quad.op == 'par' and quad.term1 != 'ret'):
+        terms = [quad.term0]
+    else:
+        terms = []
+    return [term for term in terms if is_variable(term)]
+
+
+def quad_defs(quad):
+    if quad.op in ARITHMETIC_OPS or quad.op == ':=':
+        terms = [quad.target]
+    elif quad.op == 'inp' or (quad.op == 'par' and quad.term1 != 'cv'):
+        terms = [quad.term0]
+    else:
+        terms = []
+    return [term for term in terms if is_variable(term)]
+
+
+def format_token(token):
+    return '%d:%d\t%s\t%s' % (token.pos.row, token.pos.col, token.type,
+                              token.value)
+
+
+def format_quad(quad):
+    return '%s: (%s, %s, %s, %s)' % (quad.id, quad.op, quad.term0, quad.term1,
+                                     quad.target)
+
 
 class QuadGenerator:
-    def __init__(self, table=None):
+    def __init__(self, table=None, sink=None):
         self.quad_id = 0
         self.temp_id = 0
-        self.quad_list = []
+        # temporaries of the final code generators are numbered apart, so
+        # that the quads are the same whether or not it is generated
+        self.final_temp_id = 0
         self.table = table
-        self.marked = []
+        # start_quad of a subprogram: its formal parameters, which the quads
+        # alone don't tell
+        self.parameters = {}
+        # a file-like the quads of each block are written to when it ends,
+        # after which they are released. quad_list is then a dict of the
+        # quads not released yet by id, and a quad is marked once it is gone
+        # from it, so only the quads of the open blocks are kept
+        self.sink = sink
+        if sink is None:
+            self.quad_list = []
+            self.marked = []
+        else:
+            self.quad_list = {}
+            self.marked = None
 
     def nextquad(self):
         return self.quad_id
 
     def genquad(self, op, term0, term1, target):
-        self.quad_list.append(
-            Quad(
-                id=self.quad_id,
-                op=op,
-                term0=term0,
-                term1=term1,
-                target=target))
-        self.marked.append(False)
+        quad = Quad(
+            id=self.quad_id, op=op, term0=term0, term1=term1, target=target)
+        if self.sink is None:
+            self.quad_list.append(quad)
+            self.marked.append(False)
+        else:
+            self.quad_list[quad.id] = quad
         self.quad_id += 1
 
-    def newtemp(self, should_gen=True):
-        temp = 'T_%d' % self.temp_id
-        self.temp_id += 1
+    def newtemp(self, should_gen=True, final=False):
+        if final:
+            temp = 'B_%d' % self.final_temp_id
+            self.final_temp_id += 1
+        else:
+            temp = 'T_%d' % self.temp_id
+            self.temp_id += 1
         if should_gen and self.table is not None:
             self.table.add_entity(TempVariableEntity(temp))
         return temp
 
+    def rewrite(self, quad_id, op, term0, term1, target):
+        self.quad_list[quad_id] = Quad(
+            id=quad_id, op=op, term0=term0, term1=term1, target=target)
+
     def backpatch(self, lst, target):
         for l in lst:
             quad = self.quad_list[l]
@@ -221,6 +294,9 @@ class QuadGenerator:
                 target=target)
 
     def get_and_mark_quads_from(self, from_index):
+        if self.sink is not None:
+            return self.release(from_index)
+
         quads = [
             quad for quad in self.quad_list[from_index:]
             if not self.marked[quad.id]
@@ -231,16 +307,278 @@ class QuadGenerator:
 
         return quads
 
+    def release(self, from_index):
+        # the dict is in the order of the quad ids
+        quads = [
+            self.quad_list.pop(quad_id)
+            for quad_id in list(self.quad_list) if quad_id >= from_index
+        ]
+        for quad in quads:
+            self.sink.write('%s\n' % format_quad(quad))
+        return quads
+
     def __str__(self):
-        return '\n'.join(
-            '%s: (%s, %s, %s, %s)' % (quad.id, quad.op, quad.term0, quad.term1,
-                                      quad.target) for quad in self.quad_list)
+        quads = self.quad_list if self.sink is None else \
+            self.quad_list.values()
+        return '\n'.join(format_quad(quad) for quad in quads)
+
+
+# The binary intermediate code: a header, the operands of the quads interned
+# in a string table, a fixed-width record per quad and an index of the
+# subprograms with their parameters. Every number is little-endian and every
+# section starts at a multiple of 4 bytes.
+IR_MAGIC = b'EELI'
+IR_VERSION = 1
+# magic, version, the number of quads, strings, subprograms and parameters,
+# and the offsets of the string table, the quads, the subprograms and the
+# parameters
+IR_HEADER = struct.Struct('<4sH2x8I')
+# op, term0, term1 and target: indexes into the string table, or quad ids
+# with IR_QUAD_ID set
+IR_QUAD = struct.Struct('<4I')
+IR_QUAD_ID = 0x80000000
+# name, start_quad, the id of its end_block, nesting level, the start_quad
+# of its parent (IR_NO_PARENT for the main program), and the index and
+# number of its parameters
+IR_SUBPROGRAM = struct.Struct('<7I')
+IR_NO_PARENT = 0xffffffff
+# name and mode
+IR_PARAMETER = struct.Struct('<2I')
+
+# end_quad: the id of its end_block
+# parent: the start_quad of the subprogram it is nested in, None for the main
+#   program
+# parameters: its formal parameters, as Arguments
+IRSubprogram = namedtuple(
+    'IRSubprogram',
+    ['name', 'start_quad', 'end_quad', 'level', 'parent', 'parameters'])
+
+
+class IRFormatError(Exception):
+    pass
+
+
+def ir_align(data):
+    return data + bytes(-len(data) % 4)
+
+
+def encode_ir(quad_gen):
+    """Returns the quads and the formal parameters of the subprograms of a
+    whole program in the binary intermediate code."""
+    strings = {}
+
+    def intern(term):
+        if isinstance(term, int):
+            return term | IR_QUAD_ID
+        return strings.setdefault(term, len(strings))
+
+    quads = b''.join(
+        IR_QUAD.pack(*[intern(term) for term in quad[1:]])
+        for quad in quad_gen.quad_list)
+    subprograms = []
+    parameters = []
+    for start_quad, block in sorted(split_blocks(quad_gen.quad_list).items()):
+        arguments = quad_gen.parameters.get(start_quad, [])
+        subprograms.append(
+            IR_SUBPROGRAM.pack(
+                intern(block.name), start_quad, block.quads[-1].id,
+                block.level,
+                IR_NO_PARENT if block.parent is None else block.parent,
+                len(parameters), len(arguments)))
+        parameters += [
+            IR_PARAMETER.pack(intern(arg.name), intern(arg.mode))
+            for arg in arguments
+        ]
+
+    encoded = [term.encode('utf-8') for term in strings]
+    offsets = [0]
+    for term in encoded:
+        offsets.append(offsets[-1] + len(term))
+    sections = [
+        ir_align(struct.pack('<%dI' % len(offsets), *offsets) +
+                 b''.join(encoded)), quads, b''.join(subprograms),
+        b''.join(parameters)
+    ]
+    starts = [IR_HEADER.size]
+    for section in sections[:-1]:
+        starts.append(starts[-1] + len(section))
+    return IR_HEADER.pack(IR_MAGIC, IR_VERSION, len(quad_gen.quad_list),
+                          len(strings), len(subprograms), len(parameters),
+                          *starts) + b''.join(sections)
+
+
+class IRReader:
+    """Reads the binary intermediate code of a file through mmap.
+
+    Nothing is read up front besides the header and the index of the
+    subprograms: quads are unpacked when asked for and strings decoded from
+    the mapping the first time they are used, so any subprogram's quads can
+    be had without going through the rest. subprograms has the IRSubprograms
+    by start_quad."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < IR_HEADER.size:
+                raise IRFormatError('%s is too short to be intermediate code'
+                                    % path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        try:
+            self.read_index(path)
+        except Exception as e:
+            self.close()
+            if isinstance(e, IRFormatError):
+                raise
+            raise IRFormatError('%s is corrupt: %s' % (path, e)) from e
+
+    def read_index(self, path):
+        (magic, version, self.quad_count, string_count, subprogram_count,
+         parameter_count, self.strings_offset, self.quads_offset,
+         subprograms_offset,
+         parameters_offset) = IR_HEADER.unpack_from(self.map)
+        if magic != IR_MAGIC:
+            raise IRFormatError('%s is not binary intermediate code' % path)
+        if version != IR_VERSION:
+            raise IRFormatError(
+                '%s is version %d of the intermediate code, not %d' %
+                (path, version, IR_VERSION))
+        for offset, size in [
+            (self.strings_offset, 4 * (string_count + 1)),
+            (self.quads_offset, self.quad_count * IR_QUAD.size),
+            (subprograms_offset, subprogram_count * IR_SUBPROGRAM.size),
+            (parameters_offset, parameter_count * IR_PARAMETER.size),
+        ]:
+            if offset + size > len(self.map):
+                raise IRFormatError('%s is truncated' % path)
+        self.text_offset = self.strings_offset + 4 * (string_count + 1)
+        self.strings = [None] * string_count
+
+        self.subprograms = {}
+        for i in range(subprogram_count):
+            (name, start_quad, end_quad, level, parent, first,
+             count) = IR_SUBPROGRAM.unpack_from(
+                 self.map, subprograms_offset + i * IR_SUBPROGRAM.size)
+            if first + count > parameter_count:
+                raise IRFormatError('%s has parameters out of range' % path)
+            self.subprograms[start_quad] = IRSubprogram(
+                name=self.string(name),
+                start_quad=start_quad,
+                end_quad=end_quad,
+                level=level,
+                parent=None if parent == IR_NO_PARENT else parent,
+                parameters=[
+                    Argument(*[
+                        self.string(term)
+                        for term in IR_PARAMETER.unpack_from(
+                            self.map, parameters_offset +
+                            j * IR_PARAMETER.size)
+                    ]) for j in range(first, first + count)
+                ])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.quad_count
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+    def string(self, index):
+        if not 0 <= index < len(self.strings):
+            raise IRFormatError('no string %d' % index)
+        if self.strings[index] is None:
+            start, end = struct.unpack_from(
+                '<2I', self.map, self.strings_offset + 4 * index)
+            if not start <= end <= len(self.map) - self.text_offset:
+                raise IRFormatError('string %d is out of range' % index)
+            self.strings[index] = str(
+                self.view[self.text_offset + start:self.text_offset + end],
+                'utf-8')
+        return self.strings[index]
+
+    def term(self, value):
+        if value & IR_QUAD_ID:
+            return value & ~IR_QUAD_ID
+        return self.string(value)
+
+    def quad(self, quad_id):
+        if not 0 <= quad_id < self.quad_count:
+            raise IndexError('no quad %d' % quad_id)
+        try:
+            op, term0, term1, target = IR_QUAD.unpack_from(
+                self.map, self.quads_offset + quad_id * IR_QUAD.size)
+            return Quad(id=quad_id,
+                        op=self.string(op),
+                        term0=self.term(term0),
+                        term1=self.term(term1),
+                        target=self.term(target))
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise IRFormatError('quad %d is corrupt: %s' % (quad_id, e)) \
+                from e
+
+    def quads(self, start_quad=None):
+        """Returns the quads of the subprogram at start_quad, leaving out the
+        ones of the subprograms nested in it, or every quad if start_quad is
+        None."""
+        if start_quad is None:
+            return [self.quad(quad_id) for quad_id in range(len(self))]
+
+        subprogram = self.subprograms[start_quad]
+        nested = sorted((child.start_quad, child.end_quad)
+                        for child in self.subprograms.values()
+                        if child.parent == start_quad)
+        nested.append((subprogram.end_quad + 1, subprogram.end_quad))
+        ret = []
+        quad_id = start_quad
+        for child_start, child_end in nested:
+            ret += [self.quad(i) for i in range(quad_id, child_start)]
+            quad_id = child_end + 1
+        return ret
+
+    def find(self, name):
+        """Returns the start_quads of the subprograms called name."""
+        return [
+            subprogram.start_quad
+            for subprogram in self.subprograms.values()
+            if subprogram.name == name
+        ]
+
+    def quad_generator(self):
+        """Returns a QuadGenerator with every quad, for QuadVM, PythonGen or
+        CGen to start from."""
+        quad_gen = QuadGenerator()
+        quad_gen.quad_list = self.quads()
+        quad_gen.quad_id = len(self)
+        quad_gen.marked = [False] * len(self)
+        quad_gen.parameters = dict(
+            (start_quad, subprogram.parameters)
+            for start_quad, subprogram in self.subprograms.items()
+            if subprogram.parent is not None)
+        return quad_gen
+
+
+SwitchCase = namedtuple('SwitchCase',
+                        ['value', 'test_quad', 'jump_when_done'])
+
+# switches with fewer cases than this keep the linear chain of comparisons
+SWITCH_LOWERING_MIN_CASES = 4
+# a jump table is used when at least this fraction of its entries are cases
+JUMP_TABLE_MIN_DENSITY = 0.5
+JUMP_TABLE_MAX_SIZE = 1024
+# subtrees of a binary decision tree with this many cases are searched linearly
+DECISION_TREE_LEAF_SIZE = 3
 
 
 class TrueFalse:
-    def __init__(self, true=[], false=[]):
-        self.true = true
-        self.false = false
+    def __init__(self, true=None, false=None):
+        # parse_condition and parse_boolterm extend these in place
+        self.true = true if true is not None else []
+        self.false = false if false is not None else []
 
 
 class Serializable:
@@ -433,78 +771,3302 @@ class SymbolTable:
         return self.has_an_entity_that_fulfills(name,
                                                 lambda x: x.is_a_procedure())
 
-    def has_a_function(self, name):
-        return self.has_an_entity_that_fulfills(name,
-                                                lambda x: x.is_a_function())
+    def has_a_function(self, name):
+        return self.has_an_entity_that_fulfills(name,
+                                                lambda x: x.is_a_function())
+
+    def has_a_callable_with_signature(self, name, sig):
+        return self.has_an_entity_that_fulfills(name,
+                                                lambda x: x.has_signature(sig))
+
+    def get_current_nesting_level(self):
+        return max(0, len(self.scopes) - 1)
+
+    def get_cause_of_birth(self):
+        return self.scopes[-2].entities[-1]
+
+    def get_var_entities_on_scope(self, scope):
+        var_entities = 0
+        for entity in scope.entities:
+            if entity.is_a_variable():
+                var_entities += 1
+
+        return var_entities
+
+    def get_current_framelength(self):
+        # temporaries may share slots, so the frame ends after the last one
+        offsets = [
+            entity.offset for entity in self.scopes[-1].entities
+            if entity.is_a_variable() and entity.offset is not None
+        ]
+        return max(offsets) + 4 if len(offsets) > 0 else 12
+
+
+CALLING_CONVENTIONS = ('stack', 'registers')
+# what the compiler writes: MIPS or x86-64 assembly, or C
+TARGETS = ('mips', 'x86-64', 'c')
+ARGUMENT_REGISTERS = ('$a0', '$a1', '$a2', '$a3')
+# hold the arguments of a tail call while the frame is being replaced
+TAIL_CALL_REGISTERS = ('$t1', '$t2', '$t3', '$t4', '$t5', '$t6', '$t7',
+                       '$t8', '$t9')
+
+CompileOptions = namedtuple('CompileOptions', [
+    'calling_convention', 'trim_frames', 'schedule', 'latency_model',
+    'lower_switches', 'buffered_io', 'inline_budget',
+    'eliminate_dead_subprograms', 'memoize', 'memo_size', 'tail_calls',
+    'unroll_factor', 'unroll_max_quads', 'max_clones', 'share_stack_slots',
+    'target'
+],
+                            defaults=[
+                                'stack', True, False, None, True, False, 0,
+                                True, False, 256, True, 0, 64, 0, True, 'mips'
+                            ])
+
+
+def validate_options(options):
+    """Raises a ValueError if options has a value the compiler can't use."""
+    for name, choices in [('calling_convention', CALLING_CONVENTIONS),
+                          ('target', TARGETS)]:
+        if getattr(options, name) not in choices:
+            raise ValueError('%s must be one of %s' %
+                             (name, ', '.join(choices)))
+    for name in ['inline_budget', 'unroll_factor', 'unroll_max_quads',
+                 'max_clones', 'memo_size']:
+        value = getattr(options, name)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError('%s must be a non-negative integer' % name)
+    if options.memo_size < 1 or options.memo_size & (options.memo_size -
+                                                     1) != 0:
+        raise ValueError('memo_size must be a power of two')
+
+
+# size in bytes of each of the buffers of the buffered I/O runtime
+IO_BUFFER_SIZE = 256
+# longest text print_int may add to the output buffer: '-2147483648\n' and
+# the terminating null byte
+MAX_PRINTED_INT_LENGTH = 13
+
+# is_leaf: the subprogram makes no calls, so $ra never needs saving
+# reach: the outermost non-global nesting level whose frame the subprogram (or
+#   one nested in it) reaches through its static link, None if it never does
+FrameInfo = namedtuple('FrameInfo', ['is_leaf', 'reach'])
+
+
+def graph_order(node):
+    # subprograms are keyed by their start quad and their clones by their
+    # label, which go after them
+    return isinstance(node, str), node
+
+
+class CallGraph:
+    """The subprograms of a program and the ones each of them calls.
+
+    Subprograms are identified by their start_quad (0 for the main program)
+    and added as their blocks are generated, so nested subprograms and the
+    ones declared earlier are added first and the main program last."""
+
+    def __init__(self):
+        self.names = {}
+        self.parents = {}
+        self.callees = {}
+
+    def add(self, start_quad, name, parent, callees):
+        self.names[start_quad] = name
+        self.parents[start_quad] = parent
+        self.callees[start_quad] = set(callees)
+
+    def reachable(self, root=0):
+        seen = set([root])
+        pending = [root]
+        while len(pending) > 0:
+            for callee in self.callees.get(pending.pop(), ()):
+                if callee not in seen:
+                    seen.add(callee)
+                    pending.append(callee)
+        return seen
+
+    def unreachable(self, root=0):
+        reachable = self.reachable(root)
+        return sorted((start_quad for start_quad in self.callees
+                       if start_quad not in reachable),
+                      key=graph_order)
+
+    def components(self):
+        """Returns the strongly connected components (Tarjan's algorithm),
+        callees before their callers."""
+        index = {}
+        lowlink = {}
+        stack = []
+        components = []
+
+        def visit(node):
+            index[node] = lowlink[node] = len(index)
+            stack.append(node)
+            for callee in sorted(self.callees.get(node, ()), key=graph_order):
+                if callee not in index:
+                    visit(callee)
+                    lowlink[node] = min(lowlink[node], lowlink[callee])
+                elif callee in stack:
+                    lowlink[node] = min(lowlink[node], index[callee])
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(sorted(component, key=graph_order))
+
+        for node in sorted(self.callees, key=graph_order):
+            if node not in index:
+                visit(node)
+        return components
+
+    def recursive_components(self):
+        return [
+            component for component in self.components()
+            if len(component) > 1 or component[0] in self.callees.get(
+                component[0], ())
+        ]
+
+    def to_dot(self):
+        """Calls are solid edges and nesting is dotted. Unreachable
+        subprograms are dashed, recursive ones have a double border."""
+        reachable = self.reachable()
+        recursive = set(start_quad
+                        for component in self.recursive_components()
+                        for start_quad in component)
+
+        lines = ['digraph calls {']
+        for start_quad in sorted(self.names, key=graph_order):
+            attributes = ['label="%s"' % self.names[start_quad]]
+            if start_quad == 0:
+                attributes.append('shape=box')
+            if start_quad not in reachable:
+                attributes.append('style=dashed')
+            if start_quad in recursive:
+                attributes.append('peripheries=2')
+            lines.append('    q%s [%s];' % (start_quad, ', '.join(attributes)))
+
+        for start_quad in sorted(self.names, key=graph_order):
+            if self.parents[start_quad] is not None:
+                lines.append('    q%s -> q%s [style=dotted, arrowhead=none];' %
+                             (self.parents[start_quad], start_quad))
+            for callee in sorted(self.callees[start_quad], key=graph_order):
+                lines.append('    q%s -> q%s;' % (start_quad, callee))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+
+# label: the data label of the table, made of entries of a valid flag, the
+#   arguments and the result
+# params: the names of the parameters of the function
+# keys: temporaries holding the arguments as they were on entry
+# entry: temporary holding the address of the entry for those arguments
+MemoTable = namedtuple('MemoTable', ['label', 'params', 'keys', 'entry'])
+
+# multiplier of the hash of the arguments that picks the entry of a memo table
+MEMO_HASH_MULTIPLIER = 31
+
+
+# quads: the body of a generated subprogram, after inlining its own calls
+# end: the id of its end_block quad, which returns jump to
+# locals: the names of its parameters, variables and temporaries
+# nonlocals: how every other name used in the body resolves from its scope
+InlineCandidate = namedtuple('InlineCandidate',
+                             ['entity', 'quads', 'end', 'locals', 'nonlocals'])
+
+# quads whose target is the id of another quad
+JUMP_OPS = ('jump', 'jtarget') + RELOPS
+
+ARITHMETIC_FUNCTIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul
+}
+
+
+def divide(a, b):
+    # div truncates towards zero, unlike //
+    return abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+
+
+RELOP_FUNCTIONS = {
+    '=': operator.eq,
+    '<>': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+class Inliner:
+    """Replaces calls to small non-recursive subprograms with a copy of their
+    body.
+
+    Bodies are recorded as blocks are generated, so a block can only inline
+    the subprograms that are complete by then: the ones nested in it and the
+    siblings (of it or of its ancestors) declared before it. The copy's
+    parameters, variables and temporaries become temporaries of the caller,
+    `inout` parameters are replaced by the argument itself and its ids become
+    strings prefixed by the id of the call. A body is only copied if every
+    other name it uses means the same thing where it is copied to."""
+
+    def __init__(self, table, quad_gen, call_graph, budget):
+        self.table = table
+        self.quad_gen = quad_gen
+        self.call_graph = call_graph
+        self.budget = budget
+        self.candidates = {}
+        self.inlined_calls = 0
+
+    def record(self, start_quad, quads):
+        if self.table.get_current_nesting_level() == 0:
+            return
+
+        locals = [
+            entity.name for entity in self.table.scopes[-1].entities
+            if entity.is_a_variable()
+        ]
+        nonlocals = {}
+        for quad in quads:
+            names = quad_uses(quad) + quad_defs(quad)
+            if quad.op == 'call':
+                names.append(quad.term0)
+            for name in names:
+                if name not in locals:
+                    nonlocals[name] = self.table.lookup(name)
+
+        self.candidates[start_quad] = InlineCandidate(
+            entity=self.table.get_cause_of_birth(),
+            quads=[
+                quad for quad in quads
+                if quad.op not in ('begin_block', 'int')
+            ],
+            end=self.quad_gen.nextquad(),
+            locals=locals,
+            nonlocals=nonlocals)
+
+    def is_recursive(self, start_quad):
+        # subprograms without a call graph yet are still being parsed, so
+        # they are the ones we are nested in and may well call us back
+        callees = self.call_graph.callees
+        seen = set()
+        pending = list(callees[start_quad])
+        while len(pending) > 0:
+            callee = pending.pop()
+            if callee == start_quad or callee not in callees:
+                return True
+            if callee not in seen:
+                seen.add(callee)
+                pending += callees[callee]
+        return False
+
+    def candidate_for(self, name):
+        start_quad = self.table.lookup(name).entity.start_quad
+        candidate = self.candidates.get(start_quad)
+        if candidate is None or len(candidate.quads) > self.budget or \
+                self.is_recursive(start_quad):
+            return None
+
+        for name, lookup_res in candidate.nonlocals.items():
+            here = self.table.lookup(name)
+            if here is None or here.entity is not lookup_res.entity:
+                return None
+        return candidate
+
+    def inline_calls(self, quads):
+        ret = []
+        par_quads = []
+        for quad in quads:
+            if quad.op == 'par':
+                par_quads.append(quad)
+                continue
+
+            if quad.op == 'call':
+                candidate = self.candidate_for(quad.term0)
+                if candidate is not None:
+                    ret += self.expand(candidate, par_quads, quad)
+                    self.inlined_calls += 1
+                else:
+                    ret += par_quads + [quad]
+                par_quads = []
+                continue
+
+            ret.append(quad)
+        return ret
+
+    def expand(self, candidate, par_quads, call_quad):
+        # the quads of the call become labels (or copies of `in` arguments)
+        # so that jumps to them still land in the right place
+        renames = {}
+        ret = []
+        result = None
+        arguments = iter(candidate.entity.arguments)
+        for quad in par_quads:
+            if quad.term1 == 'ret':
+                result = quad.term0
+                ret.append(Quad(quad.id, 'nop', '_', '_', '_'))
+            elif quad.term1 == 'ref':
+                renames[next(arguments).name] = quad.term0
+                ret.append(Quad(quad.id, 'nop', '_', '_', '_'))
+            else:
+                temp = self.quad_gen.newtemp(final=True)
+                renames[next(arguments).name] = temp
+                ret.append(Quad(quad.id, ':=', quad.term0, '_', temp))
+        ret.append(Quad(call_quad.id, 'nop', '_', '_', '_'))
+
+        for name in candidate.locals:
+            if name not in renames:
+                renames[name] = self.quad_gen.newtemp(final=True)
+
+        ids = dict((quad_id, '%s_%s' % (call_quad.id, quad_id))
+                   for quad_id in [quad.id for quad in candidate.quads] +
+                   [candidate.end])
+        end = ids[candidate.end]
+
+        def rename(term):
+            return renames.get(term, term)
+
+        for quad in candidate.quads:
+            if quad.op == 'retv':
+                ret += [
+                    Quad(ids[quad.id], ':=', rename(quad.term0), '_', result),
+                    Quad('%sr' % ids[quad.id], 'jump', '_', '_', end)
+                ]
+            elif quad.op in JUMP_OPS:
+                ret.append(
+                    Quad(ids[quad.id], quad.op, rename(quad.term0),
+                         rename(quad.term1), ids.get(quad.target,
+                                                     quad.target)))
+            elif quad.op == 'call':
+                ret.append(quad._replace(id=ids[quad.id]))
+            else:
+                ret.append(
+                    Quad(ids[quad.id], quad.op, rename(quad.term0),
+                         rename(quad.term1), rename(quad.target)))
+        return ret + [Quad(end, 'nop', '_', '_', '_')]
+
+
+def remove_dead_code(quads, lo, hi):
+    """Turns the quads between lo and hi that can't be reached, and the jumps
+    to where they would fall through anyway, into nops."""
+    changed = True
+    while changed:
+        changed = False
+        targets = set(quad.target for quad in quads if quad.op in JUMP_OPS)
+        reachable = True
+        for i in range(lo, hi):
+            quad = quads[i]
+            if quad.id in targets:
+                reachable = True
+            if quad.op == 'nop':
+                continue
+            if not reachable or (quad.op == 'jump'
+                                 and falls_through(quads, i)):
+                quads[i] = Quad(quad.id, 'nop', '_', '_', '_')
+                changed = True
+            elif quad.op in ('jump', 'retv'):
+                reachable = False
+
+
+def falls_through(quads, i):
+    # whether the jump only skips labels on its way to its target
+    for quad in quads[i + 1:]:
+        if quad.id == quads[i].target:
+            return True
+        if quad.op != 'nop':
+            return False
+    return False
+
+
+# head, back: the indices of the first quad of a loop and of its jump back
+# test: the index of the comparison of the induction variable that leaves it
+# stay, leave: the targets test has to jump to to stay in or leave the loop
+# trips: how many times the loop jumps back before test leaves it
+Loop = namedtuple('Loop', ['head', 'back', 'test', 'stay', 'leave', 'trips'])
+
+# loops that don't leave after this many iterations are never unrolled
+MAX_TRIP_COUNT = 65536
+
+
+class LoopUnroller:
+    """Unrolls the loops of a block whose number of iterations is known at
+    compile time.
+
+    A loop is a jump back to an earlier quad that nothing else jumps to, with
+    no other loop inside it. Its number of iterations is known when it has an
+    induction variable: a variable of the block that is set to a constant
+    right before the loop, is stepped by a constant exactly once per
+    iteration and is compared with a constant by a test that leaves the
+    loop. Loops whose copies fit in max_quads are unrolled completely. The
+    others are unrolled by factor, after peeling off the iterations that
+    don't make up a whole unrolled one. The tests whose outcome is known
+    become jumps, and the quads they make unreachable become nops."""
+
+    def __init__(self, table, factor, max_quads):
+        self.table = table
+        self.factor = factor
+        self.max_quads = max_quads
+        self.copies = 0
+        self.unrolled_loops = 0
+
+    def unroll_loops(self, quads):
+        tried = set()
+        while True:
+            loop = None
+            for head, back in self.innermost_loops(quads):
+                if quads[back].id not in tried:
+                    tried.add(quads[back].id)
+                    loop = self.analyse_loop(quads, head, back)
+                    if loop is not None:
+                        break
+            if loop is None:
+                return quads
+
+            unrolled, new_back = self.unroll(quads, loop)
+            if unrolled is None:
+                continue
+            tried.add(new_back)
+            quads = quads[:loop.head] + unrolled + quads[loop.back + 1:]
+            remove_dead_code(quads, loop.head, loop.head + len(unrolled))
+            self.unrolled_loops += 1
+
+    def innermost_loops(self, quads):
+        index = dict((quad.id, i) for i, quad in enumerate(quads))
+        backs = [(index[quad.target], i) for i, quad in enumerate(quads)
+                 if quad.op in JUMP_OPS and index.get(quad.target, i + 1) <= i]
+        return [(head, back) for head, back in backs if quads[back].op ==
+                'jump' and not any(head <= other_head and other_back < back
+                                   for other_head, other_back in backs)]
+
+    def analyse_loop(self, quads, head, back):
+        index = dict((quad.id, i) for i, quad in enumerate(quads))
+        region = range(head, back + 1)
+        for i, quad in enumerate(quads):
+            if quad.op not in JUMP_OPS:
+                continue
+            target = index.get(quad.target)
+            if target == head and i != back or \
+                    target in region and i not in region:
+                return None
+
+        for test in region:
+            quad = quads[test]
+            if quad.op not in RELOPS:
+                continue
+            if is_variable(quad.term0) and not is_variable(quad.term1):
+                var = quad.term0
+            elif is_variable(quad.term1) and not is_variable(quad.term0):
+                var = quad.term1
+            else:
+                continue
+
+            # the copies stop at the test of the last iteration, so leaving
+            # has to go straight out of the loop
+            targets = [
+                self.chase(quads, index, region, back, target)
+                for target in (quad.target, quads[test + 1].id)
+            ]
+            stays = [index.get(target) in region for target in targets]
+            if stays[0] == stays[1]:
+                continue
+            stay, leave = (quad.target, targets[1]) if stays[0] else \
+                (quads[test + 1].id, targets[0])
+
+            induction = self.induction(quads, head, back, var)
+            if induction is None:
+                continue
+            update, start, step = induction
+            if not all(
+                    self.runs_every_iteration(quads, index, head, back, i)
+                    for i in (test, update)):
+                continue
+
+            trips = self.trip_count(quad, var, start if test < update else
+                                    start + step, step, stays[0])
+            if trips is not None:
+                return Loop(head, back, test, stay, leave, trips)
+        return None
+
+    def chase(self, quads, index, region, back, target):
+        # follows the jumps that go on to another quad of the same iteration
+        i = index.get(target)
+        while i in region and i != back and quads[i].op == 'jump':
+            target = quads[i].target
+            i = index.get(target)
+        return target
+
+    def induction(self, quads, head, back, var):
+        lookup_res = self.table.lookup(var)
+        if lookup_res is None or lookup_res.nesting_level != \
+                self.table.get_current_nesting_level():
+            return None
+        entity = lookup_res.entity
+        if not isinstance(entity, VariableEntity) and not (
+                isinstance(entity, ParameterEntity) and entity.mode == 'cv'):
+            return None
+
+        # a subprogram nested in this block may change var behind our back
+        if any(quad.op == 'call' for quad in quads[head:back + 1]) and any(
+                isinstance(entity, FunctionEntity)
+                for entity in self.table.scopes[-1].entities):
+            return None
+
+        updates = [
+            i for i in range(head, back + 1) if var in quad_defs(quads[i])
+        ]
+        if len(updates) != 1 or updates[0] == head:
+            return None
+        update = updates[0]
+        step_quad, assign = quads[update - 1], quads[update]
+        if assign.op != ':=' or assign.term0 != step_quad.target:
+            return None
+        if step_quad.op == '+' and step_quad.term0 == var and \
+                not is_variable(step_quad.term1):
+            step = int(step_quad.term1)
+        elif step_quad.op == '+' and step_quad.term1 == var and \
+                not is_variable(step_quad.term0):
+            step = int(step_quad.term0)
+        elif step_quad.op == '-' and step_quad.term0 == var and \
+                not is_variable(step_quad.term1):
+            step = -int(step_quad.term1)
+        else:
+            return None
+
+        # the value var has when the loop is entered
+        targets = set(quad.target for quad in quads if quad.op in JUMP_OPS)
+        for i in range(head - 1, 0, -1):
+            quad = quads[i]
+            if var in quad_defs(quad):
+                if quad.op == ':=' and not is_variable(quad.term0):
+                    return update, int(quad.term0), step
+                return None
+            if quad.id in targets or quad.op in JUMP_OPS or \
+                    quad.op in ('call', 'jtable', 'retv'):
+                return None
+        return None
+
+    def runs_every_iteration(self, quads, index, head, back, i):
+        for source in range(head, i):
+            if quads[source].op in JUMP_OPS and \
+                    i < index.get(quads[source].target, head) <= back:
+                return False
+        return True
+
+    def trip_count(self, test, var, value, step, stays_when_true):
+        if step == 0:
+            return None
+        for trips in range(MAX_TRIP_COUNT):
+            a, b = (value, int(test.term1)) if test.term0 == var else \
+                (int(test.term0), value)
+            if RELOP_FUNCTIONS[test.op](a, b) != stays_when_true:
+                return trips
+            value += step
+        return None
+
+    def unroll(self, quads, loop):
+        body = quads[loop.head:loop.back + 1]
+        until_test = loop.test - loop.head + 1
+        if loop.trips * len(body) + until_test <= self.max_quads:
+            copies = [('stay', 'next')] * loop.trips + [('leave', None)]
+            first_in_loop = None
+        else:
+            factor = self.factor
+            while factor > 1 and (loop.trips % factor + factor) * len(body) > \
+                    self.max_quads:
+                factor -= 1
+            if factor < 2 or loop.trips < factor:
+                return None, None
+            copies = [('stay', 'next')] * (loop.trips % factor) + \
+                [(None, 'next')] + [('stay', 'next')] * (factor - 2) + \
+                [('stay', 'loop')]
+            first_in_loop = loop.trips % factor
+
+        numbers = [self.copies + n for n in range(len(copies))]
+        self.copies += len(copies)
+        head_id, back_id = body[0].id, body[-1].id
+
+        ret = [Quad(head_id, 'nop', '_', '_', '_')]
+        for n, (test, jump_back) in enumerate(copies):
+            ids = dict((quad.id, '%s_u%d' % (quad.id, numbers[n]))
+                       for quad in body)
+            if jump_back == 'next':
+                ids[head_id] = '%s_u%d' % (head_id, numbers[n + 1])
+            elif jump_back == 'loop':
+                ids[head_id] = '%s_u%d' % (head_id, numbers[first_in_loop])
+
+            for i, quad in enumerate(body):
+                if i == until_test and jump_back is None:
+                    break
+                new_id = '%s_u%d' % (quad.id, numbers[n])
+                if i == loop.test - loop.head and test is not None:
+                    target = loop.stay if test == 'stay' else loop.leave
+                    ret.append(
+                        Quad(new_id, 'jump', '_', '_', ids.get(target,
+                                                               target)))
+                elif quad.op in JUMP_OPS:
+                    ret.append(
+                        quad._replace(id=new_id,
+                                      target=ids.get(quad.target,
+                                                     quad.target)))
+                else:
+                    ret.append(quad._replace(id=new_id))
+        return ret, '%s_u%d' % (back_id, numbers[-1])
+
+
+# quads: the body of a generated subprogram, after its own calls were
+#   specialised
+# end: the id of its end_block quad
+# scopes: a copy of the scopes it was generated in
+SpecializationCandidate = namedtuple('SpecializationCandidate',
+                                     ['entity', 'quads', 'end', 'scopes'])
+
+# label: the label of its code, which calls to it jump to
+# name: the name of the subprogram and the literals it is specialised for
+# start_quad: the start_quad of the subprogram it is a copy of
+Clone = namedtuple('Clone',
+                   ['label', 'name', 'start_quad', 'quads', 'end', 'scopes'])
+
+# results of folded arithmetic that don't fit in a register are left alone
+MIN_INT = -2**31
+MAX_INT = 2**31 - 1
+
+
+class Specializer:
+    """Redirects calls that pass literals as `in` arguments to a copy of the
+    callee specialised for them.
+
+    Like the Inliner, it can only copy subprograms that are complete by the
+    time the call is generated. A copy is made once per callee and tuple of
+    literals, up to max_clones copies in all, and only if propagating the
+    literals folds some arithmetic or comparison in it. Parameters the callee
+    or a subprogram nested in it assigns are never specialised, nor are
+    subprograms that call themselves, as their tail calls may loop back into
+    the copy. The arguments are still passed, so subprograms nested in the
+    callee find them where they expect to."""
+
+    def __init__(self, table, max_clones):
+        self.table = table
+        self.max_clones = max_clones
+        self.candidates = {}
+        # start_quad: the names the subprogram, or one nested in it, assigns
+        # or passes by reference
+        self.writes = {}
+        # (start_quad, literals): the label of its clone, None if not worth one
+        self.clones = {}
+        self.pending = []
+
+    def cloned(self):
+        return len([label for label in self.clones.values() if label])
+
+    def record(self, start_quad, quads, end):
+        writes = set(sum([quad_defs(quad) for quad in quads], []))
+        for entity in self.table.scopes[-1].entities:
+            if isinstance(entity, FunctionEntity):
+                writes.update(self.writes.get(entity.start_quad, ()))
+        self.writes[start_quad] = writes
+
+        if self.table.get_current_nesting_level() == 0:
+            return
+
+        entity = self.table.get_cause_of_birth()
+        if any(quad.op == 'call' and self.table.lookup(quad.term0).entity is
+               entity for quad in quads):
+            return
+
+        self.candidates[start_quad] = SpecializationCandidate(
+            entity=entity,
+            quads=quads,
+            end=end,
+            scopes=[
+                Scope(scope.nesting_level, list(scope.entities))
+                for scope in self.table.scopes
+            ])
+
+    def specialize_calls(self, quads):
+        ret = []
+        par_quads = []
+        for quad in quads:
+            if quad.op == 'par':
+                par_quads.append(quad)
+                continue
+
+            if quad.op == 'call':
+                label = self.clone_for(quad.term0, par_quads)
+                if label is not None:
+                    quad = quad._replace(target=label)
+                ret += par_quads + [quad]
+                par_quads = []
+                continue
+
+            ret.append(quad)
+        return ret
+
+    def clone_for(self, name, par_quads):
+        entity = self.table.lookup(name).entity
+        candidate = self.candidates.get(entity.start_quad)
+        if candidate is None or candidate.entity is not entity:
+            return None
+
+        assigned = self.writes[entity.start_quad]
+        literals = {}
+        for quad, arg in zip(
+            [quad for quad in par_quads if quad.term1 != 'ret'],
+                entity.arguments):
+            if quad.term1 == 'cv' and not is_variable(quad.term0) and \
+                    arg.name not in assigned:
+                literals[arg.name] = int(quad.term0)
+        if len(literals) == 0:
+            return None
+
+        key = (entity.start_quad, tuple(sorted(literals.items())))
+        if key not in self.clones:
+            self.clones[key] = None
+            if self.cloned() < self.max_clones:
+                self.clones[key] = self.make_clone(candidate, literals)
+        return self.clones[key]
+
+    def make_clone(self, candidate, literals):
+        quads = self.propagate(candidate, literals)
+        if quads is None:
+            return None
+
+        number = self.cloned()
+        label = 'S_%s_%d' % (candidate.entity.start_quad, number)
+        ids = dict((quad_id, '%s_s%d' % (quad_id, number))
+                   for quad_id in [quad.id for quad in quads] +
+                   [candidate.end])
+        renamed = []
+        for quad in quads:
+            if quad.op == 'begin_block':
+                quad = quad._replace(term0=label)
+            elif quad.op in JUMP_OPS:
+                quad = quad._replace(target=ids.get(quad.target, quad.target))
+            renamed.append(quad._replace(id=ids[quad.id]))
+
+        self.pending.append(
+            Clone(label=label,
+                  name='%s(%s)' % (candidate.entity.name, ', '.join(
+                      '%s=%d' % (name, value)
+                      for name, value in sorted(literals.items()))),
+                  start_quad=candidate.entity.start_quad,
+                  quads=renamed,
+                  end=ids[candidate.end],
+                  scopes=candidate.scopes))
+        return label
+
+    def propagate(self, candidate, literals):
+        """Returns the quads of candidate with literals in place of the
+        parameters, after folding what can be folded, or None if nothing
+        could."""
+        defs = defaultdict(int)
+        for quad in candidate.quads:
+            for name in quad_defs(quad):
+                defs[name] += 1
+
+        constants = dict(literals)
+        quads = list(candidate.quads)
+        folded = 0
+        changed = True
+        while changed:
+            changed = False
+            for i, quad in enumerate(quads):
+                new_quad = self.fold(self.substitute(quad, constants))
+                if new_quad.op == ':=' and not is_variable(new_quad.term0) \
+                        and defs[new_quad.target] == 1 and isinstance(
+                            self.table.lookup(new_quad.target,
+                                              candidate.scopes).entity,
+                            TempVariableEntity):
+                    # a temporary that always holds the same literal
+                    constants[new_quad.target] = int(new_quad.term0)
+                    new_quad = Quad(quad.id, 'nop', '_', '_', '_')
+                if new_quad != quad:
+                    if new_quad.op != quad.op and quad.op in (ARITHMETIC_OPS +
+                                                              RELOPS):
+                        folded += 1
+                    quads[i] = new_quad
+                    changed = True
+
+        if folded == 0:
+            return None
+        remove_dead_code(quads, 0, len(quads))
+        return quads
+
+    def substitute(self, quad, constants):
+        def value(term):
+            return str(constants[term]) if term in constants else term
+
+        if quad.op in ARITHMETIC_OPS or quad.op in RELOPS:
+            return quad._replace(term0=value(quad.term0),
+                                 term1=value(quad.term1))
+        if quad.op in (':=', 'retv', 'out', 'jtable') or (quad.op == 'par' and
+                                                          quad.term1 == 'cv'):
+            return quad._replace(term0=value(quad.term0))
+        return quad
+
+    def fold(self, quad):
+        if quad.op not in ARITHMETIC_OPS + RELOPS or \
+                is_variable(quad.term0) or is_variable(quad.term1):
+            return quad
+        a, b = int(quad.term0), int(quad.term1)
+
+        if quad.op in RELOPS:
+            if RELOP_FUNCTIONS[quad.op](a, b):
+                return Quad(quad.id, 'jump', '_', '_', quad.target)
+            return Quad(quad.id, 'nop', '_', '_', '_')
+
+        if quad.op == '/':
+            if b == 0:
+                return quad
+            result = divide(a, b)
+        else:
+            result = ARITHMETIC_FUNCTIONS[quad.op](a, b)
+        if not MIN_INT <= result <= MAX_INT:
+            return quad
+        return Quad(quad.id, ':=', str(result), '_', quad.target)
+
+
+def write_asm(sink, lines):
+    for line in lines:
+        sink.write(('%s\n' if line.endswith(':') else '\t%s\n') % line)
+
+
+class FinalGen:
+    def __init__(self, table, quad_gen=None, options=None, sink=None):
+        self.table = table
+        self.quad_gen = quad_gen
+        self.options = options if options is not None else CompileOptions()
+        # a file-like the code is written to as each block ends, instead of
+        # being kept for formatted()
+        self.sink = sink
+        if sink is not None and self.options.eliminate_dead_subprograms:
+            raise ValueError('dead subprograms can only be eliminated once '
+                             'the whole program is generated')
+        self.generated = []
+        self.data = []
+        self.frame_info = {}
+        self.current_frame = None
+        self.current_frame_length = None
+        # label of a specialised copy: its frame length
+        self.clone_frame_lengths = {}
+        self.call_graph = CallGraph()
+        # start_quad: the ranges of generated and data made by its block,
+        # which are meaningless once the sink has them
+        self.spans = {}
+        # start_quad: whether the subprogram has no effects besides its result
+        # and its result only depends on its arguments
+        self.pure = {}
+        self.memo = None
+        self.scheduler = MipsScheduler(
+            self.options.latency_model) if self.options.schedule else None
+        self.inliner = Inliner(
+            table, quad_gen, self.call_graph,
+            self.options.inline_budget) if self.options.inline_budget else None
+        self.unroller = LoopUnroller(
+            table, self.options.unroll_factor, self.options.unroll_max_quads
+        ) if self.options.unroll_factor else None
+        self.specializer = Specializer(
+            table,
+            self.options.max_clones) if self.options.max_clones else None
+
+    def uses_registers(self):
+        return self.options.calling_convention == 'registers'
+
+    def reg(self, reg):
+        return reg if isinstance(reg, str) else '$t%s' % reg
+
+    def gnlvcode(self, var):
+        ret = []
+        ret.append('lw $t0, -4($sp)')
+        lookup_res = self.table.lookup(var)
+
+        for i in range(self.table.get_current_nesting_level() -
+                       lookup_res.nesting_level - 1):
+            ret.append('lw $t0, -4($t0)')
+
+        ret.append('add $t0, $t0, -%d' % lookup_res.entity.offset)
+        return ret
+
+    def store_load_rv(self, reg, var, lookup_res, func):
+        current_nesting_level = self.table.get_current_nesting_level()
+        if lookup_res.nesting_level == 0:
+            return [
+                '%s %s, -%d($s0)' % (func, self.reg(reg),
+                                     lookup_res.entity.offset)
+            ]
+        elif lookup_res.nesting_level == current_nesting_level:
+            if isinstance(lookup_res.entity, ParameterEntity) and \
+                    lookup_res.entity.mode == 'ref':
+                return [
+                    'lw $t0, -%d($sp)' % lookup_res.entity.offset,
+                    '%s %s, ($t0)' % (func, self.reg(reg))
+                ]
+
+            return [
+                '%s %s, -%d($sp)' % (func, self.reg(reg),
+                                     lookup_res.entity.offset)
+            ]
+        else:
+            gnlvret = self.gnlvcode(var)
+
+            if isinstance(lookup_res.entity, ParameterEntity) and \
+                    lookup_res.entity.mode == 'ref':
+                return gnlvret + [
+                    'lw $t0, ($t0)',
+                    '%s %s, ($t0)' % (func, self.reg(reg))
+                ]
+
+            return gnlvret + ['%s %s, ($t0)' % (func, self.reg(reg))]
+
+    def isconst(self, var):
+        try:
+            int(var)
+            return True
+        except ValueError:
+            return False
+
+    def loadvr(self, var, reg):
+        if self.isconst(var):
+            return ['li %s, %s' % (self.reg(reg), var)]
+
+        lookup_res = self.table.lookup(var)
+        return self.store_load_rv(reg, var, lookup_res, 'lw')
+
+    def storerv(self, reg, var):
+        lookup_res = self.table.lookup(var)
+        return self.store_load_rv(reg, var, lookup_res, 'sw')
+
+    def generate_block(self):
+        current_level = self.table.get_current_nesting_level()
+        if current_level == 0:
+            start_quad = 0
+        else:
+            start_quad = self.table.get_cause_of_birth().start_quad
+        end = self.quad_gen.nextquad()
+
+        quads = self.quad_gen.get_and_mark_quads_from(start_quad)
+        if self.inliner is not None:
+            quads = self.inliner.inline_calls(quads)
+            # the temporaries of the copied bodies make the frame larger
+            self.table.fill_in_framelength_on_callee()
+        if self.unroller is not None:
+            quads = self.unroller.unroll_loops(quads)
+        if self.specializer is not None:
+            quads = self.specializer.specialize_calls(quads)
+            while len(self.specializer.pending) > 0:
+                self.generate_clone(self.specializer.pending.pop(0))
+            self.specializer.record(start_quad, quads, end)
+
+        self.add_to_call_graph(start_quad, quads)
+        if self.inliner is not None:
+            self.inliner.record(start_quad, quads)
+        data_start = len(self.data)
+
+        self.current_frame = self.analyse_frame(quads)
+        if current_level != 0:
+            self.frame_info[start_quad] = self.current_frame
+            self.pure[start_quad] = self.is_pure(quads)
+        self.memo = None
+        if self.options.memoize and self.should_memoize(start_quad, quads):
+            self.memo = self.create_memo_table(start_quad)
+        if self.options.tail_calls and current_level != 0:
+            quads = self.eliminate_tail_calls(quads, end)
+        frame_length = self.lay_out_frame(quads)
+        if current_level != 0:
+            self.table.get_cause_of_birth().frame_length = frame_length
+        self.emit_block(start_quad, quads, end, data_start)
+        self.flush()
+
+    def generate_clone(self, clone):
+        """Generates the code of a specialised copy of a subprogram in the
+        scopes the original was generated in."""
+        scopes = self.table.scopes
+        self.table.scopes = clone.scopes
+        self.call_graph.add(clone.label, clone.name,
+                            self.call_graph.parents[clone.start_quad],
+                            self.callees(clone.quads))
+        data_start = len(self.data)
+
+        self.current_frame = self.analyse_frame(clone.quads)
+        self.memo = None
+        quads = clone.quads
+        if self.options.tail_calls:
+            quads = self.eliminate_tail_calls(quads, clone.end)
+        self.clone_frame_lengths[clone.label] = self.lay_out_frame(quads)
+        self.emit_block(clone.label, quads, clone.end, data_start)
+        self.table.scopes = scopes
+
+    def lay_out_frame(self, quads):
+        """Returns the frame length of the block about to be emitted, after
+        letting its temporaries share slots. Callees that reuse the frame for
+        a tail call must fit in it."""
+        if self.options.share_stack_slots:
+            self.share_stack_slots(quads)
+        self.current_frame_length = max(
+            [self.table.get_current_framelength()] + [
+                self.frame_length_of(quad) for quad in quads
+                if quad.op == 'call' and quad.term1 == 'tail'
+            ])
+        return self.current_frame_length
+
+    def share_stack_slots(self, quads):
+        """Gives temporaries whose lifetimes don't overlap the same slot, after
+        the ones of the parameters and variables. Temporaries that no quad
+        uses get no slot."""
+        entities = self.table.scopes[-1].entities
+        # results of function calls are received in `ret` parameters
+        temps = [
+            entity for entity in entities
+            if isinstance(entity, TempVariableEntity) or (
+                isinstance(entity, ParameterEntity) and entity.mode == 'ret')
+        ]
+        # the memo table code uses these outside of any quad
+        fixed = [] if self.memo is None else self.memo.keys + [self.memo.entry]
+        interference = self.interference(
+            quads, set(temp.name for temp in temps))
+
+        base = max([8] + [
+            entity.offset for entity in entities
+            if entity.is_a_variable() and entity.offset is not None and
+            not any(entity is temp for temp in temps)
+        ]) + 4
+        colors = {}
+        for temp in temps:
+            if temp.name in fixed:
+                colors[temp.name] = len(colors)
+        for temp in temps:
+            if temp.name in colors or temp.name not in interference:
+                continue
+            taken = set(colors.get(name) for name in interference[temp.name])
+            taken.update(colors[name] for name in fixed)
+            color = 0
+            while color in taken:
+                color += 1
+            colors[temp.name] = color
+
+        for temp in temps:
+            temp.offset = base + 4 * colors[temp.name] \
+                if temp.name in colors else None
+
+    def interference(self, quads, temps):
+        """Returns the temporaries the quads use, each with the ones that are
+        live whenever it is written."""
+        index = dict((quad.id, i) for i, quad in enumerate(quads))
+        successors = []
+        for i, quad in enumerate(quads):
+            if quad.op == 'jump':
+                following = [index.get(quad.target)]
+            elif quad.op in RELOPS:
+                following = [i + 1, index.get(quad.target)]
+            elif quad.op == 'jtable':
+                following = []
+                for target in quads[i + 1:]:
+                    if target.op != 'jtarget':
+                        break
+                    following.append(index.get(target.target))
+            elif quad.op in ('retv', 'jtarget') or (quad.op == 'call' and
+                                                    quad.term1 == 'tail'):
+                following = []
+            else:
+                following = [i + 1]
+            successors.append([
+                successor for successor in following
+                if successor is not None and successor < len(quads)
+            ])
+
+        uses = [set(quad_uses(quad)) & temps for quad in quads]
+        defs = [set(quad_defs(quad)) & temps for quad in quads]
+        live_in = [set() for quad in quads]
+        live_out = [set() for quad in quads]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(quads) - 1, -1, -1):
+                out = set().union(*[live_in[j] for j in successors[i]])
+                new_in = uses[i] | (out - defs[i])
+                if out != live_out[i] or new_in != live_in[i]:
+                    live_out[i], live_in[i] = out, new_in
+                    changed = True
+
+        interference = dict(
+            (name, set()) for name in set().union(*(uses + defs)))
+        for i in range(len(quads)):
+            for name in defs[i]:
+                for other in live_out[i] | defs[i]:
+                    if other != name:
+                        interference[name].add(other)
+                        interference[other].add(name)
+        return interference
+
+    def frame_length_of(self, call_quad):
+        if call_quad.target != '_':
+            return self.clone_frame_lengths[call_quad.target]
+        return self.table.lookup(call_quad.term0).entity.frame_length
+
+    def emit_block(self, key, quads, end, data_start):
+        code = []
+        par_quads = []
+        for i, quad in enumerate(quads):
+            if quad.op == 'par':
+                par_quads += [quad]
+            elif quad.op == 'call' and quad.term1 == 'tail':
+                code += self.tail_call_sequence(par_quads, quad)
+                par_quads = []
+            elif quad.op == 'call':
+                code += self.call_sequence(par_quads, quad)
+                par_quads = []
+            else:
+                code += self.translate_quad(quad)
+            if quad.op == 'begin_block' and self.memo is not None:
+                code += self.memo_lookup()
+
+        if self.table.get_current_nesting_level() != 0:
+            code += ['L_%s:' % end] + self.jump_to_ra()
+
+        if self.scheduler is not None:
+            table_targets = [
+                'L_%s' % quad.target for quad in quads if quad.op == 'jtarget'
+            ]
+            code = self.scheduler.schedule(
+                code, keep_labels=['L_%s' % quads[0].id] + table_targets)
+        self.spans[key] = ((len(self.generated),
+                            len(self.generated) + len(code)),
+                           (data_start, len(self.data)))
+        self.generated += code
+
+    def is_pure(self, quads):
+        current_level = self.table.get_current_nesting_level()
+        entity = self.table.get_cause_of_birth()
+        if any(arg.mode != 'cv' for arg in entity.arguments):
+            return False
+
+        for quad in quads:
+            if quad.op in ('out', 'inp'):
+                return False
+            if quad.op == 'call':
+                callee = self.table.lookup(quad.term0).entity
+                if callee is not entity and \
+                        not self.pure.get(callee.start_quad, False):
+                    return False
+            for var in quad_uses(quad) + quad_defs(quad):
+                if self.table.lookup(var).nesting_level != current_level:
+                    return False
+        return True
+
+    def should_memoize(self, start_quad, quads):
+        if self.table.get_current_nesting_level() == 0:
+            return False
+        entity = self.table.get_cause_of_birth()
+        return entity.is_a_function() and self.pure[start_quad] and any(
+            quad.op == 'call'
+            and self.table.lookup(quad.term0).entity is entity
+            for quad in quads)
+
+    def create_memo_table(self, start_quad):
+        params = [
+            arg.name for arg in self.table.get_cause_of_birth().arguments
+        ]
+        memo = MemoTable(
+            label='M_%s' % start_quad,
+            params=params,
+            keys=[self.quad_gen.newtemp(final=True) for param in params],
+            entry=self.quad_gen.newtemp(final=True))
+        # the new temporaries make the frame larger
+        self.table.fill_in_framelength_on_callee()
+
+        self.data += [
+            '%s:' % memo.label,
+            '.space %d' % (self.options.memo_size * 4 * (len(params) + 2))
+        ]
+        return memo
+
+    def memo_entry_size(self):
+        return 4 * (len(self.memo.params) + 2)
+
+    def memo_lookup(self):
+        """Returns straight from the prologue if the memo table has the
+        result for the arguments. The table is direct-mapped: the arguments
+        are hashed to pick the only entry they can be in, and a new result
+        replaces whatever was there."""
+        miss = 'L_%s_miss' % self.memo.label
+        ret = ['li $t1, 0']
+        for param, key in zip(self.memo.params, self.memo.keys):
+            ret += self.loadvr(param, 2) + self.storerv(2, key) + [
+                'mul $t1, $t1, %d' % MEMO_HASH_MULTIPLIER,
+                'add $t1, $t1, $t2'
+            ]
+        ret += [
+            'and $t1, $t1, %d' % (self.options.memo_size - 1),
+            'mul $t1, $t1, %d' % self.memo_entry_size(),
+            'la $t2, %s' % self.memo.label, 'add $t1, $t1, $t2'
+        ] + self.storerv(1, self.memo.entry) + [
+            'lw $t2, ($t1)',
+            'beq $t2, $zero, %s' % miss
+        ]
+        for i, key in enumerate(self.memo.keys):
+            ret += ['lw $t2, %d($t1)' % (4 + 4 * i)] + self.loadvr(key, 3) + [
+                'bne $t2, $t3, %s' % miss
+            ]
+
+        ret += ['lw $t1, %d($t1)' % (4 + 4 * len(self.memo.keys))]
+        if self.uses_registers():
+            ret += ['move $v0, $t1']
+        else:
+            ret += ['lw $t0, -8($sp)', 'sw $t1, ($t0)']
+        return ret + self.jump_to_ra() + ['%s:' % miss]
+
+    def memo_store(self, var):
+        ret = self.loadvr(self.memo.entry, 1) + self.loadvr(var, 2) + [
+            'sw $t2, %d($t1)' % (4 + 4 * len(self.memo.keys))
+        ]
+        for i, key in enumerate(self.memo.keys):
+            ret += self.loadvr(key, 2) + ['sw $t2, %d($t1)' % (4 + 4 * i)]
+        return ret + ['li $t2, 1', 'sw $t2, ($t1)']
+
+    def eliminate_tail_calls(self, quads, end):
+        """Rewrites the calls whose result (if any) is returned right away.
+        Calls to the subprogram itself become assignments to its parameters
+        and a jump back to the start of its body. Calls to others are marked
+        with 'tail' in term1 and reuse the frame when it is safe to."""
+        entity = self.table.get_cause_of_birth()
+        targets = set(quad.target for quad in quads if quad.op in JUMP_OPS)
+        ret = []
+        returns = set()
+        for i, quad in enumerate(quads):
+            if quad.id in returns:
+                ret.append(Quad(quad.id, 'nop', '_', '_', '_'))
+                continue
+            if quad.op != 'call':
+                ret.append(quad)
+                continue
+
+            par_quads = []
+            while len(ret) > 0 and ret[-1].op == 'par':
+                par_quads.insert(0, ret.pop())
+            ret_pars = [par for par in par_quads if par.term1 == 'ret']
+            args = [par for par in par_quads if par.term1 != 'ret']
+            following = quads[i + 1] if i + 1 < len(quads) else None
+
+            if len(ret_pars) > 0:
+                is_tail = following is not None and \
+                    following.op == 'retv' and \
+                    following.term0 == ret_pars[0].term0 and \
+                    following.id not in targets
+            else:
+                # a procedure also returns when it jumps to its end
+                is_tail = following is None or \
+                    (following.op == 'jump' and following.target == end)
+
+            lookup_res = self.table.lookup(quad.term0)
+            if is_tail and lookup_res.entity is entity and \
+                    self.can_loop(entity, args):
+                ret += [
+                    Quad(par.id, 'nop', '_', '_', '_') for par in par_quads
+                ]
+                ret += self.tail_loop(entity, args, quad,
+                                      self.body_start(quads))
+            elif is_tail and self.can_reuse_frame(quad, lookup_res, args):
+                ret += [par for par in args] + [
+                    Quad(par.id, 'nop', '_', '_', '_') for par in ret_pars
+                ] + [quad._replace(term1='tail')]
+            else:
+                ret += par_quads + [quad]
+                continue
+
+            if following is not None and following.op == 'retv':
+                returns.add(following.id)
+        return ret
+
+    def body_start(self, quads):
+        # the end_block quads of nested subprograms come right after the
+        # begin_block, and translate to no code to jump to
+        return [
+            quad.id for quad in quads[1:] if quad.op != 'end_block'
+        ][0]
+
+    def can_loop(self, entity, args):
+        # an inout argument can only stay what it is
+        return all(
+            par.term1 == 'cv' or par.term0 == arg.name
+            for par, arg in zip(args, entity.arguments))
+
+    def tail_loop(self, entity, args, call_quad, body_start):
+        moves = [(arg.name, par.term0)
+                 for par, arg in zip(args, entity.arguments)
+                 if par.term1 == 'cv' and par.term0 != arg.name]
+        assigned = [name for name, value in moves]
+
+        # arguments that are parameters are read before any is assigned
+        staged = []
+        assignments = []
+        for name, value in moves:
+            if value in assigned:
+                temp = self.quad_gen.newtemp(final=True)
+                staged.append((':=', value, temp))
+                value = temp
+            assignments.append((':=', value, name))
+        if len(staged) > 0:
+            self.table.fill_in_framelength_on_callee()
+
+        ret = [Quad(call_quad.id, 'nop', '_', '_', '_')]
+        for i, (op, value, name) in enumerate(staged + assignments):
+            ret.append(Quad('%s_%s' % (call_quad.id, i), op, value, '_', name))
+        return ret + [
+            Quad('%s_%s' % (call_quad.id, len(ret) - 1), 'jump', '_', '_',
+                 body_start)
+        ]
+
+    def can_reuse_frame(self, call_quad, lookup_res, args):
+        # the callee must be complete, must not need our frame for its static
+        # link or its inout arguments, and must fit in our frame
+        current_level = self.table.get_current_nesting_level()
+        frame_length = self.frame_length_of(call_quad)
+        if frame_length is None or \
+                lookup_res.nesting_level == current_level or \
+                frame_length > \
+                self.table.get_cause_of_birth().frame_length or \
+                len(args) > len(TAIL_CALL_REGISTERS):
+            return False
+
+        for par in args:
+            if par.term1 != 'ref':
+                continue
+            var = self.table.lookup(par.term0)
+            if var.nesting_level == current_level and not (
+                    isinstance(var.entity, ParameterEntity)
+                    and var.entity.mode == 'ref'):
+                return False
+        return True
+
+    def tail_call_sequence(self, par_quads, call_quad):
+        """Replaces our frame with the callee's: it is set up where ours is,
+        so it returns straight to our caller with the return address (and,
+        with the stack convention, the return value pointer) we were given."""
+        ret = ['L_%s:' % quad.id for quad in par_quads + [call_quad]]
+
+        # every argument is read before our frame starts being overwritten
+        for quad, reg in zip(par_quads, TAIL_CALL_REGISTERS):
+            if quad.term1 == 'cv':
+                ret += self.loadvr(quad.term0, reg)
+            else:
+                ret += self.address_of(quad.term0) + ['move %s, $t0' % reg]
+
+        ret += ['move $fp, $sp'] + self.init_call(call_quad.term0)
+        cv_index = 0
+        for i, (quad, reg) in enumerate(zip(par_quads, TAIL_CALL_REGISTERS)):
+            if quad.term1 == 'cv' and self.uses_registers() and \
+                    cv_index < len(ARGUMENT_REGISTERS):
+                ret += ['move %s, %s' % (ARGUMENT_REGISTERS[cv_index], reg)]
+            else:
+                ret += ['sw %s, -%s($fp)' % (reg, 12 + 4 * i)]
+            if quad.term1 == 'cv':
+                cv_index += 1
+
+        if self.saves_return_address():
+            ret += ['lw $ra, ($sp)']
+        return ret + [
+            'add $sp, $sp, -%s' % self.frame_length_of(call_quad),
+            'j %s' % self.callee_label(call_quad)
+        ]
+
+    def add_to_call_graph(self, start_quad, quads):
+        scopes = self.table.scopes
+        if len(scopes) == 1:
+            name, parent = quads[0].term0, None
+        else:
+            name = self.table.get_cause_of_birth().name
+            parent = scopes[-3].entities[-1].start_quad if len(
+                scopes) > 2 else 0
+
+        self.call_graph.add(start_quad, name, parent, self.callees(quads))
+
+    def callees(self, quads):
+        return [
+            quad.target if quad.target != '_' else
+            self.table.lookup(quad.term0).entity.start_quad for quad in quads
+            if quad.op == 'call'
+        ]
+
+    def callee_label(self, call_quad):
+        # calls to specialised copies name the copy in their target
+        return call_quad.target if call_quad.target != '_' else \
+            call_quad.term0
+
+    def live_code(self):
+        """Returns generated and data without the code of the subprograms
+        the main program can never call."""
+        if not self.options.eliminate_dead_subprograms:
+            return self.generated, self.data
+
+        dead_code = set()
+        dead_data = set()
+        for start_quad in self.call_graph.unreachable():
+            code_span, data_span = self.spans[start_quad]
+            dead_code.update(range(*code_span))
+            dead_data.update(range(*data_span))
+        return [
+            line for i, line in enumerate(self.generated) if i not in dead_code
+        ], [line for i, line in enumerate(self.data) if i not in dead_data]
+
+    def analyse_frame(self, quads):
+        current_level = self.table.get_current_nesting_level()
+        reached = []
+
+        for entity in self.table.scopes[-1].entities:
+            if isinstance(entity, FunctionEntity):
+                child = self.frame_info.get(entity.start_quad)
+                if child is not None and child.reach is not None and \
+                        child.reach < current_level:
+                    reached.append(child.reach)
+
+        for quad in quads:
+            if quad.op == 'call':
+                lookup_res = self.table.lookup(quad.term0)
+                if lookup_res.nesting_level == current_level or \
+                        lookup_res.entity is self.table.get_cause_of_birth():
+                    continue
+
+                # subprograms that haven't been analysed yet (the ones we are
+                # nested in) are assumed to need their static link
+                callee = self.frame_info.get(lookup_res.entity.start_quad)
+                if callee is None or callee.reach is not None:
+                    reached.append(lookup_res.nesting_level)
+            else:
+                for var in quad_uses(quad) + quad_defs(quad):
+                    reached.append(self.table.lookup(var).nesting_level)
+
+        reached = [level for level in reached if 0 < level < current_level]
+        return FrameInfo(
+            is_leaf=not any(self.makes_call(quad) for quad in quads),
+            reach=min(reached) if len(reached) > 0 else None)
+
+    def makes_call(self, quad):
+        return quad.op == 'call' or (self.options.buffered_io
+                                     and quad.op in ('out', 'inp'))
+
+    def saves_return_address(self):
+        if not self.options.trim_frames:
+            return True
+        if self.table.get_current_nesting_level() == 0:
+            return False
+        return self.current_frame is None or not self.current_frame.is_leaf
+
+    def call_sequence(self, par_quads, call_quad):
+        # every label goes first so that jumping to the call lands before $fp
+        # is set up
+        ret = ['L_%s:' % quad.id for quad in par_quads + [call_quad]]
+        ret += self.precall_set_fp(call_quad)
+        ret += self.setup_parameters(par_quads)
+        ret += self.translate_quad(call_quad)
+
+        ret_quads = [quad for quad in par_quads if quad.term1 == 'ret']
+        if self.uses_registers() and len(ret_quads) > 0:
+            ret += self.storerv('$v0', ret_quads[0].term0)
+
+        return ret
+
+    def precall_set_fp(self, call_quad):
+        return ['add $fp, $sp, %s' % self.frame_length_of(call_quad)]
+
+    def jump_to_ra(self):
+        if self.saves_return_address():
+            return ['lw $ra, ($sp)', 'jr $ra']
+        return ['jr $ra']
+
+    def generate_jump_to_main(self):
+        self.generated += ['j L_0']
+
+    def generate_program_exit(self, quad_id):
+        flush = ['jal __eel_flush'] if self.options.buffered_io else []
+        self.generated += ['L_%s:' % quad_id] + flush + [
+            'li $v0, 10', 'syscall'
+        ]
+        if self.options.buffered_io:
+            self.generate_io_runtime()
+        self.flush()
+
+    def generate_io_runtime(self):
+        """Emits the routines used by out and inp quads in buffered mode.
+
+        __eel_print_int appends the decimal text of $a0 and a newline to the
+        output buffer, flushing it first if the text might not fit.
+        __eel_flush writes the output buffer with a single print_string
+        syscall. __eel_read_int returns in $v0 the next integer of the input
+        buffer, refilling it a line at a time with read_string (after a flush,
+        so that prompts are shown). The routines only use $t0-$t9, $a0, $a1
+        and $v0, which the generated code never keeps live across a call."""
+        self.data += [
+            '__eel_out_len:', '.word 0', '__eel_in_next:', '.word 0',
+            '__eel_out_buf:',
+            '.space %d' % IO_BUFFER_SIZE, '__eel_in_buf:',
+            '.space %d' % IO_BUFFER_SIZE
+        ]
+        self.generated += [
+            '__eel_print_int:', 'la $t1, __eel_out_len', 'lw $t0, ($t1)',
+            'ble $t0, %d, __eel_print_int_fits' %
+            (IO_BUFFER_SIZE - MAX_PRINTED_INT_LENGTH), 'move $t7, $a0',
+            'move $t8, $ra', 'jal __eel_flush', 'move $ra, $t8',
+            'move $a0, $t7', 'li $t0, 0', '__eel_print_int_fits:',
+            'la $t1, __eel_out_buf', 'add $t1, $t1, $t0',
+            'bge $a0, $zero, __eel_print_int_digits', 'li $t3, 45',
+            'sb $t3, ($t1)', 'add $t1, $t1, 1', '__eel_print_int_digits:',
+            'move $t2, $a0', 'move $t4, $t1', 'li $t3, 10',
+            '__eel_print_int_digit:', 'rem $t5, $t2, $t3', 'abs $t5, $t5',
+            'div $t2, $t2, $t3', 'add $t5, $t5, 48', 'sb $t5, ($t1)',
+            'add $t1, $t1, 1', 'bne $t2, $zero, __eel_print_int_digit',
+            'add $t6, $t1, -1', '__eel_print_int_reverse:',
+            'bge $t4, $t6, __eel_print_int_newline', 'lb $t3, ($t4)',
+            'lb $t5, ($t6)', 'sb $t5, ($t4)', 'sb $t3, ($t6)',
+            'add $t4, $t4, 1', 'add $t6, $t6, -1',
+            'j __eel_print_int_reverse', '__eel_print_int_newline:',
+            'li $t3, 10', 'sb $t3, ($t1)', 'add $t1, $t1, 1',
+            'la $t3, __eel_out_buf', 'sub $t0, $t1, $t3',
+            'la $t3, __eel_out_len', 'sw $t0, ($t3)', 'jr $ra',
+            '__eel_flush:', 'la $t1, __eel_out_len', 'lw $t0, ($t1)',
+            'beq $t0, $zero, __eel_flush_done', 'la $a0, __eel_out_buf',
+            'add $t2, $a0, $t0', 'sb $zero, ($t2)', 'li $v0, 4', 'syscall',
+            'sw $zero, ($t1)', '__eel_flush_done:', 'jr $ra',
+            '__eel_read_int:', 'la $t1, __eel_in_next', 'lw $t0, ($t1)',
+            'bne $t0, $zero, __eel_read_int_skip', '__eel_read_int_refill:',
+            'move $t8, $ra', 'jal __eel_flush', 'move $ra, $t8',
+            'la $a0, __eel_in_buf', 'li $a1, %d' % IO_BUFFER_SIZE,
+            'li $v0, 8', 'syscall', 'la $t0, __eel_in_buf', 'lb $t2, ($t0)',
+            'bne $t2, $zero, __eel_read_int_skip', 'la $t1, __eel_in_next',
+            'sw $zero, ($t1)', 'li $v0, 0', 'jr $ra', '__eel_read_int_skip:',
+            'lb $t2, ($t0)',
+            'beq $t2, $zero, __eel_read_int_refill',
+            'bgt $t2, 32, __eel_read_int_sign', 'add $t0, $t0, 1',
+            'j __eel_read_int_skip', '__eel_read_int_sign:', 'li $t3, 1',
+            'bne $t2, 45, __eel_read_int_digits', 'li $t3, -1',
+            'add $t0, $t0, 1', '__eel_read_int_digits:', 'li $v0, 0',
+            '__eel_read_int_digit:', 'lb $t2, ($t0)',
+            'blt $t2, 48, __eel_read_int_done',
+            'bgt $t2, 57, __eel_read_int_done', 'mul $v0, $v0, 10',
+            'add $t2, $t2, -48', 'add $v0, $v0, $t2', 'add $t0, $t0, 1',
+            'j __eel_read_int_digit', '__eel_read_int_done:',
+            'mul $v0, $v0, $t3', 'la $t1, __eel_in_next', 'sw $t0, ($t1)',
+            'jr $ra'
+        ]
+
+    def new_scope_setup(self):
+        framelength = self.current_frame_length
+        if self.table.get_current_nesting_level() == 0:
+            main = ['move $s0, $sp']
+        else:
+            main = self.home_arguments()
+
+        save_ra = ['sw $ra, ($sp)'] if self.saves_return_address() else []
+        return ['add $sp, $sp, %s' % framelength] + save_ra + main
+
+    def home_arguments(self):
+        # arguments passed in registers get their stack slot back on entry,
+        # so the body and nested subprograms address them as usual
+        if not self.uses_registers():
+            return []
+
+        ret = []
+        cv_index = 0
+        for i, arg in enumerate(self.table.get_cause_of_birth().arguments):
+            if arg.mode == 'cv' and cv_index < len(ARGUMENT_REGISTERS):
+                ret += [
+                    'sw %s, -%s($sp)' % (ARGUMENT_REGISTERS[cv_index],
+                                         12 + i * 4)
+                ]
+                cv_index += 1
+
+        return ret
+
+    def init_call(self, func_name):
+        lookup_res = self.table.lookup(func_name)
+        callee = self.frame_info.get(lookup_res.entity.start_quad)
+        if self.options.trim_frames and callee is not None and \
+                callee.reach is None:
+            return []
+
+        current_level = self.table.get_current_nesting_level()
+        if current_level == lookup_res.nesting_level:
+            return ['sw $sp, -4($fp)']
+
+        ret = ['lw $t0, -4($sp)']
+        for i in range(current_level - lookup_res.nesting_level - 1):
+            ret.append('lw $t0, -4($t0)')
+
+        return ret + ['sw $t0, -4($fp)']
+
+    def exit_scope(self, call_quad):
+        return ['add $sp, $sp, -%s' % self.frame_length_of(call_quad)]
+
+    def address_of(self, var):
+        caller_nesting_level = self.table.get_current_nesting_level()
+        lookup_res_var = self.table.lookup(var)
+        is_ref = isinstance(lookup_res_var.entity, ParameterEntity) and \
+            lookup_res_var.entity.mode == 'ref'
+        if lookup_res_var.nesting_level == 0:
+            return ['add $t0, $s0, -%s' % lookup_res_var.entity.offset]
+        if caller_nesting_level == lookup_res_var.nesting_level:
+            if is_ref:
+                return ['lw $t0, -%s($sp)' % lookup_res_var.entity.offset]
+            return ['add $t0, $sp, -%s' % lookup_res_var.entity.offset]
+
+        if is_ref:
+            return self.gnlvcode(var) + ['lw $t0, ($t0)']
+        return self.gnlvcode(var)
+
+    def setup_parameters(self, quads):
+        ret = []
+
+        cv_index = 0
+        for i, quad in enumerate(quads):
+            if quad.term1 == 'cv':
+                if self.uses_registers() and \
+                        cv_index < len(ARGUMENT_REGISTERS):
+                    ret += self.loadvr(quad.term0,
+                                       ARGUMENT_REGISTERS[cv_index])
+                else:
+                    ret += self.loadvr(quad.term0, 0)
+                    ret += ['sw $t0, -%s($fp)' % (12 + i * 4)]
+                cv_index += 1
+
+            if quad.term1 == 'ref':
+                ret += self.address_of(quad.term0) + [
+                    'sw $t0, -%s($fp)' % (12 + 4 * i)
+                ]
+
+            if quad.term1 == 'ret' and not self.uses_registers():
+                lookup_res = self.table.lookup(quad.term0)
+                ret += [
+                    'add $t0, $sp, -%s' % lookup_res.entity.offset,
+                    'sw $t0, -8($fp)'
+                ]
+
+        return ret
+
+    def return_value(self, var):
+        if self.uses_registers():
+            return self.loadvr(var, '$v0')
+
+        return self.loadvr(var, 1) + ['lw $t0, -8($sp)', 'sw $t1, ($t0)']
+
+    def translate_quad(self, quad):
+        qid = ['L_%s:' % quad.id]
+
+        if quad.op == 'begin_block':
+            return qid + ['%s:' % quad.term0] + self.new_scope_setup()
+
+        if quad.op == ':=':
+            return qid + self.loadvr(quad.term0, 1) + self.storerv(
+                1, quad.target)
+
+        if quad.op == 'int' or quad.op == 'par' or quad.op == 'nop':
+            return qid + []
+
+        if quad.op == '+':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['add $t1, $t1, $t2'] + self.storerv(
+                    1, quad.target)
+
+        if quad.op == '-':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['sub $t1, $t1, $t2'] + self.storerv(
+                    1, quad.target)
+
+        if quad.op == '*':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['mul $t1, $t1, $t2'] + self.storerv(
+                    1, quad.target)
+
+        if quad.op == '/':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['div $t1, $t1, $t2'] + self.storerv(
+                    1, quad.target)
+
+        if quad.op == 'jump':
+            return qid + ['j L_%s' % quad.target]
+
+        if quad.op == 'jtable':
+            # the jtarget quads that follow make up the table
+            self.data += ['JT_%s:' % quad.id]
+            return qid + self.loadvr(quad.term0, 1) + [
+                'add $t1, $t1, %d' % -int(quad.term1), 'sll $t1, $t1, 2',
+                'la $t2, JT_%s' % quad.id, 'add $t1, $t1, $t2',
+                'lw $t1, ($t1)', 'jr $t1'
+            ]
+
+        if quad.op == 'jtarget':
+            self.data += ['.word L_%s' % quad.target]
+            return []
+
+        if quad.op == '=':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['beq $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == '<>':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['bne $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == '>':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['bgt $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == '<':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['blt $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == '>=':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['bge $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == '<=':
+            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
+                quad.term1, 2) + ['ble $t1, $t2, L_%s' % quad.target]
+
+        if quad.op == 'retv':
+            memo = self.memo_store(
+                quad.term0) if self.memo is not None else []
+            return qid + memo + self.return_value(
+                quad.term0) + self.jump_to_ra()
+
+        if quad.op == 'call':
+            return self.init_call(quad.term0) + [
+                'jal %s' % self.callee_label(quad)
+            ] + self.exit_scope(quad)
+
+        if quad.op == 'end_block':
+            # the label of a subprogram's end_block is emitted by
+            # generate_block, before the final jump to $ra
+            return []
+
+        if quad.op == 'out' and self.options.buffered_io:
+            return qid + self.loadvr(quad.term0, 1) + [
+                'move $a0, $t1', 'jal __eel_print_int'
+            ]
+
+        if quad.op == 'inp' and self.options.buffered_io:
+            return qid + ['jal __eel_read_int', 'move $t3, $v0'
+                          ] + self.storerv(3, quad.term0)
+
+        if quad.op == 'out':
+            return qid + self.loadvr(quad.term0, 1) + [
+                'li $v0, 1', 'move $a0, $t1', 'syscall', 'li $a0, 0xA',
+                'li $v0, 0XB', 'syscall'
+            ]
+
+        if quad.op == 'inp':
+            return qid + ['li $v0, 5', 'syscall', 'move $t3, $v0'
+                          ] + self.storerv(3, quad.term0)
+
+        raise Exception('Unsupported quad type to translate: %s' % str(quad))
+
+    def flush(self):
+        """Writes the code and the data generated since the last flush to
+        the sink, if there is one, and forgets them. Each flush switches to
+        the data section and back for its data."""
+        if self.sink is None:
+            return
+        if len(self.data) > 0:
+            write_asm(self.sink, ['.data'] + self.data + ['.text'])
+        write_asm(self.sink, self.generated)
+        self.generated = []
+        self.data = []
+
+    def formatted(self):
+        lines, data = self.live_code()
+        if len(data) > 0:
+            lines = ['.data'] + data + ['.text'] + lines
+        return '\n'.join('\t%s' % line if not line.endswith(':') else line
+                         for line in lines)
+
+
+MipsInstruction = namedtuple('MipsInstruction',
+                             ['text', 'op', 'operands', 'defs', 'uses'])
+
+MIPS_LOADS = ('lw', 'lb', 'lbu', 'lh', 'lhu')
+MIPS_STORES = ('sw', 'sb', 'sh')
+MIPS_CONTROL = ('j', 'jal', 'jr', 'jalr', 'syscall', 'beq', 'bne', 'bgt',
+                'blt', 'bge', 'ble', 'bgtu', 'bltu', 'bgeu', 'bleu', 'beqz',
+                'bnez', 'bltz', 'bgez', 'blez', 'bgtz')
+SCRATCH_REGISTERS = tuple('$t%d' % i for i in range(10))
+MEMORY_OPERAND = re.compile(r'\A(-?\w*)\((\$\w+)\)\Z')
+REGISTER = re.compile(r'\$\w+')
+
+
+def parse_mips(text):
+    op, _, rest = text.partition(' ')
+    operands = [operand.strip() for operand in rest.split(',')
+                ] if rest.strip() else []
+    regs = [REGISTER.findall(operand) for operand in operands]
+
+    if op == 'syscall':
+        defs, uses = ['$v0'], ['$v0', '$a0', '$a1']
+    elif op == 'jal':
+        defs, uses = ['$ra', '$v0'], ['$a0', '$a1', '$a2', '$a3']
+    elif op in MIPS_STORES or op in MIPS_CONTROL:
+        defs, uses = [], sum(regs, [])
+    else:
+        defs, uses = regs[0] if regs else [], sum(regs[1:], [])
+
+    return MipsInstruction(text, op, operands, defs, uses)
+
+
+class LatencyModel:
+    """Number of cycles after an instruction issues until its result can be
+    used. Subclass and override latency() to model another core."""
+    LATENCIES = {
+        'lw': 2,
+        'lb': 2,
+        'lbu': 2,
+        'lh': 2,
+        'lhu': 2,
+        'mul': 2,
+        'div': 10,
+        'rem': 10
+    }
+
+    def latency(self, instruction):
+        return self.LATENCIES.get(instruction.op, 1)
+
+
+class MipsScheduler:
+    """List scheduler for the straight-line regions of generated MIPS.
+
+    A region ends at a label that is a jump target, at a branch/jump and at a
+    syscall. Scratch registers are renamed inside a region so that the reuse
+    of $t1/$t2 by every quad doesn't serialise everything, then instructions
+    are reordered by critical path to keep loads away from their uses."""
+
+    def __init__(self, latency_model=None):
+        self.latency_model = latency_model if latency_model is not None \
+            else LatencyModel()
+        self.cycles_before = 0
+        self.cycles_after = 0
+
+    def cycles_saved(self):
+        return self.cycles_before - self.cycles_after
+
+    def schedule(self, lines, keep_labels=()):
+        referenced = set(keep_labels)
+        for line in lines:
+            instruction = parse_mips(line)
+            if instruction.op in MIPS_CONTROL and instruction.op != 'jr':
+                referenced.update(instruction.operands[-1:])
+
+        regions = [[]]
+        for line in lines:
+            if line.endswith(':'):
+                if line[:-1] in referenced or not line.startswith('L_'):
+                    regions += [line, []]
+            else:
+                regions[-1].append(parse_mips(line))
+                if regions[-1][-1].op in MIPS_CONTROL:
+                    regions.append([])
+
+        regions = [region for region in regions if len(region) > 0]
+        used = set(sum([
+            instruction.defs + instruction.uses for region in regions
+            if not isinstance(region, str) for instruction in region
+        ], []))
+        exposed = set(
+            sum([
+                self.upward_exposed(region) for region in regions
+                if not isinstance(region, str)
+            ], []))
+        pool = [reg for reg in SCRATCH_REGISTERS if reg not in used]
+        renamable = set(reg for reg in used
+                        if reg in SCRATCH_REGISTERS and reg not in exposed)
+
+        ret = []
+        for region in regions:
+            if isinstance(region, str):
+                ret.append(region)
+            else:
+                ret += self.schedule_region(region, pool, renamable)
+        return ret
+
+    def upward_exposed(self, region):
+        defined = set()
+        exposed = []
+        for instruction in region:
+            exposed += [reg for reg in instruction.uses if reg not in defined]
+            defined.update(instruction.defs)
+        return exposed
+
+    def rename(self, region, pool, renamable):
+        last_use = {}
+        current = {}
+        for i, instruction in enumerate(region):
+            for reg in instruction.uses:
+                if reg in current:
+                    last_use[current[reg]] = i
+            for reg in instruction.defs:
+                current[reg] = i
+                last_use[i] = i
+
+        free_at = dict((reg, -1) for reg in pool)
+        mapping = {}
+        renamed = []
+        for i, instruction in enumerate(region):
+            new_name = dict(mapping)
+            for reg in instruction.defs:
+                mapping.pop(reg, None)
+                free = [p for p in pool if free_at[p] < i]
+                if reg in renamable and len(free) > 0:
+                    choice = min(free, key=lambda p: free_at[p])
+                    free_at[choice] = last_use[i]
+                    mapping[reg] = choice
+
+            # operands before first_use are written, the rest are read
+            first_use = 1 if len(instruction.defs) > 0 and \
+                instruction.op not in ('syscall', 'jal') else 0
+            operands = [
+                self.substitute(operand, mapping)
+                for operand in instruction.operands[:first_use]
+            ] + [
+                self.substitute(operand, new_name)
+                for operand in instruction.operands[first_use:]
+            ]
+            text = instruction.op + (' ' + ', '.join(operands)
+                                     if len(operands) > 0 else '')
+            renamed.append(parse_mips(text))
+        return renamed
+
+    def substitute(self, operand, names):
+        return REGISTER.sub(lambda m: names.get(m.group(), m.group()),
+                            operand)
+
+    def memory_access(self, instruction):
+        if instruction.op not in MIPS_LOADS and \
+                instruction.op not in MIPS_STORES:
+            return None
+        match = MEMORY_OPERAND.match(instruction.operands[1])
+        if match is None:
+            return (None, None)
+        return match.group(2), match.group(1)
+
+    def dependences(self, region):
+        latency = self.latency_model.latency
+        preds = [[] for instruction in region]
+        versions = defaultdict(int)
+        accesses = []
+        for i, instruction in enumerate(region):
+            access = self.memory_access(instruction)
+            if access is not None:
+                base, offset = access
+                if base in ('$sp', '$s0', '$fp'):
+                    access = (base, versions[base], offset)
+                else:
+                    access = None
+            accesses.append(access)
+            for reg in instruction.defs:
+                versions[reg] += 1
+
+        for j, later in enumerate(region):
+            for i in range(j):
+                earlier = region[i]
+                weight = None
+                if set(earlier.defs) & set(later.uses):
+                    weight = latency(earlier)
+                elif set(earlier.defs) & set(later.defs):
+                    weight = 1
+                elif set(earlier.uses) & set(later.defs):
+                    weight = 0
+
+                stores = [
+                    ins.op in MIPS_STORES for ins in (earlier, later)
+                    if ins.op in MIPS_LOADS or ins.op in MIPS_STORES
+                ]
+                if len(stores) == 2 and any(stores) and (
+                        accesses[i] is None or accesses[j] is None
+                        or accesses[i] == accesses[j]
+                        or accesses[i][:2] != accesses[j][:2]):
+                    weight = max(weight or 0, 1 if stores[0] else 0)
+
+                if later.op in MIPS_CONTROL:
+                    weight = weight or 0
+
+                if weight is not None:
+                    preds[j].append((i, weight))
+        return preds
+
+    def estimate(self, order, preds):
+        issued = {}
+        time = -1
+        for node in order:
+            time = max([time + 1] +
+                       [issued[pred] + weight for pred, weight in preds[node]])
+            issued[node] = time
+        return time + 1
+
+    def list_schedule(self, region, preds):
+        succs = [[] for instruction in region]
+        for node, node_preds in enumerate(preds):
+            for pred, weight in node_preds:
+                succs[pred].append((node, weight))
+
+        priority = [0] * len(region)
+        for node in reversed(range(len(region))):
+            priority[node] = max(
+                [self.latency_model.latency(region[node])] +
+                [weight + priority[succ] for succ, weight in succs[node]])
+
+        waiting = [len(node_preds) for node_preds in preds]
+        earliest = [0] * len(region)
+        ready = [node for node in range(len(region)) if waiting[node] == 0]
+        order = []
+        time = 0
+        while len(order) < len(region):
+            candidates = [node for node in ready if earliest[node] <= time]
+            if len(candidates) == 0:
+                candidates = ready
+            node = max(candidates, key=lambda n: (priority[n], -n))
+            ready.remove(node)
+            order.append(node)
+            for succ, weight in succs[node]:
+                earliest[succ] = max(earliest[succ], time + weight)
+                waiting[succ] -= 1
+                if waiting[succ] == 0:
+                    ready.append(succ)
+            time = max(time, earliest[node]) + 1
+        return order
+
+    def schedule_region(self, region, pool, renamable):
+        original = [instruction.text for instruction in region]
+        before = self.estimate(
+            range(len(region)), self.dependences(region))
+        self.cycles_before += before
+
+        renamed = self.rename(region, pool, renamable)
+        preds = self.dependences(renamed)
+        order = self.list_schedule(renamed, preds)
+        after = self.estimate(order, preds)
+
+        if after >= before:
+            self.cycles_after += before
+            return original
+
+        self.cycles_after += after
+        return [renamed[node].text for node in order]
+
+
+class VMError(Exception):
+    pass
+
+
+# quads: its quads, leaving out the ones of the subprograms nested in it
+# parent: the start_quad of the block it is nested in, None for the main block
+QuadBlock = namedtuple('QuadBlock',
+                       ['name', 'start_quad', 'level', 'parent', 'quads'])
+
+
+def split_blocks(quads):
+    """Returns the QuadBlocks of the quads of a whole program by start_quad,
+    outer blocks first."""
+    blocks = {}
+    open_blocks = []
+    for quad in quads:
+        if quad.op == 'begin_block':
+            blocks[quad.id] = QuadBlock(
+                name=quad.term0,
+                start_quad=quad.id,
+                level=len(open_blocks),
+                parent=open_blocks[-1] if open_blocks else None,
+                quads=[])
+            open_blocks.append(quad.id)
+        blocks[open_blocks[-1]].quads.append(quad)
+        if quad.op == 'end_block':
+            open_blocks.pop()
+    return blocks
+
+
+def find_callee(blocks, start_quad, name):
+    # the closest subprogram with that name nested in the block or in one of
+    # the blocks around it
+    while start_quad is not None:
+        for block in blocks.values():
+            if block.parent == start_quad and block.name == name:
+                return block.start_quad
+        start_quad = blocks[start_quad].parent
+    raise VMError('Call to unknown subprogram %s.' % name)
+
+
+class IntReader:
+    """Reads the integers of input statements from a file, 0 once it runs
+    out, like the read_int syscall."""
+
+    def __init__(self, stdin):
+        self.stdin = stdin
+        self.pending = []
+
+    def read(self):
+        while len(self.pending) == 0:
+            line = self.stdin.readline()
+            if line == '':
+                return 0
+            self.pending = line.split()[::-1]
+
+        token = self.pending.pop()
+        try:
+            return to_signed(int(token))
+        except ValueError:
+            raise VMError('Expected an integer as input, got %s.' % token)
+
+
+def to_signed(value):
+    # results wrap around like they do in a 32-bit register
+    return (value - MIN_INT) % 2**32 + MIN_INT
+
+
+def checked_divide(a, b):
+    if b == 0:
+        raise VMError('Division by zero.')
+    return divide(a, b)
+
+
+VM_ARITHMETIC_FUNCTIONS = dict(ARITHMETIC_FUNCTIONS, **{'/': checked_divide})
+
+# name: the name of the subprogram, or of the program for the main block
+# level: its nesting level, 0 for the main block
+# parent: the VMBlock it is nested in, None for the main block
+# frame: the frame a call to it starts with: its static link, the cell its
+#   result goes to, a slot for each parameter, variable and temporary and
+#   then one for each constant it uses, already holding it
+# names: name or constant: (slot, whether the slot holds a reference)
+# far: (slot, hops, by_reference) of each operand that is in another frame or
+#   behind a reference, which instructions refer to by its bitwise complement
+# code: its instructions, leaving out the quads of nested subprograms
+VMBlock = namedtuple('VMBlock', [
+    'name', 'start_quad', 'level', 'parent', 'frame', 'names', 'far', 'code'
+])
+
+
+def vm_cell(frame, far):
+    slot, hops, by_reference = far
+    for i in range(hops):
+        frame = frame[0]
+    if by_reference:
+        return frame[slot]
+    return frame, slot
+
+
+def vm_load(frame, far):
+    frame, slot = vm_cell(frame, far)
+    return frame[slot]
+
+
+class QuadVM:
+    """Runs the quads of a program directly, without going through MIPS.
+
+    Every block is decoded once into instructions
+    (op, a, b, c, d, quad ids) whose operands are slots of its frame, a list.
+    Constants get slots too, so reading any operand of the block's own is
+    just an index; the rest are looked up through static links and
+    references. The par quads of a call are folded into it. Calls push onto
+    a list instead of recursing, so deep recursion in EEL is fine. With
+    count_quads, counts[quad id] is the number of times the quad ran."""
+
+    def __init__(self, quad_gen, count_quads=False):
+        self.quads = quad_gen.quad_list
+        self.parameters = quad_gen.parameters
+        self.blocks = self.decode_blocks()
+        self.counts = [0] * len(self.quads) if count_quads else None
+
+    def decode_blocks(self):
+        self.quad_blocks = split_blocks(self.quads)
+        blocks = {}
+        # a block only uses the names of the blocks it is nested in, which
+        # are laid out before it
+        for start_quad, quad_block in self.quad_blocks.items():
+            blocks[start_quad] = VMBlock(
+                name=quad_block.name,
+                start_quad=start_quad,
+                level=quad_block.level,
+                parent=blocks.get(quad_block.parent),
+                frame=[None, None],
+                names={},
+                far=[],
+                code=[])
+            self.lay_out(blocks[start_quad], quad_block.quads)
+        for start_quad, quad_block in self.quad_blocks.items():
+            blocks[start_quad].code.extend(
+                self.decode(blocks[start_quad], quad_block.quads, blocks))
+        return blocks
+
+    def lay_out(self, block, quads):
+        for arg in self.parameters.get(block.start_quad, []):
+            block.names[arg.name] = (len(block.frame), arg.mode == 'ref')
+            block.frame.append(0)
+        for quad in quads:
+            if quad.op == 'int':
+                block.names[quad.term0] = (len(block.frame), False)
+                block.frame.append(0)
+
+        # whatever isn't declared anywhere is a temporary
+        for quad in quads:
+            for name in quad_uses(quad) + quad_defs(quad):
+                if self.resolve(block, name) is None:
+                    block.names[name] = (len(block.frame), False)
+                    block.frame.append(0)
+
+    def resolve(self, block, name):
+        while block is not None:
+            if name in block.names:
+                return (block, ) + block.names[name]
+            block = block.parent
+        return None
+
+    def operand(self, block, term):
+        if not is_variable(term):
+            if term not in block.names:
+                block.names[term] = (len(block.frame), False)
+                block.frame.append(int(term))
+            return block.names[term][0]
+
+        owner, slot, by_reference = self.resolve(block, term)
+        if owner is block and not by_reference:
+            return slot
+        block.far.append((slot, block.level - owner.level, by_reference))
+        return ~(len(block.far) - 1)
+
+    def decode(self, block, quads, blocks):
+        code = []
+        # quad id: the position of the instruction it ended up in
+        positions = {}
+        par_quads = []
+        for i, quad in enumerate(quads):
+            positions[quad.id] = len(code)
+            if quad.op == 'par':
+                par_quads.append(quad)
+                continue
+            if quad.op in ('begin_block', 'int', 'jtarget'):
+                continue
+
+            if quad.op == ':=':
+                ins = [':=', self.operand(block, quad.term0), None,
+                       self.operand(block, quad.target), None]
+            elif quad.op in ARITHMETIC_OPS:
+                ins = ['arith', self.operand(block, quad.term0),
+                       self.operand(block, quad.term1),
+                       self.operand(block, quad.target),
+                       VM_ARITHMETIC_FUNCTIONS[quad.op]]
+            elif quad.op in RELOPS:
+                ins = ['if', self.operand(block, quad.term0),
+                       self.operand(block, quad.term1), quad.target,
+                       RELOP_FUNCTIONS[quad.op]]
+            elif quad.op == 'jump':
+                ins = ['jump', None, None, quad.target, None]
+            elif quad.op == 'jtable':
+                targets = []
+                for target in quads[i + 1:]:
+                    if target.op != 'jtarget':
+                        break
+                    targets.append(target.target)
+                ins = ['jtable', self.operand(block, quad.term0),
+                       int(quad.term1), targets, None]
+            elif quad.op == 'call':
+                callee = blocks[find_callee(self.quad_blocks,
+                                            block.start_quad, quad.term0)]
+                args = tuple((par.term1 == 'ref', self.operand(
+                    block, par.term0)) for par in par_quads
+                             if par.term1 != 'ret')
+                ret = [
+                    self.operand(block, par.term0) for par in par_quads
+                    if par.term1 == 'ret'
+                ]
+                ins = ['call', callee, args, ret[0] if ret else None,
+                       block.level - callee.parent.level]
+            elif quad.op == 'retv':
+                ins = ['retv', self.operand(block, quad.term0), None, None,
+                       None]
+            elif quad.op == 'out':
+                ins = ['out', self.operand(block, quad.term0), None, None,
+                       None]
+            elif quad.op == 'inp':
+                ins = ['inp', None, None, self.operand(block, quad.term0),
+                       None]
+            elif quad.op == 'halt' or (quad.op == 'end_block' and
+                                       block.level == 0):
+                ins = ['halt', None, None, None, None]
+            elif quad.op == 'end_block':
+                ins = ['return', None, None, None, None]
+            else:
+                raise VMError('Unsupported quad: %s' % str(quad))
+
+            code.append(ins + [tuple(par.id for par in par_quads) +
+                               (quad.id, )])
+            par_quads = []
+
+        for ins in code:
+            if ins[0] in ('if', 'jump'):
+                ins[3] = positions[ins[3]]
+            elif ins[0] == 'jtable':
+                ins[3] = [positions[target] for target in ins[3]]
+        return [tuple(ins) for ins in code]
+
+    def run(self, stdin=None, stdout=None):
+        reader = IntReader(sys.stdin if stdin is None else stdin)
+        stdout = sys.stdout if stdout is None else stdout
+        counts = self.counts
+        main = self.blocks[min(self.blocks)]
+        code, far, frame, pc = main.code, main.far, list(main.frame), 0
+        # (code, far, frame, pc) of every caller
+        stack = []
+
+        while True:
+            op, a, b, c, d, ids = code[pc]
+            pc += 1
+            if counts is not None:
+                for quad_id in ids:
+                    counts[quad_id] += 1
+
+            if op == ':=':
+                value = frame[a] if a >= 0 else vm_load(frame, far[~a])
+                if c >= 0:
+                    frame[c] = value
+                else:
+                    cell, slot = vm_cell(frame, far[~c])
+                    cell[slot] = value
+            elif op == 'arith':
+                value = d(frame[a] if a >= 0 else vm_load(frame, far[~a]),
+                          frame[b] if b >= 0 else vm_load(frame, far[~b]))
+                if not MIN_INT <= value <= MAX_INT:
+                    value = to_signed(value)
+                if c >= 0:
+                    frame[c] = value
+                else:
+                    cell, slot = vm_cell(frame, far[~c])
+                    cell[slot] = value
+            elif op == 'if':
+                if d(frame[a] if a >= 0 else vm_load(frame, far[~a]),
+                     frame[b] if b >= 0 else vm_load(frame, far[~b])):
+                    pc = c
+            elif op == 'jump':
+                pc = c
+            elif op == 'call':
+                callee_frame = list(a.frame)
+                static_link = frame
+                for i in range(d):
+                    static_link = static_link[0]
+                callee_frame[0] = static_link
+                if c is not None:
+                    callee_frame[1] = (frame, c) if c >= 0 else vm_cell(
+                        frame, far[~c])
+                slot = 2
+                for by_reference, arg in b:
+                    if by_reference:
+                        callee_frame[slot] = (frame, arg) if arg >= 0 \
+                            else vm_cell(frame, far[~arg])
+                    else:
+                        callee_frame[slot] = frame[arg] if arg >= 0 \
+                            else vm_load(frame, far[~arg])
+                    slot += 1
+                stack.append((code, far, frame, pc))
+                code, far, frame, pc = a.code, a.far, callee_frame, 0
+            elif op == 'retv':
+                value = frame[a] if a >= 0 else vm_load(frame, far[~a])
+                if frame[1] is not None:
+                    cell, slot = frame[1]
+                    cell[slot] = value
+                code, far, frame, pc = stack.pop()
+            elif op == 'return':
+                code, far, frame, pc = stack.pop()
+            elif op == 'out':
+                stdout.write('%d\n' %
+                             (frame[a] if a >= 0 else vm_load(frame, far[~a])))
+            elif op == 'inp':
+                value = reader.read()
+                if c >= 0:
+                    frame[c] = value
+                else:
+                    cell, slot = vm_cell(frame, far[~c])
+                    cell[slot] = value
+            elif op == 'jtable':
+                pc = c[(frame[a] if a >= 0 else vm_load(frame, far[~a])) - b]
+            elif op == 'halt':
+                return
+
+    def profile(self):
+        """Returns (count, quad) for every quad that ran, the most frequent
+        first."""
+        return sorted(
+            [(self.counts[quad.id], quad)
+             for quad in self.quads if self.counts[quad.id] > 0],
+            key=lambda entry: (-entry[0], entry[1].id))
+
+
+PYTHON_RELOPS = {
+    '=': '==',
+    '<>': '!=',
+    '<': '<',
+    '<=': '<=',
+    '>': '>',
+    '>=': '>='
+}
+
+# EEL recursion turns into Python recursion
+PYTHON_RECURSION_LIMIT = 200000
+# Python allows at most 20 loops inside one another
+PYTHON_MAX_NESTED_LOOPS = 16
+
+# Python source: its code object, so programs run again aren't recompiled;
+# the oldest entries go once there are PYTHON_CODE_CACHE_ENTRIES, and every
+# thread goes through PYTHON_CODE_CACHE_LOCK
+PYTHON_CODE_CACHE = {}
+PYTHON_CODE_CACHE_ENTRIES = 64
+PYTHON_CODE_CACHE_LOCK = threading.Lock()
+
+
+class PythonGen:
+    """Translates the quads of a program into a Python function, so it runs
+    at the speed of Python code instead of one quad at a time.
+
+    Every block becomes a function nested in the one of the block around it,
+    so closures do the job of static links. Parameters, variables and
+    temporaries are locals; the variables some call passes as inout live in
+    one element lists, which inout parameters receive. The basic blocks of a
+    function are the cases of a loop over pc, which falls through to the
+    next case and only goes back to the top for backward jumps. Blocks
+    without jumps are left as they are."""
+
+    def __init__(self, quad_gen):
+        self.blocks = split_blocks(quad_gen.quad_list)
+        self.parameters = quad_gen.parameters
+        self.lines = []
+
+        # start_quad: the parameters and variables of its block, each
+        # 'plain', 'boxed' or 'ref'
+        self.declared = {}
+        for start_quad, block in self.blocks.items():
+            names = dict((arg.name, 'ref' if arg.mode == 'ref' else 'plain')
+                         for arg in self.parameters.get(start_quad, []))
+            for quad in block.quads:
+                if quad.op == 'int':
+                    names[quad.term0] = 'plain'
+            self.declared[start_quad] = names
+
+        for block in self.blocks.values():
+            for quad in block.quads:
+                if quad.op == 'par' and quad.term1 == 'ref':
+                    names = self.declared[self.owner(block, quad.term0)]
+                    if names[quad.term0] == 'plain':
+                        names[quad.term0] = 'boxed'
+
+    def owner(self, block, name):
+        """Returns the start_quad of the block whose parameter or variable the
+        name is, None for a temporary."""
+        start_quad = block.start_quad
+        while start_quad is not None:
+            if name in self.declared[start_quad]:
+                return start_quad
+            start_quad = self.blocks[start_quad].parent
+        return None
+
+    def kind(self, block, name):
+        owner = self.owner(block, name)
+        return 'plain' if owner is None else self.declared[owner][name]
+
+    def term(self, block, term):
+        if not is_variable(term):
+            return term
+        if self.kind(block, term) == 'plain':
+            return self.python_name(term)
+        return '%s[0]' % self.python_name(term)
+
+    def python_name(self, name):
+        # temporaries are named T_<n>, which no EEL identifier can be
+        return name if name.startswith('T_') else 'v_%s' % name
+
+    def emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def source(self):
+        if len(self.lines) == 0:
+            self.emit(0, 'def eel_program(read_int, write, to_signed):')
+            self.generate_block(self.blocks[0], 1)
+            self.emit(1, 'f_0()')
+        return '\n'.join(self.lines) + '\n'
+
+    def code(self):
+        source = self.source()
+        with PYTHON_CODE_CACHE_LOCK:
+            code = PYTHON_CODE_CACHE.get(source)
+        if code is None:
+            code = compile(source, '<eel>', 'exec')
+            with PYTHON_CODE_CACHE_LOCK:
+                while len(PYTHON_CODE_CACHE) >= PYTHON_CODE_CACHE_ENTRIES:
+                    del PYTHON_CODE_CACHE[next(iter(PYTHON_CODE_CACHE))]
+                PYTHON_CODE_CACHE[source] = code
+        return code
+
+    def run(self, stdin=None, stdout=None):
+        namespace = {}
+        exec(self.code(), namespace)
+        stdout = sys.stdout if stdout is None else stdout
+
+        def write(value):
+            stdout.write('%d\n' % value)
+
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, PYTHON_RECURSION_LIMIT))
+        try:
+            namespace['eel_program'](
+                IntReader(sys.stdin if stdin is None else stdin).read, write,
+                to_signed)
+        except ZeroDivisionError:
+            raise VMError('Division by zero.')
+        except RecursionError:
+            raise VMError('Recursion too deep.')
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    def generate_block(self, block, depth):
+        parameters = self.parameters.get(block.start_quad, [])
+        names = self.declared[block.start_quad]
+        self.emit(depth, 'def f_%s(%s):' % (block.start_quad, ', '.join(
+            self.python_name(arg.name) for arg in parameters)))
+        depth += 1
+
+        assigned = set()
+        temps = set()
+        for quad in block.quads:
+            for name in quad_uses(quad) + quad_defs(quad):
+                if self.owner(block, name) is None:
+                    temps.add(name)
+            for name in quad_defs(quad):
+                owner = self.owner(block, name)
+                if owner not in (None, block.start_quad) and \
+                        self.declared[owner][name] == 'plain':
+                    assigned.add(name)
+        if len(assigned) > 0:
+            self.emit(
+                depth, 'nonlocal %s' %
+                ', '.join(self.python_name(name) for name in sorted(assigned)))
+
+        # uninitialised variables read as 0, like fresh stack slots
+        arguments = [arg.name for arg in parameters]
+        plain = [
+            self.python_name(name) for name in names
+            if name not in arguments and names[name] == 'plain'
+        ] + sorted(temps)
+        if len(plain) > 0:
+            self.emit(depth, '%s = 0' % ' = '.join(plain))
+        for name in names:
+            if names[name] == 'boxed':
+                value = self.python_name(name) if name in arguments else '0'
+                self.emit(depth, '%s = [%s]' % (self.python_name(name), value))
+
+        for nested in self.blocks.values():
+            if nested.parent == block.start_quad:
+                self.generate_block(nested, depth)
+        self.generate_body(block, depth)
+
+    def generate_body(self, block, depth):
+        # name: the quads of the block that use it
+        self.uses = defaultdict(list)
+        self.defs = defaultdict(int)
+        for quad in block.quads:
+            for name in quad_uses(quad):
+                self.uses[name].append(quad)
+            for name in quad_defs(quad):
+                self.defs[name] += 1
+
+        jtargets = {}
+        quads = []
+        # quad id: the index in quads of the first quad it is followed by
+        position = {}
+        waiting = []
+        for i, quad in enumerate(block.quads):
+            if quad.op == 'jtable':
+                jtargets[quad.id] = []
+                for target in block.quads[i + 1:]:
+                    if target.op != 'jtarget':
+                        break
+                    jtargets[quad.id].append(target.target)
+            waiting.append(quad.id)
+            if quad.op in ('begin_block', 'int', 'jtarget'):
+                continue
+            for quad_id in waiting:
+                position[quad_id] = len(quads)
+            waiting = []
+            quads.append(quad)
+
+        targets = set()
+        for quad in quads:
+            if quad.op in ('jump', ) + RELOPS:
+                targets.add(position[quad.target])
+            elif quad.op == 'jtable':
+                targets.update(position[target]
+                               for target in jtargets[quad.id])
+        leaders = set([0]) | targets
+        for i, quad in enumerate(quads[:-1]):
+            if quad.op in ('jump', 'jtable', 'retv', 'halt') + RELOPS:
+                leaders.add(i + 1)
+        starts = sorted(leaders)
+        ends = starts[1:] + [len(quads)]
+        # index in quads of the first quad of a basic block: its number
+        basic_block = dict((start, k) for k, start in enumerate(starts))
+
+        if len(targets) == 0:
+            self.generate_quads(block, quads, depth)
+            return
+
+        def follow(k):
+            # basic blocks that only jump somewhere are skipped over
+            for i in range(len(starts)):
+                if quads[starts[k]].op != 'jump':
+                    break
+                k = basic_block[position[quads[starts[k]].target]]
+            return k
+
+        successors = []
+        for k in range(len(starts)):
+            last = quads[ends[k] - 1]
+            if last.op == 'jump':
+                following = [basic_block[position[last.target]]]
+            elif last.op in RELOPS:
+                following = [basic_block[position[last.target]], k + 1]
+            elif last.op == 'jtable':
+                following = [
+                    basic_block[position[target]]
+                    for target in jtargets[last.id]
+                ]
+            elif last.op in ('retv', 'halt', 'end_block'):
+                following = []
+            else:
+                following = [k + 1]
+            successors.append([follow(successor) for successor in following])
+
+        reachable = set()
+        pending = [follow(0)]
+        while len(pending) > 0:
+            k = pending.pop()
+            if k not in reachable:
+                reachable.add(k)
+                pending += successors[k]
+
+        # a backward jump makes a loop over the cases from its target to the
+        # last jump back there, which gets a while loop of its own so that
+        # jumping back only tries the cases in it
+        loops = {}
+        for k in reachable:
+            for successor in successors[k]:
+                if successor <= k:
+                    loops[successor] = max(loops.get(successor, k), k)
+        # loops that overlap without one being inside the other are left to
+        # the loop around them
+        regions = {}
+        inside = []
+        for header in sorted(loops):
+            while len(inside) > 0 and inside[-1] < header:
+                inside.pop()
+            if len(inside) == 0 or loops[header] <= inside[-1] and \
+                    len(inside) < PYTHON_MAX_NESTED_LOOPS:
+                regions[header] = loops[header]
+                inside.append(loops[header])
+
+        def generate_cases(cases, depth, region):
+            i = 0
+            while i < len(cases):
+                k = cases[i]
+                if k in regions and (k, regions[k]) != region:
+                    inner = [case for case in cases if k <= case <= regions[k]]
+                    self.emit(depth, 'while %d <= pc <= %d:' % (k, regions[k]))
+                    generate_cases(inner, depth + 1, (k, regions[k]))
+                    i += len(inner)
+                else:
+                    self.generate_case(block, quads[starts[k]:ends[k]], k,
+                                       successors[k], depth, region)
+                    i += 1
+
+        self.emit(depth, 'pc = %d' % follow(0))
+        self.emit(depth, 'while True:')
+        generate_cases(sorted(reachable), depth + 1, (0, len(starts) - 1))
+
+    def generate_case(self, block, quads, k, successors, depth, region):
+        self.emit(depth, 'if pc == %d:' % k)
+        last = quads[-1]
+        if last.op in ('jump', 'jtable') + RELOPS:
+            self.generate_quads(block, quads[:-1], depth + 1)
+        else:
+            self.generate_quads(block, quads, depth + 1)
+
+        if last.op == 'jump':
+            self.generate_jump(successors[0], k, depth + 1, region)
+        elif last.op in RELOPS:
+            self.emit(
+                depth + 1, 'if %s %s %s:' %
+                (self.term(block, last.term0), PYTHON_RELOPS[last.op],
+                 self.term(block, last.term1)))
+            self.generate_jump(successors[0], k, depth + 2, region)
+            self.emit(depth + 1, 'else:')
+            self.generate_jump(successors[1], k, depth + 2, region)
+        elif last.op == 'jtable':
+            self.emit(
+                depth + 1, 'pc = (%s, )[%s - %s]' %
+                (', '.join(str(target) for target in successors),
+                 self.term(block, last.term0), last.term1))
+            if any(self.goes_back(target, k, region)
+                   for target in successors):
+                self.emit(depth + 1, 'continue')
+        elif len(successors) > 0:
+            self.generate_jump(successors[0], k, depth + 1, region)
+
+    def goes_back(self, target, k, region):
+        # the cases after this one in the same loop are tried anyway
+        low, high = region
+        return target <= k or not low <= target <= high
+
+    def generate_jump(self, target, k, depth, region):
+        self.emit(depth, 'pc = %d' % target)
+        if self.goes_back(target, k, region):
+            self.emit(depth, 'continue')
+
+    def single_use(self, block, name):
+        return self.owner(block, name) is None and self.defs[name] == 1 and \
+            len(self.uses[name]) == 1
+
+    def generate_quads(self, block, quads, depth):
+        i = 0
+        while i < len(quads):
+            quad = quads[i]
+            following = quads[i + 1] if i + 1 < len(quads) else None
+            # a temporary that is only assigned to a variable is left out
+            if quad.op in ARITHMETIC_OPS and following is not None and \
+                    following.op == ':=' and following.term0 == quad.target \
+                    and self.single_use(block, quad.target):
+                self.generate_arithmetic(block, quad, following.target, depth)
+                i += 2
+            else:
+                self.generate_quad(block, quad, depth)
+                i += 1
+
+    def generate_arithmetic(self, block, quad, target_name, depth):
+        target = self.term(block, target_name)
+        result = target if self.kind(block, target_name) == 'plain' else 'w'
+        # the quotient of 32-bit integers is exact as a float
+        expression = 'int(%s / %s)' if quad.op == '/' else '%s ' + \
+            quad.op + ' %s'
+        self.emit(
+            depth, '%s = %s' % (result, expression %
+                                (self.term(block, quad.term0),
+                                 self.term(block, quad.term1))))
+
+        # results wrap around at 32 bits, which checking for is cheaper than
+        # always doing. Wrapping the result of +, - or * instead gives the
+        # same, so temporaries only used there aren't checked.
+        if not (self.single_use(block, target_name) and
+                self.uses[target_name][0].op in ('+', '-', '*')):
+            self.emit(
+                depth, 'if not %d <= %s <= %d: %s = to_signed(%s)' %
+                (MIN_INT, result, MAX_INT, result, result))
+        if result != target:
+            self.emit(depth, '%s = %s' % (target, result))
+
+    def generate_quad(self, block, quad, depth):
+        if quad.op == 'par':
+            return
+
+        if quad.op == ':=':
+            self.emit(
+                depth, '%s = %s' %
+                (self.term(block, quad.target), self.term(block, quad.term0)))
+        elif quad.op in ARITHMETIC_OPS:
+            self.generate_arithmetic(block, quad, quad.target, depth)
+        elif quad.op == 'call':
+            self.generate_call(block, quad, depth)
+        elif quad.op == 'retv':
+            self.emit(depth, 'return %s' % self.term(block, quad.term0))
+        elif quad.op == 'out':
+            self.emit(depth, 'write(%s)' % self.term(block, quad.term0))
+        elif quad.op == 'inp':
+            self.emit(depth, '%s = read_int()' % self.term(block, quad.term0))
+        elif quad.op == 'halt' or quad.op == 'end_block':
+            self.emit(depth, 'return')
+        else:
+            raise VMError('Unsupported quad: %s' % str(quad))
+
+    def generate_call(self, block, call_quad, depth):
+        # the par quads of a call come right before it
+        i = block.quads.index(call_quad)
+        par_quads = []
+        while i > 0 and block.quads[i - 1].op == 'par':
+            i -= 1
+            par_quads.insert(0, block.quads[i])
+
+        args = []
+        ret = None
+        for par in par_quads:
+            if par.term1 == 'cv':
+                args.append(self.term(block, par.term0))
+            elif par.term1 == 'ref':
+                args.append(self.python_name(par.term0))
+            else:
+                ret = self.term(block, par.term0)
+
+        call = 'f_%s(%s)' % (find_callee(self.blocks, block.start_quad,
+                                         call_quad.term0), ', '.join(args))
+        self.emit(depth, call if ret is None else '%s = %s' % (ret, call))
+
+
+C_PRELUDE = '''#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+static void eel_error(const char *message)
+{
+    fflush(stdout);
+    fprintf(stderr, "runtime error: %s\\n", message);
+    exit(1);
+}
+
+static inline int32_t eel_div(int32_t a, int32_t b)
+{
+    if (b == 0)
+        eel_error("division by zero");
+    /* the one quotient that doesn't fit wraps around, like div */
+    if (b == -1)
+        return (int32_t)(0u - (uint32_t)a);
+    return a / b;
+}
+
+static inline int32_t eel_read(void)
+{
+    long long value;
+
+    /* like the read_int syscall, the end of the input reads as 0 */
+    if (scanf("%lld", &value) != 1)
+        return 0;
+    return (int32_t)(uint32_t)value;
+}
+'''
+
+# + - and * are done on unsigned integers, which wrap around at 32 bits
+C_ARITHMETIC = '(int32_t)((uint32_t)%s ' + '%s' + ' (uint32_t)%s)'
+
+
+class CGen:
+    """Translates the quads of a program into one C translation unit, for a
+    C compiler to turn into a native program.
+
+    Every block becomes a function. The variables and parameters of a block
+    that the blocks nested in it use are kept in a struct for its frame,
+    which nested blocks get a pointer to as their static link and which
+    holds the static link of the block itself; everything else is a local
+    of its function. Parameters passed as inout are pointers, and jumps are
+    gotos."""
+
+    def __init__(self, quad_gen):
+        self.blocks = split_blocks(quad_gen.quad_list)
+        self.parameters = quad_gen.parameters
+        self.lines = []
+
+        # start_quad: the parameters and variables of its block, each
+        # 'value' or 'ref'
+        self.declared = {}
+        for start_quad, block in self.blocks.items():
+            names = dict((arg.name, arg.mode)
+                         for arg in self.parameters.get(start_quad, []))
+            for quad in block.quads:
+                if quad.op == 'int':
+                    names[quad.term0] = 'cv'
+            self.declared[start_quad] = names
+
+        # start_quad: the names of its block that live in its frame struct
+        self.shared = dict((start_quad, set()) for start_quad in self.blocks)
+        for block in self.blocks.values():
+            for quad in block.quads:
+                names = quad_uses(quad) + quad_defs(quad) + (
+                    [quad.term0] if quad.op == 'par' else [])
+                for name in names:
+                    owner = self.owner(block, name)
+                    if owner not in (None, block.start_quad):
+                        self.shared[owner].add(name)
+
+    def owner(self, block, name):
+        """Returns the start_quad of the block whose parameter or variable the
+        name is, None for a temporary or a constant."""
+        start_quad = block.start_quad
+        while start_quad is not None:
+            if name in self.declared[start_quad]:
+                return start_quad
+            start_quad = self.blocks[start_quad].parent
+        return None
+
+    def has_frame(self, block):
+        return any(nested.parent == block.start_quad
+                   for nested in self.blocks.values())
+
+    def c_name(self, name):
+        # temporaries are named T_<n>, which no EEL identifier can be
+        return name if name.startswith('T_') else 'v_%s' % name
+
+    def link(self, block, start_quad):
+        # a pointer to the frame of start_quad, which is block or a block
+        # around it
+        if start_quad == block.start_quad:
+            return '&frame'
+        hops = block.level - self.blocks[start_quad].level
+        return 'link' + '->link' * (hops - 1)
+
+    def place(self, block, name):
+        owner = self.owner(block, name)
+        if owner == block.start_quad and name in self.shared[owner]:
+            return 'frame.%s' % self.c_name(name)
+        if owner not in (None, block.start_quad):
+            return '%s->%s' % (self.link(block, owner), self.c_name(name))
+        return self.c_name(name)
+
+    def by_reference(self, block, name):
+        owner = self.owner(block, name)
+        return owner is not None and self.declared[owner][name] == 'ref'
+
+    def term(self, block, term):
+        if not is_variable(term):
+            return term
+        if self.by_reference(block, term):
+            return '*%s' % self.place(block, term)
+        return self.place(block, term)
+
+    def address(self, block, name):
+        if self.by_reference(block, name):
+            return self.place(block, name)
+        return '&%s' % self.place(block, name)
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def signature(self, block):
+        parameters = [
+            '%s%s' % ('int32_t *' if arg.mode == 'ref' else 'int32_t ',
+                      self.c_name(arg.name))
+            for arg in self.parameters.get(block.start_quad, [])
+        ]
+        if block.parent is not None:
+            parameters.insert(0, 'struct frame_%s *link' % block.parent)
+        return 'static int32_t f_%s(%s)' % (block.start_quad,
+                                            ', '.join(parameters) or 'void')
 
-    def has_a_callable_with_signature(self, name, sig):
-        return self.has_an_entity_that_fulfills(name,
-                                                lambda x: x.has_signature(sig))
+    def source(self):
+        if len(self.lines) > 0:
+            return '\n'.join(self.lines) + '\n'
+
+        self.emit(C_PRELUDE)
+        for block in self.blocks.values():
+            if self.has_frame(block):
+                self.generate_frame(block)
+        for block in self.blocks.values():
+            self.emit('%s;' % self.signature(block))
+        for block in self.blocks.values():
+            self.emit('')
+            self.generate_block(block)
+        self.emit('')
+        self.emit('int main(void)')
+        self.emit('{')
+        self.emit('    f_0();')
+        self.emit('    return 0;')
+        self.emit('}')
+        return '\n'.join(self.lines) + '\n'
+
+    def generate_frame(self, block):
+        names = self.declared[block.start_quad]
+        self.emit('struct frame_%s {' % block.start_quad)
+        if block.parent is not None:
+            self.emit('    struct frame_%s *link;' % block.parent)
+        for name in sorted(self.shared[block.start_quad]):
+            self.emit('    int32_t %s%s;' % ('*' if names[name] == 'ref' else
+                                             '', self.c_name(name)))
+        if block.parent is None and len(self.shared[block.start_quad]) == 0:
+            # C structs can't be empty
+            self.emit('    char unused;')
+        self.emit('};')
+        self.emit('')
+
+    def generate_block(self, block):
+        names = self.declared[block.start_quad]
+        arguments = [
+            arg.name for arg in self.parameters.get(block.start_quad, [])
+        ]
+        self.emit(self.signature(block))
+        self.emit('{')
+
+        # uninitialised variables read as 0, like fresh stack slots
+        if self.has_frame(block):
+            self.emit('    struct frame_%s frame = {%s};' %
+                      (block.start_quad,
+                       '0' if block.parent is None else 'link'))
+        temps = set()
+        for quad in block.quads:
+            for name in quad_uses(quad) + quad_defs(quad):
+                if self.owner(block, name) is None:
+                    temps.add(name)
+        local = [
+            self.c_name(name) for name in names if name not in arguments
+            and name not in self.shared[block.start_quad]
+        ] + sorted(temps)
+        if len(local) > 0:
+            self.emit('    int32_t %s;' %
+                      ', '.join('%s = 0' % name for name in local))
+        for name in sorted(self.shared[block.start_quad]):
+            if name in arguments:
+                self.emit('    frame.%s = %s;' % (self.c_name(name),
+                                                  self.c_name(name)))
+
+        targets = set()
+        for quad in block.quads:
+            if quad.op in JUMP_OPS:
+                targets.add(quad.target)
+        for i, quad in enumerate(block.quads):
+            if quad.id in targets:
+                self.emit('L_%s:' % quad.id)
+            self.generate_quad(block, i, quad)
+        self.emit('}')
+
+    def generate_quad(self, block, i, quad):
+        if quad.op in ('begin_block', 'int', 'par', 'jtarget'):
+            return
 
-    def get_current_nesting_level(self):
-        return max(0, len(self.scopes) - 1)
+        if quad.op == ':=':
+            self.emit('    %s = %s;' % (self.term(block, quad.target),
+                                        self.term(block, quad.term0)))
+        elif quad.op == '/':
+            self.emit('    %s = eel_div(%s, %s);' %
+                      (self.term(block, quad.target),
+                       self.term(block, quad.term0),
+                       self.term(block, quad.term1)))
+        elif quad.op in ARITHMETIC_OPS:
+            self.emit('    %s = %s;' % (
+                self.term(block, quad.target), C_ARITHMETIC %
+                (self.term(block, quad.term0), quad.op,
+                 self.term(block, quad.term1))))
+        elif quad.op == 'jump':
+            self.emit('    goto L_%s;' % quad.target)
+        elif quad.op in RELOPS:
+            self.emit('    if (%s %s %s)' %
+                      (self.term(block, quad.term0), PYTHON_RELOPS[quad.op],
+                       self.term(block, quad.term1)))
+            self.emit('        goto L_%s;' % quad.target)
+        elif quad.op == 'jtable':
+            self.emit('    switch (%s - %s) {' %
+                      (self.term(block, quad.term0), quad.term1))
+            for value, target in enumerate(block.quads[i + 1:]):
+                if target.op != 'jtarget':
+                    break
+                self.emit('    case %d: goto L_%s;' % (value, target.target))
+            self.emit('    }')
+        elif quad.op == 'call':
+            self.generate_call(block, i, quad)
+        elif quad.op == 'retv':
+            self.emit('    return %s;' % self.term(block, quad.term0))
+        elif quad.op == 'out':
+            self.emit('    printf("%%d\\n", %s);' %
+                      self.term(block, quad.term0))
+        elif quad.op == 'inp':
+            self.emit('    %s = eel_read();' % self.term(block, quad.term0))
+        elif quad.op in ('halt', 'end_block'):
+            self.emit('    return 0;')
+        else:
+            raise VMError('Unsupported quad: %s' % str(quad))
 
-    def get_cause_of_birth(self):
-        return self.scopes[-2].entities[-1]
+    def generate_call(self, block, i, call_quad):
+        # the par quads of a call come right before it
+        par_quads = []
+        while i > 0 and block.quads[i - 1].op == 'par':
+            i -= 1
+            par_quads.insert(0, block.quads[i])
+
+        callee = self.blocks[find_callee(self.blocks, block.start_quad,
+                                         call_quad.term0)]
+        args = [self.link(block, callee.parent)]
+        ret = None
+        for par in par_quads:
+            if par.term1 == 'cv':
+                args.append(self.term(block, par.term0))
+            elif par.term1 == 'ref':
+                args.append(self.address(block, par.term0))
+            else:
+                ret = self.term(block, par.term0)
+
+        call = 'f_%s(%s)' % (callee.start_quad, ', '.join(args))
+        self.emit('    %s;' %
+                  (call if ret is None else '%s = %s' % (ret, call)))
+
+
+# every 4-byte slot the symbol table lays out takes 8 bytes, enough for the
+# static link and the addresses inout parameters hold
+X86_SLOT_SCALE = 2
+X86_JUMPS = {
+    '=': 'je',
+    '<>': 'jne',
+    '<': 'jl',
+    '<=': 'jle',
+    '>': 'jg',
+    '>=': 'jge'
+}
+X86_ARITHMETIC = {'+': 'addl', '-': 'subl', '*': 'imull'}
+X86_DIVISION_BY_ZERO_MESSAGE = 'runtime error: division by zero\n'
+X86_IN_BUFFER_SIZE = 4096
+
+# print, input and division by zero, which the generated code calls. They
+# use %rax, %rcx, %rdx, %rsi, %rdi and %r8-%r11, and the generated code
+# keeps nothing but %rbx and %rbp across a call.
+X86_RUNTIME = [
+    # writes %edi and a newline to stdout
+    '__eel_print_int:',
+    'subq $32, %rsp',
+    'leaq 31(%rsp), %rsi',
+    'movb $10, (%rsi)',
+    'movslq %edi, %rax',
+    'movq %rax, %r8',
+    'testq %rax, %rax',
+    'jns __eel_print_int_digit',
+    'negq %rax',
+    '__eel_print_int_digit:',
+    'movl $10, %ecx',
+    'xorl %edx, %edx',
+    'divq %rcx',
+    'addb $48, %dl',
+    'decq %rsi',
+    'movb %dl, (%rsi)',
+    'testq %rax, %rax',
+    'jnz __eel_print_int_digit',
+    'testq %r8, %r8',
+    'jns __eel_print_int_write',
+    'decq %rsi',
+    'movb $45, (%rsi)',
+    '__eel_print_int_write:',
+    'leaq 32(%rsp), %rdx',
+    'subq %rsi, %rdx',
+    'movl $1, %eax',
+    'movl $1, %edi',
+    'syscall',
+    'addq $32, %rsp',
+    'ret',
+    # returns in %eax the next byte of stdin, -1 at its end
+    '__eel_getc:',
+    'movq __eel_in_next(%rip), %rax',
+    'cmpq __eel_in_end(%rip), %rax',
+    'jb __eel_getc_buffered',
+    'xorl %eax, %eax',
+    'xorl %edi, %edi',
+    'leaq __eel_in_buf(%rip), %rsi',
+    'movl $%d, %%edx' % X86_IN_BUFFER_SIZE,
+    'syscall',
+    'testq %rax, %rax',
+    'jle __eel_getc_end',
+    'leaq __eel_in_buf(%rip), %rsi',
+    'addq %rsi, %rax',
+    'movq %rax, __eel_in_end(%rip)',
+    'movq %rsi, %rax',
+    '__eel_getc_buffered:',
+    'leaq 1(%rax), %rdx',
+    'movq %rdx, __eel_in_next(%rip)',
+    'movzbl (%rax), %eax',
+    'ret',
+    '__eel_getc_end:',
+    'movl $-1, %eax',
+    'ret',
+    # returns in %eax the next integer of stdin, 0 at its end like read_int
+    '__eel_read_int:',
+    'call __eel_getc',
+    'cmpl $-1, %eax',
+    'je __eel_read_int_end',
+    'cmpl $32, %eax',
+    'jle __eel_read_int',
+    'xorl %r8d, %r8d',
+    'movl $1, %r9d',
+    'cmpl $45, %eax',
+    'jne __eel_read_int_digit',
+    'movl $-1, %r9d',
+    '__eel_read_int_next:',
+    'call __eel_getc',
+    '__eel_read_int_digit:',
+    'subl $48, %eax',
+    'cmpl $9, %eax',
+    'ja __eel_read_int_done',
+    'imull $10, %r8d',
+    'addl %eax, %r8d',
+    'jmp __eel_read_int_next',
+    '__eel_read_int_done:',
+    'movl %r8d, %eax',
+    'imull %r9d, %eax',
+    'ret',
+    '__eel_read_int_end:',
+    'xorl %eax, %eax',
+    'ret',
+    '__eel_division_by_zero:',
+    'movl $1, %eax',
+    'movl $2, %edi',
+    'leaq __eel_division_by_zero_message(%rip), %rsi',
+    'movl $%d, %%edx' % len(X86_DIVISION_BY_ZERO_MESSAGE),
+    'syscall',
+    'movl $60, %eax',
+    'movl $1, %edi',
+    'syscall',
+]
 
-    def get_var_entities_on_scope(self, scope):
-        var_entities = 0
-        for entity in scope.entities:
-            if entity.is_a_variable():
-                var_entities += 1
+X86_RUNTIME_DATA = [
+    '__eel_in_next:', '.quad 0', '__eel_in_end:', '.quad 0',
+    '__eel_division_by_zero_message:',
+    '.ascii "%s"' % X86_DIVISION_BY_ZERO_MESSAGE.replace('\n', '\\n'),
+    '__eel_in_buf:',
+    '.space %d' % X86_IN_BUFFER_SIZE
+]
 
-        return var_entities
 
-    def get_current_framelength(self):
-        return 12 + self.get_var_entities_on_scope(self.scopes[-1]) * 4
+class X86Gen:
+    """Generates x86-64 assembly for GNU as, to run natively on Linux.
 
+    It lays out frames like FinalGen, with the offsets the symbol table gives
+    scaled by X86_SLOT_SCALE and %rbp in the role of $sp: the static link
+    is at -8(%rbp), the arguments from -24(%rbp) on, and the frame of the
+    main program is in %rbx. The caller writes the arguments and the static
+    link where the frame of the callee will be, below its own %rsp, and
+    results come back in %eax. None of the MIPS specific options apply."""
 
-class FinalGen:
-    def __init__(self, table, quad_gen=None):
+    def __init__(self, table, quad_gen=None, options=None, sink=None):
         self.table = table
         self.quad_gen = quad_gen
+        self.options = options if options is not None else CompileOptions()
+        self.sink = sink
+        self.flushed = False
         self.generated = []
+        self.data = []
+
+    def slot(self, offset):
+        return offset * X86_SLOT_SCALE
 
     def gnlvcode(self, var):
-        ret = []
-        ret.append('lw $t0, -4($sp)')
+        ret = ['movq -8(%rbp), %rcx']
         lookup_res = self.table.lookup(var)
 
         for i in range(self.table.get_current_nesting_level() -
-                       lookup_res.nesting_level):
-            ret.append('lw $t0, -4($t0)')
+                       lookup_res.nesting_level - 1):
+            ret.append('movq -8(%rcx), %rcx')
 
-        ret.append('add $t0, $t0, -%d' % lookup_res.entity.offset)
         return ret
 
-    def store_load_rv(self, reg, var, lookup_res, func):
-        current_nesting_level = self.table.get_current_nesting_level()
+    def operand(self, var):
+        """Returns the instructions that find var and the memory operand
+        it is at, which may use %rcx."""
+        lookup_res = self.table.lookup(var)
+        offset = self.slot(lookup_res.entity.offset)
+        is_ref = isinstance(lookup_res.entity, ParameterEntity) and \
+            lookup_res.entity.mode == 'ref'
         if lookup_res.nesting_level == 0:
-            return [
-                '%s $t%s, -%d($s0)' % (func, reg, lookup_res.entity.offset)
-            ]
-        elif lookup_res.nesting_level == current_nesting_level:
-            if isinstance(lookup_res.entity, ParameterEntity) and \
-                    lookup_res.entity.mode == 'ref':
-                return [
-                    'lw $t0, -%d($sp)' % lookup_res.entity.offset,
-                    '%s $t%s, ($t0)' % (func, reg)
-                ]
+            return [], '-%d(%%rbx)' % offset
 
-            return [
-                '%s $t%s, -%d($sp)' % (func, reg, lookup_res.entity.offset)
-            ]
+        if lookup_res.nesting_level == \
+                self.table.get_current_nesting_level():
+            ret = []
+            base = '%rbp'
         else:
-            gnlvret = self.gnlvcode(var)
-
-            if isinstance(lookup_res.entity, ParameterEntity) and \
-                    lookup_res.entity.mode == 'ref':
-                return gnlvret + [
-                    'lw $t0, ($t0)',
-                    '%s $t%s, ($t0)' % (func, reg)
-                ]
+            ret = self.gnlvcode(var)
+            base = '%rcx'
 
-            return gnlvret + ['%s $t%d, ($t0)' % (func, reg)]
+        if is_ref:
+            return ret + ['movq -%d(%s), %%rcx' % (offset, base)], '(%rcx)'
+        return ret, '-%d(%s)' % (offset, base)
 
     def isconst(self, var):
         try:
@@ -515,14 +4077,21 @@ class FinalGen:
 
     def loadvr(self, var, reg):
         if self.isconst(var):
-            return ['li $t%s, %s' % (reg, var)]
+            return ['movl $%s, %s' % (var, reg)]
 
-        lookup_res = self.table.lookup(var)
-        return self.store_load_rv(reg, var, lookup_res, 'lw')
+        ret, operand = self.operand(var)
+        return ret + ['movl %s, %s' % (operand, reg)]
 
     def storerv(self, reg, var):
-        lookup_res = self.table.lookup(var)
-        return self.store_load_rv(reg, var, lookup_res, 'sw')
+        ret, operand = self.operand(var)
+        return ret + ['movl %s, %s' % (reg, operand)]
+
+    def address_of(self, var):
+        # leaves the address of var in %rcx
+        ret, operand = self.operand(var)
+        if operand == '(%rcx)':
+            return ret
+        return ret + ['leaq %s, %%rcx' % operand]
 
     def generate_block(self):
         current_level = self.table.get_current_nesting_level()
@@ -530,209 +4099,590 @@ class FinalGen:
             start_quad = 0
         else:
             start_quad = self.table.get_cause_of_birth().start_quad
+        end = self.quad_gen.nextquad()
 
         quads = self.quad_gen.get_and_mark_quads_from(start_quad)
-
+        code = []
         par_quads = []
         for i, quad in enumerate(quads):
             if quad.op == 'par':
                 par_quads += [quad]
+            elif quad.op == 'call':
+                code += self.call_sequence(par_quads, quad)
+                par_quads = []
             else:
-                if quad.op == 'call':
-                    self.generated += self.precall_set_fp(quad.term0)
-
-                if len(par_quads) > 0:
-                    self.generated += self.setup_parameters(par_quads)
-                    par_quads = []
-
-                self.generated += self.translate_quad(quad)
-
-        if current_level is not 0:
-            self.generated += self.jump_to_ra()
+                code += self.translate_quad(quad, quads[i + 1:])
 
-    def precall_set_fp(self, func_name):
-        lookup_res = self.table.lookup(func_name)
-        return ['add $fp, $sp, %s' % lookup_res.entity.frame_length]
-
-    def jump_to_ra(self):
-        return ['lw $ra, ($sp)', 'jr $ra']
+        if current_level != 0:
+            code += ['L_%s:' % end, 'leave', 'ret']
+        self.generated += code
+        self.flush()
 
     def generate_jump_to_main(self):
-        self.generated += ['j L_0']
+        self.generated += ['jmp L_0']
 
     def generate_program_exit(self, quad_id):
-        self.generated += ['L_%s:' % quad_id, 'li $v0, 10', 'syscall']
+        self.generated += [
+            'L_%s:' % quad_id, 'movl $60, %eax', 'xorl %edi, %edi', 'syscall'
+        ] + X86_RUNTIME
+        self.data += X86_RUNTIME_DATA
+        self.flush()
 
     def new_scope_setup(self):
-        framelength = self.table.get_current_framelength()
-        if self.table.get_current_nesting_level() == 0:
-            main = ['move $s0, $sp']
-        else:
-            main = []
-
-        return ['add $sp, $sp, %s' % framelength, 'sw $ra, ($sp)'] + main
+        # the frame is rounded up to keep %rsp 16-byte aligned
+        frame_length = self.slot(self.table.get_current_framelength())
+        frame_length = (frame_length + 15) // 16 * 16
+        main = ['movq %rbp, %rbx'] if \
+            self.table.get_current_nesting_level() == 0 else []
+        return ['pushq %rbp', 'movq %rsp, %rbp',
+                'subq $%d, %%rsp' % frame_length] + main
 
     def init_call(self, func_name):
+        # the return address and the saved %rbp of the callee come between
+        # our %rsp and its frame
+        current_level = self.table.get_current_nesting_level()
         lookup_res = self.table.lookup(func_name)
-        if self.table.get_current_nesting_level == lookup_res.nesting_level:
-            return ['lw $t0, -4($sp)', 'sw $t0, -4($fp)']
+        if current_level == lookup_res.nesting_level:
+            return ['movq %rbp, -24(%rsp)']
 
-        return ['sw $sp, -4($fp)']
+        ret = ['movq -8(%rbp), %rcx']
+        for i in range(current_level - lookup_res.nesting_level - 1):
+            ret.append('movq -8(%rcx), %rcx')
 
-    def exit_scope(self, func):
-        framelength = self.table.lookup(func).entity.frame_length
-        return ['add $sp, $sp -%s' % framelength]
+        return ret + ['movq %rcx, -24(%rsp)']
 
     def setup_parameters(self, quads):
         ret = []
-
-        i = 0
-        for quad in quads:
-            qid = ['L_%s:' % quad.id]
-            ret += qid
-
+        for i, quad in enumerate(quads):
+            slot = 16 + self.slot(12 + 4 * i)
             if quad.term1 == 'cv':
-                ret += self.loadvr(quad.term0, 0)
-                ret += ['sw $t0, -%s($fp)' % (12 + i * 4)]
-
+                ret += self.loadvr(quad.term0, '%eax') + [
+                    'movl %%eax, -%d(%%rsp)' % slot
+                ]
             if quad.term1 == 'ref':
-                caller_nesting_level = self.table.get_current_nesting_level()
-                lookup_res_var = self.table.lookup(quad.term0)
-                if caller_nesting_level == lookup_res_var.nesting_level:
-                    if isinstance(lookup_res_var.entity, ParameterEntity
-                                  ) and lookup_res_var.entity.mode == 'ref':
-                        ret += [
-                            'lw $t0, -%s($sp)' % lookup_res_var.entity.offset,
-                            'sw $t0, -%s($fp)' % (12 + 4 * i)
-                        ]
-                    else:
-                        ret += [
-                            'add $t0, $sp, -%s' % lookup_res_var.entity.offset,
-                            'sw $t0, -%s($fp)' % (12 + 4 * i)
-                        ]
-                else:
-                    ret += self.gnlvcode(quad.term0)
-
-                    if isinstance(lookup_res_var.entity, ParameterEntity
-                                  ) and lookup_res_var.entity.mode == 'ref':
-                        ret += [
-                            'lw $t0, ($t0)',
-                            'sw $t0, -%s($fp)' % (12 + 4 * i)
-                        ]
-                    else:
-                        ret += ['sw $t0, -%s($fp)' % (12 + 4 * i)]
-
-            if quad.term1 == 'ret':
-                lookup_res = self.table.lookup(quad.term0)
-                ret += [
-                    'add $t0, $sp, -%s' % lookup_res.entity.offset,
-                    'sw $t0, -8($fp)'
+                ret += self.address_of(quad.term0) + [
+                    'movq %%rcx, -%d(%%rsp)' % slot
                 ]
+        return ret
 
-            i += 1
+    def call_sequence(self, par_quads, call_quad):
+        ret = ['L_%s:' % quad.id for quad in par_quads + [call_quad]]
+        ret += self.setup_parameters(par_quads)
+        ret += self.init_call(call_quad.term0)
+        ret += [
+            'call L_%s' % self.table.lookup(call_quad.term0).entity.start_quad
+        ]
 
+        ret_quads = [quad for quad in par_quads if quad.term1 == 'ret']
+        if len(ret_quads) > 0:
+            ret += self.storerv('%eax', ret_quads[0].term0)
         return ret
 
-    def translate_quad(self, quad):
+    def translate_quad(self, quad, following):
         qid = ['L_%s:' % quad.id]
 
         if quad.op == 'begin_block':
-            return qid + ['%s:' % quad.term0] + self.new_scope_setup()
+            return qid + self.new_scope_setup()
 
         if quad.op == ':=':
-            return qid + self.loadvr(quad.term0, 1) + self.storerv(
-                1, quad.target)
-
-        if quad.op == 'int' or quad.op == 'par':
-            return qid + []
+            return qid + self.loadvr(quad.term0, '%eax') + self.storerv(
+                '%eax', quad.target)
 
-        if quad.op == '+':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['add $t1, $t1, $t2'] + self.storerv(
-                    1, quad.target)
+        if quad.op in ('int', 'nop', 'jtarget'):
+            return qid
 
-        if quad.op == '-':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['sub $t1, $t1, $t2'] + self.storerv(
-                    1, quad.target)
+        if quad.op == 'end_block':
+            # its label goes with the return generate_block adds
+            return []
 
-        if quad.op == '*':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['mul $t1, $t1, $t2'] + self.storerv(
-                    1, quad.target)
+        # the second operand goes last, as finding it may take %rcx
+        if quad.op in X86_ARITHMETIC:
+            return qid + self.loadvr(quad.term0, '%eax') + self.loadvr(
+                quad.term1, '%ecx') + [
+                    '%s %%ecx, %%eax' % X86_ARITHMETIC[quad.op]
+                ] + self.storerv('%eax', quad.target)
 
         if quad.op == '/':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['div $t1, $t1, $t2'] + self.storerv(
-                    1, quad.target)
+            # idivl traps on the one quotient that doesn't fit, which wraps
+            # around instead, like div
+            return qid + self.loadvr(quad.term0, '%eax') + self.loadvr(
+                quad.term1, '%ecx') + [
+                    'testl %ecx, %ecx', 'jz __eel_division_by_zero',
+                    'cmpl $-1, %ecx',
+                    'jne L_%s_divide' % quad.id, 'negl %eax',
+                    'jmp L_%s_divided' % quad.id,
+                    'L_%s_divide:' % quad.id, 'cltd', 'idivl %ecx',
+                    'L_%s_divided:' % quad.id
+                ] + self.storerv('%eax', quad.target)
 
         if quad.op == 'jump':
-            return qid + ['j L_%s' % quad.target]
-
-        if quad.op == '=':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['beq $t1, $t2, L_%s' % quad.target]
-
-        if quad.op == '<>':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['bne $t1, $t2, L_%s' % quad.target]
-
-        if quad.op == '>':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['bgt $t1, $t2, L_%s' % quad.target]
-
-        if quad.op == '<':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['blt $t1, $t2, L_%s' % quad.target]
+            return qid + ['jmp L_%s' % quad.target]
 
-        if quad.op == '>=':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['bge $t1, $t2, L_%s' % quad.target]
+        if quad.op == 'jtable':
+            # the jtarget quads that follow make up the table
+            self.data += ['JT_%s:' % quad.id]
+            for target in following:
+                if target.op != 'jtarget':
+                    break
+                self.data += ['.quad L_%s' % target.target]
+            return qid + self.loadvr(quad.term0, '%eax') + [
+                'subl $%s, %%eax' % quad.term1, 'movslq %eax, %rax',
+                'leaq JT_%s(%%rip), %%rcx' % quad.id,
+                'jmp *(%rcx,%rax,8)'
+            ]
 
-        if quad.op == '<=':
-            return qid + self.loadvr(quad.term0, 1) + self.loadvr(
-                quad.term1, 2) + ['ble $t1, $t2, L_%s' % quad.target]
+        if quad.op in X86_JUMPS:
+            return qid + self.loadvr(quad.term0, '%eax') + self.loadvr(
+                quad.term1, '%ecx') + [
+                    'cmpl %ecx, %eax',
+                    '%s L_%s' % (X86_JUMPS[quad.op], quad.target)
+                ]
 
         if quad.op == 'retv':
-            return qid + self.loadvr(quad.term0, 1) + [
-                'lw $t0, -8($sp)', 'sw $t1, ($t0)'
-            ] + self.jump_to_ra()
-
-        if quad.op == 'call':
-            return self.init_call(quad.term0) + qid + ['jal %s' % quad.term0
-                                                       ] + self.exit_scope(
-                                                           quad.term0)
-
-        if quad.op == 'end_block':
-            return qid + []
+            return qid + self.loadvr(quad.term0, '%eax') + ['leave', 'ret']
 
         if quad.op == 'out':
-            return qid + self.loadvr(quad.term0, 1) + [
-                'li $v0, 1', 'move $a0, $t1', 'syscall', 'li $a0, 0xA',
-                'li $v0, 0XB', 'syscall'
+            return qid + self.loadvr(quad.term0, '%edi') + [
+                'call __eel_print_int'
             ]
 
         if quad.op == 'inp':
-            return qid + ['li $v0, 5', 'syscall', 'move $t3, $v0'
-                          ] + self.storerv(3, quad.term0)
+            return qid + ['call __eel_read_int'] + self.storerv(
+                '%eax', quad.term0)
 
         raise Exception('Unsupported quad type to translate: %s' % str(quad))
 
+    def flush(self):
+        """Like FinalGen.flush, starting with the entry point."""
+        if self.sink is None:
+            return
+        if not self.flushed:
+            write_asm(self.sink, ['.text', '.globl _start', '_start:'])
+            self.flushed = True
+        if len(self.data) > 0:
+            write_asm(self.sink, ['.data'] + self.data + ['.text'])
+        write_asm(self.sink, self.generated)
+        self.generated = []
+        self.data = []
+
     def formatted(self):
+        lines = ['.text', '.globl _start', '_start:'] + self.generated
+        if len(self.data) > 0:
+            lines = ['.data'] + self.data + lines
         return '\n'.join('\t%s' % line if not line.endswith(':') else line
-                         for line in self.generated)
+                         for line in lines) + '\n'
+
+
+# where the simulator puts the sections of a program, like SPIM does
+MIPS_TEXT_BASE = 0x00400000
+MIPS_MEMORY_BASE = 0x10000000
+MIPS_DATA_BASE = 0x10010000
+# the frames of the generated code grow upwards from here
+MIPS_STACK_BASE = 0x10100000
+MIPS_MEMORY_SIZE = 0x00400000
+MIPS_REGISTERS = ('zero', 'at', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3', 't0',
+                  't1', 't2', 't3', 't4', 't5', 't6', 't7', 's0', 's1', 's2',
+                  's3', 's4', 's5', 's6', 's7', 't8', 't9', 'k0', 'k1', 'gp',
+                  'sp', 'fp', 'ra')
+MIPS_BRANCHES = {
+    'beq': lambda a, b: a == b,
+    'bne': lambda a, b: a != b,
+    'bgt': lambda a, b: a > b,
+    'blt': lambda a, b: a < b,
+    'bge': lambda a, b: a >= b,
+    'ble': lambda a, b: a <= b
+}
+MIPS_ARITHMETIC = {
+    'add': lambda a, b: a + b,
+    'addu': lambda a, b: a + b,
+    'addi': lambda a, b: a + b,
+    'addiu': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'subu': lambda a, b: a - b,
+    'mul': lambda a, b: a * b,
+    'div': checked_divide,
+    'rem': lambda a, b: a - b * checked_divide(a, b),
+    'and': lambda a, b: a & b,
+    'andi': lambda a, b: a & b,
+    'or': lambda a, b: a | b,
+    'ori': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b,
+    'sll': lambda a, b: a << (b & 31),
+    'srl': lambda a, b: (a & 0xffffffff) >> (b & 31),
+    'sra': lambda a, b: a >> (b & 31),
+    'slt': lambda a, b: int(a < b)
+}
+MIPS_UNARY = {'move': lambda a: a, 'neg': lambda a: -a, 'abs': abs}
+MIPS_LOAD_SIZES = {'lw': 4, 'lb': 1, 'lbu': 1, 'lh': 2, 'lhu': 2}
+MIPS_STORE_SIZES = {'sw': 4, 'sb': 1, 'sh': 2}
+# cycles lost refetching after a jump or a taken branch
+TAKEN_BRANCH_PENALTY = 1
+MAX_SIMULATED_INSTRUCTIONS = 10**9
+LABEL = re.compile(r'\A([A-Za-z_.$][\w.$]*):\s*(.*)\Z')
+
+# exit_code: what the program passed to the exit syscall, 0 if it ran off
+#   the end of its code
+# instructions: how many instructions it ran
+# cycles: an estimate of the cycles they took on an in-order core that
+#   stalls on the latencies of a LatencyModel
+# label_hits: label: how many times the instruction after it ran, for the
+#   labels that were reached
+SimulationResult = namedtuple(
+    'SimulationResult', ['exit_code', 'instructions', 'cycles', 'label_hits'])
+
+
+class ProgramExit(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class MipsSimulator:
+    """Runs the MIPS assembly FinalGen writes, with the syscalls of SPIM for
+    I/O, and counts what it runs.
+
+    Every instruction is decoded once into a function that does it and
+    returns the index of the next one. Memory is big-endian, like on the
+    32-bit MIPS qemu-mips runs. The program ends with an exit syscall or by
+    running past its last instruction; jumping anywhere else outside the
+    code is a VMError."""
+
+    def __init__(self, text, latency_model=None,
+                 max_instructions=MAX_SIMULATED_INSTRUCTIONS):
+        self.latency_model = latency_model if latency_model is not None \
+            else LatencyModel()
+        self.max_instructions = max_instructions
+        self.registers = [0] * len(MIPS_REGISTERS)
+        self.memory = bytearray(MIPS_MEMORY_SIZE)
+        self.instructions = []
+        # label: its address
+        self.labels = {}
+        # label: the index of the instruction it is on
+        self.text_labels = {}
+        self.words = []
+        self.data_end = MIPS_DATA_BASE
+        self.assemble(text)
+        for address, value in self.words:
+            self.store(address, 4, self.value_of(value))
+        self.code = [
+            self.decode(instruction) for instruction in self.instructions
+        ]
+
+    def assemble(self, text):
+        section = '.text'
+        for line in text.split('\n'):
+            line = line.split('#')[0].strip()
+            match = LABEL.match(line)
+            while match is not None:
+                name, line = match.groups()
+                if name in self.labels:
+                    raise VMError('Label defined twice: %s' % name)
+                if section == '.text':
+                    self.labels[name] = MIPS_TEXT_BASE + 4 * len(
+                        self.instructions)
+                    self.text_labels[name] = len(self.instructions)
+                else:
+                    self.labels[name] = self.data_end
+                match = LABEL.match(line)
+            if line == '':
+                continue
+
+            if line in ('.data', '.text'):
+                section = line
+            elif line.startswith('.'):
+                self.directive(line)
+            else:
+                self.instructions.append(parse_mips(line))
+
+    def directive(self, line):
+        name, _, rest = line.partition(' ')
+        if name == '.space':
+            self.data_end += int(rest, 0)
+        elif name == '.word':
+            for value in rest.split(','):
+                self.words.append((self.data_end, value.strip()))
+                self.data_end += 4
+        elif name == '.align':
+            alignment = 1 << int(rest)
+            self.data_end = (self.data_end + alignment - 1) // alignment * \
+                alignment
+        else:
+            raise VMError('Unsupported directive: %s' % line)
+
+    def value_of(self, text):
+        if text in self.labels:
+            return self.labels[text]
+        try:
+            return int(text, 0)
+        except ValueError:
+            raise VMError('Unknown label: %s' % text)
+
+    def register(self, text):
+        try:
+            return MIPS_REGISTERS.index(text.lstrip('$'))
+        except ValueError:
+            raise VMError('Unknown register: %s' % text)
+
+    def target(self, label):
+        if label not in self.text_labels:
+            raise VMError('Unknown label: %s' % label)
+        return self.text_labels[label]
+
+    def load(self, address, size, signed=True):
+        index = address - MIPS_MEMORY_BASE
+        if index < 0 or index + size > MIPS_MEMORY_SIZE:
+            raise VMError('Invalid memory access at 0x%x.' % address)
+        return int.from_bytes(self.memory[index:index + size],
+                              'big',
+                              signed=signed)
+
+    def store(self, address, size, value):
+        index = address - MIPS_MEMORY_BASE
+        if index < 0 or index + size > MIPS_MEMORY_SIZE:
+            raise VMError('Invalid memory access at 0x%x.' % address)
+        self.memory[index:index + size] = (value % 2**(8 * size)).to_bytes(
+            size, 'big')
+
+    def decode(self, instruction):
+        """Returns a function that runs the instruction, the registers it
+        reads and writes and its latency."""
+        step = self.decode_step(instruction)
+        uses = [self.register(reg) for reg in instruction.uses]
+        defs = [
+            self.register(reg) for reg in instruction.defs if reg != '$zero'
+        ]
+        return step, uses, defs, self.latency_model.latency(instruction)
+
+    def decode_step(self, instruction):
+        r = self.registers
+        op = instruction.op
+        operands = instruction.operands
+
+        if op in MIPS_ARITHMETIC:
+            function = MIPS_ARITHMETIC[op]
+            d, a = self.register(operands[0]), self.register(operands[1])
+            if operands[2].startswith('$'):
+                b = self.register(operands[2])
+
+                def step(pc):
+                    r[d] = to_signed(function(r[a], r[b]))
+                    return pc + 1
+            else:
+                value = self.value_of(operands[2])
+
+                def step(pc):
+                    r[d] = to_signed(function(r[a], value))
+                    return pc + 1
+
+            return step
+
+        if op in MIPS_UNARY:
+            function = MIPS_UNARY[op]
+            d, a = self.register(operands[0]), self.register(operands[1])
+
+            def step(pc):
+                r[d] = to_signed(function(r[a]))
+                return pc + 1
+
+            return step
+
+        if op in ('li', 'la'):
+            d = self.register(operands[0])
+            value = to_signed(self.value_of(operands[1]))
+
+            def step(pc):
+                r[d] = value
+                return pc + 1
+
+            return step
+
+        if op in MIPS_LOAD_SIZES or op in MIPS_STORE_SIZES:
+            reg = self.register(operands[0])
+            match = MEMORY_OPERAND.match(operands[1])
+            if match is None:
+                offset, base = self.value_of(operands[1]), 0
+            else:
+                offset = int(match.group(1) or '0')
+                base = self.register(match.group(2))
+            load, store = self.load, self.store
+
+            if op in MIPS_STORE_SIZES:
+                size = MIPS_STORE_SIZES[op]
+
+                def step(pc):
+                    store(r[base] + offset, size, r[reg])
+                    return pc + 1
+            else:
+                size = MIPS_LOAD_SIZES[op]
+                signed = not op.endswith('u')
+
+                def step(pc):
+                    r[reg] = load(r[base] + offset, size, signed)
+                    return pc + 1
+
+            return step
+
+        if op in MIPS_BRANCHES:
+            function = MIPS_BRANCHES[op]
+            a = self.register(operands[0])
+            destination = self.target(operands[2])
+            if operands[1].startswith('$'):
+                b = self.register(operands[1])
+
+                def step(pc):
+                    return destination if function(r[a], r[b]) else pc + 1
+            else:
+                value = self.value_of(operands[1])
+
+                def step(pc):
+                    return destination if function(r[a], value) else pc + 1
+
+            return step
+
+        if op == 'j':
+            destination = self.target(operands[0])
+            return lambda pc: destination
+
+        if op == 'jal':
+            destination = self.target(operands[0])
+            ra = self.register('$ra')
+
+            def step(pc):
+                r[ra] = MIPS_TEXT_BASE + 4 * (pc + 1)
+                return destination
+
+            return step
+
+        if op == 'jr':
+            a = self.register(operands[0])
+            end = MIPS_TEXT_BASE + 4 * len(self.instructions)
+
+            def step(pc):
+                if not MIPS_TEXT_BASE <= r[a] < end or r[a] % 4 != 0:
+                    raise VMError('Jump to 0x%x, outside the code.' %
+                                  (r[a] % 2**32))
+                return (r[a] - MIPS_TEXT_BASE) // 4
+
+            return step
+
+        if op == 'nop':
+            return lambda pc: pc + 1
+
+        if op == 'syscall':
+            return self.syscall
+
+        raise VMError('Unsupported instruction: %s' % instruction.text)
+
+    def syscall(self, pc):
+        r = self.registers
+        code = r[self.register('$v0')]
+        a0 = r[self.register('$a0')]
+        if code == 1:
+            self.stdout.write('%d' % a0)
+        elif code == 4:
+            start = a0 - MIPS_MEMORY_BASE
+            end = self.memory.find(0, start) if start >= 0 else -1
+            if end < 0:
+                raise VMError('Invalid string at 0x%x.' % a0)
+            self.stdout.write(self.memory[start:end].decode('latin-1'))
+        elif code == 5:
+            r[self.register('$v0')] = self.reader.read()
+        elif code == 8:
+            # reads at most $a1 - 1 characters of a line, then a null byte
+            line = self.stdin.readline()[:max(0, r[self.register('$a1')] - 1)]
+            for i, char in enumerate(line.encode('latin-1') + b'\0'):
+                self.store(a0 + i, 1, char)
+        elif code == 10:
+            raise ProgramExit(0)
+        elif code == 11:
+            self.stdout.write(chr(a0 & 0xff))
+        elif code == 17:
+            raise ProgramExit(a0)
+        else:
+            raise VMError('Unsupported syscall: %d' % code)
+        return pc + 1
+
+    def run(self, stdin=None, stdout=None):
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.reader = IntReader(self.stdin)
+        r = self.registers
+        r[self.register('$sp')] = r[self.register('$fp')] = MIPS_STACK_BASE
+
+        code = self.code
+        counts = [0] * len(code)
+        # register: the cycle its value is ready on
+        ready = [0] * len(r)
+        cycle = 0
+        executed = 0
+        exit_code = 0
+        pc = 0
+        try:
+            while 0 <= pc < len(code):
+                step, uses, defs, latency = code[pc]
+                counts[pc] += 1
+                executed += 1
+                if executed > self.max_instructions:
+                    raise VMError('Ran more than %d instructions.' %
+                                  self.max_instructions)
+
+                issue = cycle
+                for reg in uses:
+                    if ready[reg] > issue:
+                        issue = ready[reg]
+                cycle = issue + 1
+                for reg in defs:
+                    ready[reg] = issue + latency
+
+                next_pc = step(pc)
+                # writes to $zero are discarded
+                r[0] = 0
+                if next_pc != pc + 1:
+                    cycle += TAKEN_BRANCH_PENALTY
+                pc = next_pc
+        except ProgramExit as e:
+            exit_code = e.code
+        finally:
+            self.stdout.flush()
+
+        return SimulationResult(
+            exit_code=exit_code,
+            instructions=executed,
+            cycles=cycle,
+            label_hits=dict((name, counts[index])
+                            for name, index in self.text_labels.items()
+                            if index < len(code) and counts[index] > 0))
 
 
 class SyntaxAnal:
-    def __init__(self, tokens):
+    def __init__(self,
+                 tokens,
+                 options=None,
+                 subprograms=None,
+                 generate_final=True,
+                 quad_sink=None,
+                 final_sink=None):
         self.tokens = tokens
         self.exits = []
         self.table = SymbolTable()
-        self.quad_gen = QuadGenerator(table=self.table)
+        # with sinks, the quads and the final code are written as each block
+        # ends and only those of the blocks still open are kept
+        self.quad_gen = QuadGenerator(table=self.table, sink=quad_sink)
         self.last_pos = None
         self.returns_of_scopes = []
         self.inside_repeat = 0
-        self.final = FinalGen(self.table, self.quad_gen)
+        self.options = options if options is not None else CompileOptions()
+        # None when only the quads are needed
+        self.final = None
+        if generate_final and self.options.target == 'x86-64':
+            self.final = X86Gen(self.table, self.quad_gen, self.options,
+                                final_sink)
+        elif generate_final:
+            self.final = FinalGen(self.table, self.quad_gen, self.options,
+                                  final_sink)
+        # a SubprogramCache to take the code of unchanged subprograms from
+        self.subprograms = subprograms
+        self.reused_subprograms = 0
 
     def ensure_we_do_not_redeclare(self, name):
         if self.table.lookup_on_current_scope(name) is not None:
@@ -742,7 +4692,8 @@ class SyntaxAnal:
     def check_syntax(self):
         self.parse_program()
         if len(self.tokens) > 0:
-            raise Exception('Unexpected token after endprogram.')
+            raise CompilationError(pos=self.tokens[0].pos,
+                                   msg='Unexpected token after endprogram.')
 
     def peek_type(self):
         return self.tokens[0].type
@@ -760,18 +4711,27 @@ class SyntaxAnal:
 
     def peek(self, type):
         if len(self.tokens) == 0:
-            raise Exception('Unexpected EOF. Maybe endprogram is missing.')
+            raise CompilationError(
+                pos=self.last_pos
+                if self.last_pos is not None else CursorPosition(1, 1),
+                msg='Unexpected end of file.',
+                suggestion='Maybe endprogram is missing.')
         return self.peek_type() == type
 
     def parse_program(self):
         self.consume('program')
         name = self.consume('id').value
-        self.final.generate_jump_to_main()
+        if self.final is not None:
+            self.final.generate_jump_to_main()
         self.quad_gen.genquad('begin_block', name, '_', '_')
         self.parse_block()
-        self.final.generate_program_exit(self.quad_gen.nextquad())
+        if self.final is not None:
+            self.final.generate_program_exit(self.quad_gen.nextquad())
         self.quad_gen.genquad('halt', '_', '_', '_')
         self.quad_gen.genquad('end_block', name, '_', '_')
+        if self.quad_gen.sink is not None:
+            # the quads after the block of the main program
+            self.quad_gen.get_and_mark_quads_from(0)
         self.consume('endprogram')
 
     def parse_block(self):
@@ -781,7 +4741,12 @@ class SyntaxAnal:
         self.parse_statements()
 
         self.table.fill_in_framelength_on_callee()
-        self.final.generate_block()
+        if self.final is not None:
+            self.final.generate_block()
+        elif self.quad_gen.sink is not None:
+            self.quad_gen.get_and_mark_quads_from(
+                0 if self.table.get_current_nesting_level() == 0 else
+                self.table.get_cause_of_birth().start_quad)
         self.table.destroy_scope()
 
     def parse_declarations(self):
@@ -809,27 +4774,42 @@ class SyntaxAnal:
             self.parse_procorfunc()
 
     def parse_procorfunc(self):
+        key = self.subprogram_key()
+        entry = None if key is None else self.subprograms.get(key)
+        if entry is not None:
+            self.reuse_subprogram(entry)
+            return
+
+        start_quad = self.quad_gen.nextquad()
+        temp_id = self.quad_gen.temp_id
+        tokens = len(self.tokens)
+        if key is not None:
+            code_start = len(self.final.generated)
+            data_start = len(self.final.data)
+            counters = self.counters()
         if self.peek('procedure'):
             self.consume('procedure')
             name = self.consume('id').value
             self.ensure_we_do_not_redeclare(name)
-            self.table.add_entity(
-                FunctionEntity(
-                    name, self.quad_gen.nextquad(), type='procedure'))
+            entity = FunctionEntity(
+                name, self.quad_gen.nextquad(), type='procedure')
+            self.table.add_entity(entity)
+            self.quad_gen.parameters[entity.start_quad] = entity.arguments
             self.quad_gen.genquad('begin_block', name, '_', '_')
             self.parse_procorfuncbody()
-            self.quad_gen.genquad('end_block', name, '_', '_')
+            self.gen_end_block(name)
             self.consume('endprocedure')
         else:
             self.consume('function')
             name = self.consume('id').value
             self.ensure_we_do_not_redeclare(name)
-            self.table.add_entity(
-                FunctionEntity(name, self.quad_gen.nextquad()))
+            entity = FunctionEntity(name, self.quad_gen.nextquad())
+            self.table.add_entity(entity)
+            self.quad_gen.parameters[entity.start_quad] = entity.arguments
             self.returns_of_scopes.append([])
             self.quad_gen.genquad('begin_block', name, '_', '_')
             self.parse_procorfuncbody()
-            self.quad_gen.genquad('end_block', name, '_', '_')
+            self.gen_end_block(name)
             self.consume('endfunction')
 
             our_returns = self.returns_of_scopes.pop()
@@ -839,6 +4819,214 @@ class SyntaxAnal:
                     msg='End of function block and no return found.',
                     suggestion='Did you forget to return?')
 
+        if key is not None:
+            self.subprograms.put(
+                key,
+                self.compiled_subprogram(start_quad, temp_id, code_start,
+                                         data_start, counters,
+                                         tokens - len(self.tokens)))
+
+    def gen_end_block(self, name):
+        self.quad_gen.genquad('end_block', name, '_', '_')
+        if self.quad_gen.sink is not None:
+            # the block it ends has been generated already, so it is
+            # released now rather than kept until the enclosing block ends
+            self.quad_gen.get_and_mark_quads_from(self.quad_gen.nextquad() -
+                                                  1)
+
+    def can_reuse_subprograms(self):
+        # the inliner and the specializer copy the quads of the callees,
+        # which the fingerprint of their callers doesn't cover, and streamed
+        # code is gone by the time the subprogram ends
+        return self.subprograms is not None and isinstance(
+            self.final, FinalGen) and self.final.sink is None and \
+            not self.options.inline_budget and not self.options.max_clones
+
+    def subprogram_span(self):
+        """Returns the tokens of the subprogram about to be parsed, None if
+        it never ends."""
+        depth = 0
+        for i, token in enumerate(self.tokens):
+            if token.type in ('procedure', 'function'):
+                depth += 1
+            elif token.type in ('endprocedure', 'endfunction'):
+                depth -= 1
+                if depth == 0:
+                    return self.tokens[:i + 1]
+        return None
+
+    def subprogram_key(self):
+        """Returns the key of the subprogram about to be parsed in the
+        SubprogramCache, None if it can't be reused."""
+        if not self.can_reuse_subprograms():
+            return None
+        span = self.subprogram_span()
+        if span is None:
+            return None
+
+        names = sorted(
+            set(token.value for token in span if token.type == 'id'))
+        fingerprint = (self.table.get_current_nesting_level(),
+                       [(token.type, token.value) for token in span],
+                       [(name, self.describe(name)) for name in names])
+        return self.subprograms.key('subprogram %r' % (fingerprint, ),
+                                    self.options)
+
+    def describe(self, name):
+        """Returns what compiling a subprogram that names name may depend
+        on."""
+        lookup_res = self.table.lookup(name)
+        if lookup_res is None:
+            return None
+
+        entity = lookup_res.entity
+        description = (lookup_res.nesting_level, type(entity).__name__,
+                       getattr(entity, 'offset', None),
+                       getattr(entity, 'mode', None))
+        if isinstance(entity, FunctionEntity):
+            description += (entity.type, [(arg.name, arg.mode)
+                                          for arg in entity.arguments],
+                            entity.frame_length,
+                            self.final.frame_info.get(entity.start_quad),
+                            self.final.pure.get(entity.start_quad))
+        return description
+
+    def counters(self):
+        unroller = self.final.unroller
+        scheduler = self.final.scheduler
+        return ([0, 0] if unroller is None else
+                [unroller.unrolled_loops, unroller.copies]) + (
+                    [0, 0] if scheduler is None else
+                    [scheduler.cycles_before, scheduler.cycles_after])
+
+    def add_to_counters(self, counters):
+        if self.final.unroller is not None:
+            self.final.unroller.unrolled_loops += counters[0]
+            self.final.unroller.copies += counters[1]
+        if self.final.scheduler is not None:
+            self.final.scheduler.cycles_before += counters[2]
+            self.final.scheduler.cycles_after += counters[3]
+
+    def compiled_subprogram(self, start_quad, temp_id, code_start,
+                            data_start, counters, tokens):
+        """Returns the SubprogramEntry of the subprogram just parsed."""
+        entity = self.table.last_entity()
+        end = self.quad_gen.nextquad()
+        final = self.final
+        # the subprograms declared outside of it are called by name
+        names = dict((outer.start_quad, outer.name)
+                     for scope in self.table.scopes
+                     for outer in scope.entities
+                     if isinstance(outer, FunctionEntity))
+
+        def relative(quad_id):
+            return quad_id - start_quad if start_quad <= quad_id < end \
+                else None
+
+        blocks = []
+        for block in sorted(
+                quad_id for quad_id in final.spans
+                if isinstance(quad_id, int) and start_quad <= quad_id < end):
+            (code_lo, code_hi), (data_lo, data_hi) = final.spans[block]
+            parent = final.call_graph.parents[block]
+            blocks.append([
+                block - start_quad, final.call_graph.names[block],
+                None if block == start_quad else relative(parent),
+                [[relative(callee),
+                  names.get(callee, final.call_graph.names.get(callee))]
+                 for callee in sorted(final.call_graph.callees[block])],
+                [code_lo - code_start, code_hi - code_start],
+                [data_lo - data_start, data_hi - data_start],
+                final.frame_info[block], final.pure[block]
+            ])
+
+        added = [now - then for now, then in zip(self.counters(), counters)]
+        return SubprogramEntry(
+            kind=entity.type,
+            tokens=tokens,
+            arguments=[[arg.name, arg.mode] for arg in entity.arguments],
+            frame_length=entity.frame_length,
+            quads=[
+                list(relocate_quad(quad, -start_quad, -temp_id))
+                for quad in self.quad_gen.quad_list[start_quad:end]
+            ],
+            marked=self.quad_gen.marked[start_quad:end],
+            temps=self.quad_gen.temp_id - temp_id,
+            parameters=[[
+                block[0], [[arg.name, arg.mode]
+                           for arg in self.quad_gen.parameters[block[0] +
+                                                               start_quad]]
+            ] for block in blocks],
+            blocks=blocks,
+            generated=[
+                relocate_labels(line, -start_quad, -counters[1])
+                for line in final.generated[code_start:]
+            ],
+            data=[
+                relocate_labels(line, -start_quad, -counters[1])
+                for line in final.data[data_start:]
+            ],
+            counters=added)
+
+    def reuse_subprogram(self, entry):
+        """Parses the subprogram about to be parsed by splicing in the code
+        of entry."""
+        self.consume(entry.kind)
+        name = self.consume('id').value
+        self.ensure_we_do_not_redeclare(name)
+        start_quad = self.quad_gen.nextquad()
+        entity = FunctionEntity(name,
+                                start_quad,
+                                [Argument(*arg) for arg in entry.arguments],
+                                entry.frame_length,
+                                type=entry.kind)
+        self.table.add_entity(entity)
+        self.last_pos = self.tokens[entry.tokens - 3].pos
+        del self.tokens[:entry.tokens - 2]
+
+        temp_id = self.quad_gen.temp_id
+        for quad in entry.quads:
+            self.quad_gen.quad_list.append(
+                relocate_quad(Quad(*quad), start_quad, temp_id))
+        self.quad_gen.marked += entry.marked
+        self.quad_gen.quad_id += len(entry.quads)
+        self.quad_gen.temp_id += entry.temps
+        for block, arguments in entry.parameters:
+            self.quad_gen.parameters[block + start_quad] = \
+                entity.arguments if block == 0 else [
+                    Argument(*arg) for arg in arguments]
+
+        final = self.final
+        scopes = self.table.scopes
+        parent = scopes[-2].entities[-1].start_quad if len(scopes) > 1 else 0
+        code_start = len(final.generated)
+        data_start = len(final.data)
+        copies = self.counters()[1]
+        final.generated += [
+            relocate_labels(line, start_quad, copies)
+            for line in entry.generated
+        ]
+        final.data += [
+            relocate_labels(line, start_quad, copies) for line in entry.data
+        ]
+        for block, block_name, block_parent, callees, code_span, data_span, \
+                frame_info, pure in entry.blocks:
+            final.call_graph.add(
+                block + start_quad, block_name,
+                parent if block_parent is None else block_parent + start_quad,
+                [
+                    self.table.lookup(callee_name).entity.start_quad
+                    if callee is None else callee + start_quad
+                    for callee, callee_name in callees
+                ])
+            final.spans[block + start_quad] = (
+                (code_start + code_span[0], code_start + code_span[1]),
+                (data_start + data_span[0], data_start + data_span[1]))
+            final.frame_info[block + start_quad] = FrameInfo(*frame_info)
+            final.pure[block + start_quad] = pure
+        self.add_to_counters(entry.counters)
+        self.reused_subprograms += 1
+
     def parse_procorfuncbody(self):
         self.parse_formalpars()
         self.parse_block()
@@ -968,16 +5156,24 @@ class SyntaxAnal:
         self.consume('switch')
         expr = self.parse_expression()
 
-        jumps_when_done = self.parse_case(expr)
+        cases = [self.parse_case(expr)]
         while self.peek('case'):
-            jumps_when_done += self.parse_case(expr)
+            cases.append(self.parse_case(expr))
 
         self.consume('endswitch')
+        jumps_when_done = [case.jump_when_done for case in cases]
+        if self.options.lower_switches and \
+                len(cases) >= SWITCH_LOWERING_MIN_CASES and \
+                all(case.value is not None for case in cases):
+            jumps_when_done += self.lower_switch(expr, cases)
         self.quad_gen.backpatch(jumps_when_done, self.quad_gen.nextquad())
 
     def parse_case(self, expr1):
         self.consume('case')
+        before_expr = self.quad_gen.nextquad()
         expr2 = self.parse_expression()
+        is_constant = self.quad_gen.nextquad() == before_expr and \
+            expr2.isdigit()
 
         neq_quad = self.quad_gen.nextquad()
         self.quad_gen.genquad('<>', expr1, expr2, '_')
@@ -987,7 +5183,61 @@ class SyntaxAnal:
         jump_when_done = self.quad_gen.nextquad()
         self.quad_gen.genquad('jump', '_', '_', '_')
         self.quad_gen.backpatch([neq_quad], self.quad_gen.nextquad())
-        return [jump_when_done]
+        return SwitchCase(
+            value=int(expr2) if is_constant else None,
+            test_quad=neq_quad,
+            jump_when_done=jump_when_done)
+
+    def lower_switch(self, expr, cases):
+        """Replaces the linear chain of comparisons of a switch over integer
+        constants with a dispatch placed after the last case: a jump table if
+        the values are dense, a binary decision tree otherwise. Returns the
+        quads that jump to the end of the switch when nothing matches."""
+        bodies = {}
+        for case in cases:
+            # the first of several cases with the same value wins
+            bodies.setdefault(case.value, case.test_quad + 1)
+
+        self.quad_gen.rewrite(cases[0].test_quad, 'jump', '_', '_',
+                              self.quad_gen.nextquad())
+
+        low, high = min(bodies), max(bodies)
+        size = high - low + 1
+        if size <= JUMP_TABLE_MAX_SIZE and \
+                len(bodies) >= JUMP_TABLE_MIN_DENSITY * size:
+            return self.gen_jump_table(expr, low, high, bodies)
+
+        return self.gen_decision_tree(expr, sorted(bodies.items()))
+
+    def gen_jump_table(self, expr, low, high, bodies):
+        out_of_range = [self.quad_gen.nextquad()]
+        self.quad_gen.genquad('<', expr, str(low), '_')
+        out_of_range.append(self.quad_gen.nextquad())
+        self.quad_gen.genquad('>', expr, str(high), '_')
+
+        self.quad_gen.genquad('jtable', expr, str(low), '_')
+        missing = []
+        for value in range(low, high + 1):
+            if value not in bodies:
+                missing.append(self.quad_gen.nextquad())
+            self.quad_gen.genquad('jtarget', '_', '_', bodies.get(value, '_'))
+
+        return out_of_range + missing
+
+    def gen_decision_tree(self, expr, cases):
+        if len(cases) <= DECISION_TREE_LEAF_SIZE:
+            for value, body in cases:
+                self.quad_gen.genquad('=', expr, str(value), body)
+            no_match = self.quad_gen.nextquad()
+            self.quad_gen.genquad('jump', '_', '_', '_')
+            return [no_match]
+
+        middle = len(cases) // 2
+        to_lower_half = self.quad_gen.nextquad()
+        self.quad_gen.genquad('<', expr, str(cases[middle][0]), '_')
+        no_match = self.gen_decision_tree(expr, cases[middle:])
+        self.quad_gen.backpatch([to_lower_half], self.quad_gen.nextquad())
+        return no_match + self.gen_decision_tree(expr, cases[:middle])
 
     def parse_forcasestat(self):
         self.consume('forcase')
@@ -1060,7 +5310,12 @@ class SyntaxAnal:
         self.consume('oparen')
         pars = self.parse_actualparlist()
         self.consume('cparen')
-        return pars
+
+        # par quads are only generated once every argument has been
+        # evaluated, so calls nested in the arguments don't interleave theirs
+        for par, mode in pars:
+            self.quad_gen.genquad('par', par, mode, '_')
+        return [mode for par, mode in pars]
 
     def parse_actualparlist(self):
         pars = []
@@ -1076,13 +5331,11 @@ class SyntaxAnal:
         if self.peek('in'):
             self.consume('in')
             par = self.parse_expression()
-            self.quad_gen.genquad('par', par, 'cv', '_')
-            return 'cv'
+            return par, 'cv'
         else:
             self.consume('inout')
             par = self.consume('id').value
-            self.quad_gen.genquad('par', par, 'ref', '_')
-            return 'ref'
+            return par, 'ref'
 
     def parse_condition(self):
         b = TrueFalse()
@@ -1259,28 +5512,980 @@ class SyntaxAnal:
         return ''
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('source_file')
-    args = parser.parse_args()
+# what compiling a source can give: its tokens, quads and final code
+EMITS = ('tokens', 'quads', 'asm')
+
+
+def emit_list(text):
+    """Parses the value of --emit: some of EMITS, separated by commas."""
+    emit = text.split(',')
+    for what in emit:
+        if what not in EMITS:
+            raise argparse.ArgumentTypeError(
+                'invalid choice: %s (choose from %s)' %
+                (what, ', '.join(EMITS)))
+    return emit
 
-    basename = os.path.basename(args.source_file)
-    sourcename = basename.split('.')[0]
-    intermediate_filename = '%s.eeli' % sourcename
-    final_filename = '%s.s' % sourcename
 
-    with open(args.source_file, 'r') as source_file:
-        source = source_file.read()
+# tokens: the tokens of the source, None if it has an invalid one
+# intermediate: the text of the .eeli file, None if compiling failed
+# final: the text of the final code, None if compiling failed
+# error: the CompilationError compiling failed with, None if it didn't
+CompileResult = namedtuple('CompileResult',
+                           ['tokens', 'intermediate', 'final', 'error'])
+
+
+def compile_source(text, options=None, subprograms=None, emit=EMITS):
+    """Compiles the EEL source text and returns a CompileResult.
+
+    Only the phases emit needs run: tokens alone just need the lexer, and
+    the final code is only generated when asked for. The intermediate code
+    is None unless emit has quads and the final code unless it has asm;
+    without either, the source is still checked. Everything a compilation
+    changes belongs to it, so any number of them can run at the same time on
+    a thread pool.
+    A SubprogramCache may be shared by all of them."""
+    options = options if options is not None else CompileOptions()
+    tokens = None
     try:
-        tokens = Lexer(source).tokenize()
-        syntax_anal = SyntaxAnal(tokens)
+        tokens = Lexer(text).tokenize()
+        if set(emit) == set(['tokens']):
+            return CompileResult(tokens=tokens,
+                                 intermediate=None,
+                                 final=None,
+                                 error=None)
+        syntax_anal = SyntaxAnal(list(tokens), options, subprograms,
+                                 'asm' in emit)
         syntax_anal.check_syntax()
-        print('Putting intermediate code in [%s]...' % intermediate_filename)
-        with open(intermediate_filename, 'w') as intermediate_file:
-            intermediate_file.write(str(syntax_anal.quad_gen))
-        print('Putting final code in [%s]...' % final_filename)
-        with open(final_filename, 'w') as s_file:
-            s_file.write(syntax_anal.final.formatted())
     except CompilationError as e:
-        print('%s:%s\n' % (args.source_file, str(e)))
-        sys.exit(1)
+        return CompileResult(tokens=tokens,
+                             intermediate=None,
+                             final=None,
+                             error=e)
+    return CompileResult(
+        tokens=tokens,
+        intermediate=str(syntax_anal.quad_gen) if 'quads' in emit else None,
+        final=final_code(syntax_anal, options) if 'asm' in emit else None,
+        error=None)
+
+
+async def compile_source_async(text,
+                               options=None,
+                               subprograms=None,
+                               emit=EMITS,
+                               executor=None):
+    """Like compile_source, but run on executor (the default executor of
+    the event loop if None) so that the event loop isn't held up."""
+    # asyncio takes longer to import than the rest of the compiler; whoever
+    # awaits this has imported it already
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, compile_source, text, options, subprograms, emit)
+
+
+# source_file: the path of the EEL file
+# error: why it failed to compile, None if it didn't
+# seconds: how long compiling it took
+# cached: whether it came out of the cache, None if there was no cache
+CompileReport = namedtuple('CompileReport',
+                           ['source_file', 'error', 'seconds', 'cached'])
+
+# intermediate: the text of the .eeli file, None if compiling failed
+# final: the text of the final code, None if compiling failed
+# error: the CompilationError compiling failed with, None if it didn't
+CacheEntry = namedtuple('CacheEntry', ['intermediate', 'final', 'error'])
+
+# the cache evicts the least recently used entries beyond this size
+CACHE_MAX_BYTES = 256 * 2**20
+# eviction goes down to max_bytes less this fraction of it, so the directory
+# is only listed again once that much more has been written
+CACHE_EVICT_FRACTION = 8
+
+
+class CompileCache:
+    """Keeps what compiling a source gave in a directory, under a hash of
+    the source, the options and the compiler itself.
+
+    Every entry is a JSON file, written to a temporary file first and then
+    renamed into place, so several compilers can share a directory. Reading
+    an entry touches it. The size of the directory is kept track of as
+    entries are written, and once it goes over max_bytes the least recently
+    used entries are evicted until it is back under max_bytes less
+    1/CACHE_EVICT_FRACTION of it. Entries that can't be written are left
+    out. hits and misses count the lookups of this object, and compile_batch
+    adds those of its processes to them."""
+
+    entry_type = CacheEntry
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # the size of the directory, None until it is first listed
+        self.size = None
+        with open(__file__, 'rb') as compiler_file:
+            self.compiler_digest = hashlib.sha256(
+                compiler_file.read()).hexdigest()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, options):
+        # a latency model is an object, which is told apart by its class
+        model = options.latency_model
+        options = options._replace(
+            latency_model=None if model is None else '%s.%s' %
+            (type(model).__module__, type(model).__qualname__))
+        text = '%s\0%r\0%s' % (self.compiler_digest, tuple(options), source)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'r') as entry_file:
+                entry = self.entry_type(**json.load(entry_file))
+            os.utime(self.path(key))
+        except (OSError, ValueError, TypeError):
+            # missing, or evicted or replaced while we were reading it
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        # the cache is best-effort: an entry that can't be written (a full
+        # disk, a read-only or vanished directory) is left out
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        except OSError:
+            return
+        data = json.dumps(entry._asdict()).encode()
+        try:
+            with os.fdopen(fd, 'wb') as entry_file:
+                entry_file.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        if self.size is None or self.size + len(data) > self.max_bytes:
+            self.evict()
+        else:
+            self.size += len(data)
+
+    def evict(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        if size > self.max_bytes:
+            limit = self.max_bytes - self.max_bytes // CACHE_EVICT_FRACTION
+            for mtime, entry_size, name in sorted(entries):
+                if size <= limit:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                size -= entry_size
+        self.size = size
+
+
+# the code of a subprogram and of the ones nested in it, with quad ids,
+# temporaries and labels relative to its begin_block quad and first temporary
+# kind: 'procedure' or 'function'
+# tokens: how many tokens it spans, from procedure or function to its end
+# arguments: [name, mode] of each of its formal parameters
+# frame_length: the length of its frame, as its callers set it up
+# quads: [id, op, term0, term1, target] of each of its quads
+# marked: which of them its blocks took, all but its own end_block
+# temps: how many temporaries compiling it made
+# parameters: [start_quad, arguments] of it and each subprogram nested in it
+# blocks: [start_quad, name, parent, callees, code span, data span,
+#   frame_info, pure] of each of them, the parent None for the subprogram
+#   itself and every callee a [start_quad, name], the start_quad None for
+#   subprograms declared outside of it
+# generated: its lines of final code
+# data: its lines of data
+# counters: what it added to the counters of the LoopUnroller (loops
+#   unrolled, copies made) and the MipsScheduler (cycles before and after)
+SubprogramEntry = namedtuple('SubprogramEntry', [
+    'kind', 'tokens', 'arguments', 'frame_length', 'quads', 'marked', 'temps',
+    'parameters', 'blocks', 'generated', 'data', 'counters'
+])
+
+# labels made of the id of a quad or the start_quad of a subprogram, and of
+# the number of the copy of an unrolled loop the quad is in
+QUAD_LABEL = re.compile(r'(L_|JT_|M_)(\d+)(_u(\d+))?')
+TEMP_NAME = re.compile(r'\AT_(\d+)\Z')
+
+
+def relocate_quad(quad, quad_offset, temp_offset):
+    def term(value):
+        match = TEMP_NAME.match(value) if isinstance(value, str) else None
+        if match is None:
+            return value
+        return 'T_%d' % (int(match.group(1)) + temp_offset)
+
+    target = quad.target + quad_offset if quad.op in JUMP_OPS and \
+        isinstance(quad.target, int) else term(quad.target)
+    return Quad(quad.id + quad_offset, quad.op, term(quad.term0),
+                term(quad.term1), target)
+
+
+def relocate_labels(line, quad_offset, copy_offset):
+    def relocate(match):
+        label = '%s%d' % (match.group(1), int(match.group(2)) + quad_offset)
+        if match.group(3) is None:
+            return label
+        return '%s_u%d' % (label, int(match.group(4)) + copy_offset)
+
+    return QUAD_LABEL.sub(relocate, line)
+
+
+class SubprogramCache(CompileCache):
+    """Keeps the code of single subprograms, under a hash of their
+    fingerprint: their tokens and what the symbols they name were when
+    they were compiled.
+
+    SyntaxAnal looks every subprogram up before parsing it and splices in
+    the code of the ones it finds, after moving it to where the quads,
+    temporaries and final code of the program are up to. compile_file keeps
+    them in the directory of its CompileCache, next to whole programs."""
+
+    entry_type = SubprogramEntry
+
+
+def compile_entry(source, options, subprograms=None):
+    """Compiles source and returns a CacheEntry with what came out. With a
+    SubprogramCache, the subprograms it has seen before aren't compiled
+    again."""
+    result = compile_source(source, options, subprograms)
+    return CacheEntry(
+        intermediate=result.intermediate,
+        final=result.final,
+        error=None if result.error is None else str(result.error))
+
+
+def output_filename(source_file, options, what, output_dir='.'):
+    """Returns the path of the file what ('tokens', 'quads' or 'asm') of a
+    source file goes in."""
+    sourcename = os.path.basename(source_file).split('.')[0]
+    extension = {
+        'tokens': 'tokens',
+        'quads': 'eeli',
+        'asm': 'c' if options.target == 'c' else 's'
+    }[what]
+    return os.path.join(output_dir, '%s.%s' % (sourcename, extension))
+
+
+def output_filenames(source_file, options, output_dir='.'):
+    """Returns the paths of the intermediate and final code of a source
+    file."""
+    return (output_filename(source_file, options, 'quads', output_dir),
+            output_filename(source_file, options, 'asm', output_dir))
+
+
+def output_text(what, tokens, intermediate, final):
+    if what == 'tokens':
+        return ''.join('%s\n' % format_token(token) for token in tokens)
+    return intermediate if what == 'quads' else final
+
+
+def final_code(syntax_anal, options):
+    if options.target == 'c':
+        return CGen(syntax_anal.quad_gen).source()
+    return syntax_anal.final.formatted()
+
+
+def find_sources(paths):
+    """Returns the paths given, with the directories among them replaced
+    by the .eel files in them."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources += sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith('.eel'))
+        else:
+            sources.append(path)
+    return sources
+
+
+def compile_file(source_file,
+                 options,
+                 output_dir='.',
+                 cache=None,
+                 emit=('quads', 'asm')):
+    """Compiles a source file into output_dir without printing anything and
+    returns a CompileReport. Only what emit asks for is generated and
+    written. With a CompileCache, sources it has seen before aren't compiled
+    again, and neither are the subprograms of the ones it hasn't that it has
+    seen before. The cache keeps the intermediate and final code, so it is
+    only looked up when emit asks for the final code and not the tokens."""
+    start = time.perf_counter()
+    error = None
+    cached = None
+    try:
+        with open(source_file, 'r') as f:
+            source = f.read()
+        subprograms = None
+        if cache is not None:
+            try:
+                subprograms = SubprogramCache(cache.directory,
+                                              cache.max_bytes)
+            except OSError:
+                pass
+        tokens = None
+        if cache is not None and 'asm' in emit and 'tokens' not in emit:
+            key = cache.key(source, options)
+            entry = cache.get(key)
+            cached = entry is not None
+            if entry is None:
+                entry = compile_entry(source, options, subprograms)
+                cache.put(key, entry)
+        else:
+            result = compile_source(source, options, subprograms, emit)
+            tokens = result.tokens
+            entry = CacheEntry(
+                intermediate=result.intermediate,
+                final=result.final,
+                error=None if result.error is None else str(result.error))
+
+        if entry.error is not None:
+            error = '%s:%s' % (source_file, entry.error)
+        else:
+            for what in [what for what in EMITS if what in emit]:
+                with open(
+                        output_filename(source_file, options, what,
+                                        output_dir), 'w') as output_file:
+                    output_file.write(
+                        output_text(what, tokens, entry.intermediate,
+                                    entry.final))
+    except Exception as e:
+        error = '%s: %s' % (source_file, str(e))
+    return CompileReport(source_file, error, time.perf_counter() - start,
+                         cached)
+
+
+def compile_batch(source_files,
+                  options,
+                  output_dir='.',
+                  jobs=None,
+                  cache=None,
+                  emit=('quads', 'asm')):
+    """Compiles the source files in up to jobs processes at a time (as many
+    as there are cores by default) and returns their CompileReports, in the
+    same order. Raises a ValueError if two of them would be written to the
+    same files. The hits and misses of the cache in the processes are added
+    to those of cache."""
+    written = {}
+    for source_file in source_files:
+        output = output_filename(source_file, options, 'asm', output_dir)
+        if output in written:
+            raise ValueError(
+                '[%s] and [%s] would both be written to [%s]' %
+                (written[output], source_file, output))
+        written[output] = source_file
+    # a few chunks per process, so that one slow file doesn't hold up many
+    chunksize = max(1, len(source_files) // (8 * (os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        reports = list(
+            executor.map(compile_file,
+                         source_files,
+                         repeat(options),
+                         repeat(output_dir),
+                         repeat(cache),
+                         repeat(emit),
+                         chunksize=chunksize))
+    if cache is not None:
+        cache.hits += len([report for report in reports if report.cached])
+        cache.misses += len(
+            [report for report in reports if report.cached is False])
+    return reports
+
+
+# the compile server forgets the least recently used responses beyond these
+SERVER_MEMORY_ENTRIES = 256
+
+
+def compile_request(request, subprograms=None):
+    """Answers a request of the compile server: compiles its source with its
+    options and returns what it asked to emit, along with the diagnostics
+    compiling it gave. With a SubprogramCache, the subprograms it has seen
+    before aren't compiled again."""
+    try:
+        source = request['source']
+        emit = request.get('emit', ['asm'])
+        options = CompileOptions(**request.get('options', {}))
+        validate_options(options)
+        if options.latency_model is not None:
+            raise ValueError('latency_model can only be given in-process')
+        if not isinstance(source, str) or not set(emit) <= set(EMITS):
+            raise ValueError('expected a source and some of %s' %
+                             ', '.join(EMITS))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return {'error': 'Invalid request: %s' % e}
+
+    response = {'error': None, 'diagnostics': []}
+    try:
+        result = compile_source(source, options, subprograms, emit)
+    except Exception as e:
+        response['diagnostics'].append({
+            'row': None,
+            'col': None,
+            'message': str(e),
+            'suggestion': None
+        })
+        return response
+
+    if 'tokens' in emit and result.tokens is not None:
+        response['tokens'] = [[
+            token.type, token.value, token.pos.row, token.pos.col
+        ] for token in result.tokens]
+    if result.error is not None:
+        response['diagnostics'].append({
+            'row': result.error.pos.row,
+            'col': result.error.pos.col,
+            'message': result.error.msg,
+            'suggestion': result.error.suggestion
+        })
+        return response
+    if 'quads' in emit:
+        response['quads'] = result.intermediate
+    if 'asm' in emit:
+        response['asm'] = result.final
+    return response
+
+
+def serve_request(request, cache=None):
+    """Answers a request in a process of the compile server, looking its
+    subprograms up in the directory of a CompileCache, and returns the
+    response with the hits and misses of the lookups, for the server to add
+    up."""
+    subprograms = None
+    if cache is not None:
+        try:
+            subprograms = SubprogramCache(cache.directory, cache.max_bytes)
+        except OSError:
+            pass
+    response = compile_request(request, subprograms)
+    if subprograms is None:
+        return response, 0, 0
+    return response, subprograms.hits, subprograms.misses
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    """Reads requests off a connection, a JSON object per line, and writes
+    back a line of JSON for each."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'error': 'Invalid request: %s' % e}
+            else:
+                response = self.server.respond(request)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class CompileServer(socketserver.ThreadingUnixStreamServer):
+    """Compiles the sources its clients send over a Unix domain socket.
+
+    Every connection gets a thread, which hands its requests to a pool of
+    up to jobs processes (one per core by default) that stay up between
+    requests. The responses to the last memory_entries requests are kept in
+    memory and sent again when the same request comes back, and with a
+    CompileCache the subprograms of the sources seen before aren't compiled
+    again; its hits and misses add up the lookups of every process."""
+
+    daemon_threads = True
+
+    def __init__(self,
+                 path,
+                 jobs=None,
+                 cache=None,
+                 memory_entries=SERVER_MEMORY_ENTRIES):
+        super().__init__(path, CompileRequestHandler)
+        self.executor = ProcessPoolExecutor(max_workers=jobs)
+        self.cache = cache
+        self.memory_entries = memory_entries
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+
+    def respond(self, request):
+        key = json.dumps(request, sort_keys=True)
+        with self.lock:
+            self.requests += 1
+            response = self.responses.pop(key, None)
+            if response is not None:
+                self.hits += 1
+                self.responses[key] = response
+                return response
+
+        response, hits, misses = self.executor.submit(
+            serve_request, request, self.cache).result()
+        with self.lock:
+            if self.cache is not None:
+                self.cache.hits += hits
+                self.cache.misses += misses
+            self.responses[key] = response
+            while len(self.responses) > self.memory_entries:
+                del self.responses[next(iter(self.responses))]
+        return response
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'source_files',
+        nargs='*',
+        metavar='source_file',
+        help='EEL file to compile; several files or a directory of .eel '
+        'files are compiled in parallel')
+    parser.add_argument(
+        '-o',
+        '--output-dir',
+        default='.',
+        metavar='DIR',
+        help='write what is emitted to DIR (default: the current '
+        'directory), or to stdout if DIR is -')
+    parser.add_argument(
+        '--emit',
+        type=emit_list,
+        metavar='WHAT',
+        help='what to write, separated by commas: the tokens to '
+        '<name>.tokens, the quads to <name>.eeli and the final code to '
+        '<name>.s or <name>.c; only the phases they need run (default: '
+        'quads,asm)')
+    parser.add_argument(
+        '--check-only',
+        action='store_true',
+        help='only report the errors of the source, without generating the '
+        'final code or writing anything')
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='write the quads and the final code of each block as soon as it '
+        'is generated and forget them, so that memory is bounded by the '
+        'deepest nesting rather than the size of the program; the quads are '
+        'written in the order their blocks end. Which subprograms are dead '
+        'is only known once the whole program is generated, so this implies '
+        '--keep-dead-subprograms')
+    parser.add_argument(
+        '--ir-format',
+        choices=('text', 'binary'),
+        default='text',
+        help='write <name>.eeli as text (the default) or in the binary '
+        'format IRReader loads')
+    parser.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        help='keep the output of every compilation in DIR and reuse it when '
+        'the same source is compiled again with the same options')
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=CACHE_MAX_BYTES // 2**20,
+        metavar='MB',
+        help='evict the least recently used entries of --cache-dir beyond '
+        'MB megabytes (default: %d)' % (CACHE_MAX_BYTES // 2**20))
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        metavar='N',
+        help='compile several files in up to N processes at a time '
+        '(default: one per core)')
+    parser.add_argument(
+        '--serve',
+        metavar='SOCKET',
+        help='instead of compiling, listen on the Unix domain socket SOCKET '
+        'for sources to compile, each with its own options, in --jobs '
+        'processes and with --cache-dir, until interrupted')
+    parser.add_argument(
+        '--calling-convention',
+        choices=CALLING_CONVENTIONS,
+        default='stack',
+        help='pass the first four `in` arguments in $a0-$a3 and return '
+        'values in $v0 (registers), or everything on the stack (stack)')
+    parser.add_argument(
+        '--no-trim-frames',
+        dest='trim_frames',
+        action='store_false',
+        help='always save $ra and set up the static link, even for leaf '
+        'subprograms and subprograms that never use it')
+    parser.add_argument(
+        '--schedule',
+        action='store_true',
+        help='reorder the generated MIPS to separate loads from their uses')
+    parser.add_argument(
+        '--no-switch-lowering',
+        dest='lower_switches',
+        action='store_false',
+        help='always compile switch statements to a linear chain of '
+        'comparisons')
+    parser.add_argument(
+        '--buffered-io',
+        action='store_true',
+        help='buffer the output of print and the input of input in memory '
+        'instead of making a syscall for each of them')
+    parser.add_argument(
+        '--inline-budget',
+        type=int,
+        default=0,
+        metavar='N',
+        help='inline calls to non-recursive subprograms of at most N quads '
+        '(0, the default, disables inlining)')
+    parser.add_argument(
+        '--keep-dead-subprograms',
+        dest='eliminate_dead_subprograms',
+        action='store_false',
+        help='emit code for subprograms that are never called')
+    parser.add_argument(
+        '--call-graph',
+        metavar='FILE',
+        help='write the call graph of the program to FILE in DOT format')
+    parser.add_argument(
+        '--memoize',
+        action='store_true',
+        help='cache the results of pure recursive functions in a table')
+    parser.add_argument(
+        '--memo-size',
+        type=int,
+        default=256,
+        metavar='N',
+        help='number of entries of each memo table, a power of two '
+        '(default: 256)')
+    parser.add_argument(
+        '--no-tail-calls',
+        dest='tail_calls',
+        action='store_false',
+        help='compile calls in tail position like any other call')
+    parser.add_argument(
+        '--unroll',
+        dest='unroll_factor',
+        type=int,
+        default=0,
+        metavar='FACTOR',
+        help='unroll loops with a constant number of iterations, completely '
+        'if they fit in --unroll-max-quads or else FACTOR times (0, the '
+        'default, disables unrolling)')
+    parser.add_argument(
+        '--unroll-max-quads',
+        type=int,
+        default=64,
+        metavar='N',
+        help='largest number of quads an unrolled loop may take up '
+        '(default: 64)')
+    parser.add_argument(
+        '--max-clones',
+        type=int,
+        default=0,
+        metavar='N',
+        help='make up to N copies of subprograms specialised for the literal '
+        'arguments they are called with (0, the default, disables '
+        'specialisation)')
+    parser.add_argument(
+        '--no-stack-slot-sharing',
+        dest='share_stack_slots',
+        action='store_false',
+        help='give every temporary its own slot in the frame, even when its '
+        'lifetime doesn\'t overlap another one\'s')
+    parser.add_argument(
+        '--target',
+        choices=TARGETS,
+        default='mips',
+        help='write MIPS assembly to <name>.s (mips), x86-64 assembly for '
+        'Linux to <name>.s (x86-64) or a C program to <name>.c (c)')
+    parser.add_argument(
+        '--run',
+        action='store_true',
+        help='run the program on the quad interpreter after compiling it, '
+        'reading its input from stdin')
+    parser.add_argument(
+        '--runner',
+        choices=('quads', 'python'),
+        default='quads',
+        help='what --run runs the program on: the quad interpreter (quads) '
+        'or the program translated to Python (python)')
+    parser.add_argument(
+        '--quad-counts',
+        metavar='FILE',
+        help='with --run, write how many times each quad ran to FILE')
+    parser.add_argument(
+        '--simulate',
+        action='store_true',
+        help='run the MIPS code on the built-in simulator after compiling '
+        'it, reading its input from stdin, and report how many instructions '
+        'and cycles it took')
+    parser.add_argument(
+        '--label-counts',
+        metavar='FILE',
+        help='with --simulate, write how many times the code at each label '
+        'ran to FILE')
+    args = parser.parse_args()
+    if args.quad_counts is not None and args.runner != 'quads':
+        parser.error('--quad-counts needs --runner=quads')
+    if args.simulate and args.target != 'mips':
+        parser.error('--simulate needs --target=mips')
+    if args.call_graph is not None and args.target == 'x86-64':
+        parser.error('--call-graph needs --target=mips or --target=c')
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.serve is not None:
+        if len(args.source_files) > 0:
+            parser.error('--serve takes no source files')
+        cache = None
+        if args.cache_dir is not None:
+            cache = CompileCache(args.cache_dir, args.cache_size * 2**20)
+        server = CompileServer(args.serve, args.jobs, cache)
+        print('Serving on [%s]...' % args.serve)
+        sys.stdout.flush()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print('Answered %d requests, %d of them from memory.' %
+                  (server.requests, server.hits))
+            if cache is not None:
+                print('Found %d subprograms in the cache and missed %d.' %
+                      (cache.hits, cache.misses))
+        sys.exit(0)
+    if len(args.source_files) == 0:
+        parser.error('the following arguments are required: source_file')
+    if args.check_only and (args.emit is not None or args.run or
+                            args.simulate or args.call_graph is not None):
+        parser.error('--check-only takes no --emit, --run, --simulate or '
+                     '--call-graph')
+    emit = [] if args.check_only else args.emit or ['quads', 'asm']
+    if args.simulate and 'asm' not in emit:
+        parser.error('--simulate needs --emit to include asm')
+    # '-' writes what is emitted to stdout, and nothing else
+    to_stdout = args.output_dir == '-'
+    source_files = find_sources(args.source_files)
+    batch = len(source_files) != 1 or os.path.isdir(args.source_files[0])
+    if batch and (args.run or args.simulate or args.call_graph is not None
+                  or to_stdout):
+        parser.error('--run, --simulate, --call-graph and -o - take a single '
+                     'source file')
+    if args.stream and (batch or to_stdout or args.run or args.simulate or
+                        args.target == 'c'):
+        parser.error('--stream takes a single source file and no -o -, '
+                     '--run, --simulate or --target=c')
+    if args.ir_format == 'binary' and (batch or to_stdout or args.stream):
+        parser.error('--ir-format=binary takes a single source file and no '
+                     '-o - or --stream')
+    options = CompileOptions(
+        calling_convention=args.calling_convention,
+        trim_frames=args.trim_frames,
+        schedule=args.schedule,
+        lower_switches=args.lower_switches,
+        buffered_io=args.buffered_io,
+        inline_budget=args.inline_budget,
+        # streamed blocks are written before it is known which are dead
+        eliminate_dead_subprograms=args.eliminate_dead_subprograms and
+        not args.stream,
+        memoize=args.memoize,
+        memo_size=args.memo_size,
+        tail_calls=args.tail_calls,
+        unroll_factor=args.unroll_factor,
+        unroll_max_quads=args.unroll_max_quads,
+        max_clones=args.max_clones,
+        share_stack_slots=args.share_stack_slots,
+        target=args.target)
+    try:
+        validate_options(options)
+    except ValueError as e:
+        parser.error(str(e))
+    if not to_stdout:
+        os.makedirs(args.output_dir, exist_ok=True)
+    cache = None
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, args.cache_size * 2**20)
+
+    if batch:
+        start = time.perf_counter()
+        try:
+            reports = compile_batch(source_files, options, args.output_dir,
+                                    args.jobs, cache, emit)
+        except ValueError as e:
+            parser.error(str(e))
+        failed = [report for report in reports if report.error is not None]
+        for report in failed:
+            print(report.error)
+        print('Compiled %d files in %.2fs, %d failed.' %
+              (len(reports), time.perf_counter() - start, len(failed)))
+        if len(reports) > 0:
+            slowest = max(reports, key=lambda report: report.seconds)
+            print('Spent %.2fs compiling, %.2fs of it on [%s].' %
+                  (sum(report.seconds for report in reports),
+                   slowest.seconds, slowest.source_file))
+        if cache is not None:
+            print('Reused the cached output of %d of them.' % cache.hits)
+        sys.exit(1 if len(failed) > 0 else 0)
+    args.source_file = source_files[0]
+    descriptions = {
+        'tokens': 'tokens',
+        'quads': 'intermediate code',
+        'asm': 'final code'
+    }
+    final = None
+
+    # --run, --simulate and --call-graph need more than the cache keeps
+    if cache is not None and not to_stdout and not args.run and \
+            not args.simulate and args.call_graph is None and \
+            not args.stream and args.ir_format == 'text':
+        report = compile_file(args.source_file, options, args.output_dir,
+                              cache, emit)
+        if report.error is not None:
+            print('%s\n' % report.error)
+            sys.exit(1)
+        for what in [what for what in EMITS if what in emit]:
+            print('Putting %s in [%s]...' %
+                  (descriptions[what],
+                   output_filename(args.source_file, options, what,
+                                   args.output_dir)))
+        if report.cached:
+            print('Reused the cached output of an identical compilation.')
+    else:
+        with open(args.source_file, 'r') as source_file:
+            source = source_file.read()
+        # what is written while compiling: its file
+        sinks = {}
+        try:
+            tokens = Lexer(source).tokenize()
+            if args.stream:
+                for what in [what for what in ('quads', 'asm')
+                             if what in emit]:
+                    filename = output_filename(args.source_file, options,
+                                               what, args.output_dir)
+                    print('Putting %s in [%s]...' % (descriptions[what],
+                                                     filename))
+                    sinks[what] = open(filename, 'w')
+            # the tokens alone don't need parsing, and only the final code
+            # and the call graph need FinalGen
+            syntax_anal = None
+            intermediate = None
+            if set(emit) != set(['tokens']) or args.run:
+                syntax_anal = SyntaxAnal(
+                    list(tokens), options,
+                    None if cache is None else SubprogramCache(
+                        cache.directory, cache.max_bytes), 'asm' in emit
+                    or args.call_graph is not None, sinks.get('quads'),
+                    sinks.get('asm'))
+                syntax_anal.check_syntax()
+                intermediate = str(syntax_anal.quad_gen)
+            if 'asm' in emit and 'asm' not in sinks:
+                final = final_code(syntax_anal, options)
+            if args.ir_format == 'binary' and 'quads' in emit:
+                intermediate = encode_ir(syntax_anal.quad_gen)
+            for what in [what for what in EMITS
+                         if what in emit and what not in sinks]:
+                text = output_text(what, tokens, intermediate, final)
+                if to_stdout:
+                    sys.stdout.write(text if text.endswith('\n') else
+                                     text + '\n')
+                    continue
+                filename = output_filename(args.source_file, options, what,
+                                           args.output_dir)
+                print('Putting %s in [%s]...' % (descriptions[what],
+                                                 filename))
+                with open(filename, 'wb' if isinstance(text, bytes) else
+                          'w') as output_file:
+                    output_file.write(text)
+            if args.call_graph is not None:
+                print('Putting call graph in [%s]...' % args.call_graph)
+                with open(args.call_graph, 'w') as dot_file:
+                    dot_file.write(syntax_anal.final.call_graph.to_dot())
+            if syntax_anal is not None and isinstance(
+                    syntax_anal.final, FinalGen) and not to_stdout:
+                if syntax_anal.final.inliner is not None:
+                    print('Inlined %d calls.' %
+                          syntax_anal.final.inliner.inlined_calls)
+                if syntax_anal.final.unroller is not None:
+                    print('Unrolled %d loops.' %
+                          syntax_anal.final.unroller.unrolled_loops)
+                if syntax_anal.final.specializer is not None:
+                    print('Made %d specialised copies of subprograms.' %
+                          syntax_anal.final.specializer.cloned())
+                if syntax_anal.final.scheduler is not None:
+                    print('Scheduling saved an estimated %d cycles.' %
+                          syntax_anal.final.scheduler.cycles_saved())
+            if syntax_anal is not None and \
+                    syntax_anal.reused_subprograms > 0:
+                print('Reused the cached code of %d subprograms.' %
+                      syntax_anal.reused_subprograms)
+        except CompilationError as e:
+            print('%s:%s\n' % (args.source_file, str(e)))
+            # the files written so far would be mistaken for the output
+            for sink in sinks.values():
+                sink.close()
+                os.remove(sink.name)
+            sys.exit(1)
+        finally:
+            for sink in sinks.values():
+                sink.close()
+
+    if args.run:
+        if args.runner == 'python':
+            vm = PythonGen(syntax_anal.quad_gen)
+        else:
+            vm = QuadVM(syntax_anal.quad_gen,
+                        count_quads=args.quad_counts is not None)
+        sys.stdout.flush()
+        try:
+            vm.run()
+        except VMError as e:
+            print('%s: runtime error: %s' % (args.source_file, str(e)))
+            sys.exit(1)
+        if args.quad_counts is not None:
+            with open(args.quad_counts, 'w') as counts_file:
+                counts_file.write(''.join(
+                    '%d\t%s\n' % (count, format_quad(quad))
+                    for count, quad in vm.profile()))
+
+    if args.simulate:
+        sys.stdout.flush()
+        try:
+            result = MipsSimulator(final, options.latency_model).run()
+        except VMError as e:
+            print('%s: runtime error: %s' % (args.source_file, str(e)))
+            sys.exit(1)
+        print('Ran %d instructions in an estimated %d cycles.' %
+              (result.instructions, result.cycles))
+        if args.label_counts is not None:
+            with open(args.label_counts, 'w') as counts_file:
+                counts_file.write(''.join(
+                    '%d\t%s\n' % (count, label)
+                    for label, count in sorted(result.label_hits.items(),
+                                               key=lambda hit: -hit[1])))
+        if result.exit_code != 0:
+            sys.exit(result.exit_code)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Compiles EEL files on a server started with `compiler.py --serve SOCKET`,
+# without loading the compiler itself.
+import argparse
+import json
+import os
+import socket
+import sys
+
+# what the server can send back for a source
+EMITS = ('tokens', 'quads', 'asm')
+
+
+def request_compile(socket_path, source, options=None, emit=('asm', )):
+    """Sends a source to the server listening on socket_path and returns its
+    response: a dict with the emitted tokens, quads and asm and the
+    diagnostics, or an error if the request was invalid or the server gave
+    no answer."""
+    request = {
+        'source': source,
+        'options': options if options is not None else {},
+        'emit': list(emit)
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as response_file:
+            line = response_file.readline()
+    try:
+        response = json.loads(line)
+    except ValueError:
+        response = None
+    if not isinstance(response, dict) or 'error' not in response:
+        return {'error': 'The server at [%s] gave no valid answer.' %
+                socket_path}
+    return response
+
+
+def option(text):
+    name, equals, value = text.partition('=')
+    if equals == '':
+        raise argparse.ArgumentTypeError('expected NAME=VALUE, got %s' % text)
+    try:
+        # true, false and numbers; anything else is a string
+        return name.replace('-', '_'), json.loads(value)
+    except ValueError:
+        return name.replace('-', '_'), value
+
+
+def format_diagnostic(diagnostic):
+    if diagnostic['row'] is None:
+        return diagnostic['message']
+    text = '(%d,%d):\n\t%s' % (diagnostic['row'], diagnostic['col'],
+                               diagnostic['message'])
+    if diagnostic['suggestion'] is not None:
+        text += '\n\t-> %s' % diagnostic['suggestion']
+    return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('socket', help='the socket the server listens on')
+    parser.add_argument('source_file', help='EEL file to compile')
+    parser.add_argument(
+        '--emit',
+        nargs='+',
+        choices=EMITS,
+        default=['quads', 'asm'],
+        help='what to write: the tokens to <name>.tokens, the quads to '
+        '<name>.eeli and the final code to <name>.s or <name>.c (default: '
+        'quads and asm)')
+    parser.add_argument(
+        '--output-dir',
+        default='.',
+        metavar='DIR',
+        help='write what is emitted to DIR (default: the current directory)')
+    parser.add_argument(
+        '--option',
+        dest='options',
+        type=option,
+        action='append',
+        default=[],
+        metavar='NAME=VALUE',
+        help='compile with a field of CompileOptions set, like '
+        'schedule=true or target=c; may be repeated')
+    args = parser.parse_args()
+
+    with open(args.source_file, 'r') as source_file:
+        source = source_file.read()
+    options = dict(args.options)
+    try:
+        response = request_compile(args.socket, source, options, args.emit)
+    except OSError as e:
+        print('Could not reach the server at [%s]: %s' % (args.socket, e))
+        sys.exit(2)
+    if response['error'] is not None:
+        print(response['error'])
+        sys.exit(2)
+    if len(response['diagnostics']) > 0:
+        for diagnostic in response['diagnostics']:
+            print('%s:%s\n' %
+                  (args.source_file, format_diagnostic(diagnostic)))
+        sys.exit(1)
+
+    sourcename = os.path.join(args.output_dir,
+                              os.path.basename(args.source_file).split('.')[0])
+    extension = 'c' if options.get('target') == 'c' else 's'
+    os.makedirs(args.output_dir, exist_ok=True)
+    for emit, filename, text in [
+        ('tokens', '%s.tokens' % sourcename, ''.join(
+            '%d:%d\t%s\t%s\n' % (row, col, type, value)
+            for type, value, row, col in response.get('tokens', []))),
+        ('quads', '%s.eeli' % sourcename, response.get('quads')),
+        ('asm', '%s.%s' % (sourcename, extension), response.get('asm'))
+    ]:
+        if emit in args.emit:
+            print('Putting %s in [%s]...' % (emit, filename))
+            with open(filename, 'w') as output_file:
+                output_file.write(text)
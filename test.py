@@ -1,8 +1,26 @@
+import asyncio
+import io
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from compiler import (Argument, FinalGen, FunctionEntity, LookupResult,
-                      ParameterEntity, Scope, SymbolTable, TempVariableEntity,
-                      VariableEntity)
-from unittest.mock import MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from compiler import (Argument, CGen, CompileOptions, FinalGen, FrameInfo,
+                      FunctionEntity, LatencyModel, Lexer, LookupResult,
+                      MipsScheduler, MipsSimulator, ParameterEntity,
+                      PythonGen, Quad, QuadVM, Scope, SymbolTable, SyntaxAnal,
+                      TempVariableEntity, VariableEntity, VMError,
+                      CacheEntry, CompileCache, CompileServer, IRFormatError,
+                      IRReader, SubprogramCache, TrueFalse, compile_batch,
+                      compile_file, compile_source, compile_source_async,
+                      encode_ir, find_sources, format_token,
+                      output_filenames)
+from eelclient import request_compile
+from unittest.mock import MagicMock, patch
 
 
 class SymbolTableTest(unittest.TestCase):
@@ -203,8 +221,7 @@ class FinalCodeHelpersTest(unittest.TestCase):
         gen = FinalGen(tbl)
 
         self.assertEqual(
-            gen.gnlvcode('var0'),
-            ['lw $t0, -4($sp)', 'lw $t0, -4($t0)', 'add $t0, $t0, -4'])
+            gen.gnlvcode('var0'), ['lw $t0, -4($sp)', 'add $t0, $t0, -4'])
         tbl.get_current_nesting_level.assert_called_once()
         tbl.lookup.assert_called_once_with('var0')
 
@@ -217,10 +234,8 @@ class FinalCodeHelpersTest(unittest.TestCase):
         gen = FinalGen(tbl)
 
         self.assertEqual(
-            gen.gnlvcode('var0'), [
-                'lw $t0, -4($sp)', 'lw $t0, -4($t0)', 'lw $t0, -4($t0)',
-                'add $t0, $t0, -4'
-            ])
+            gen.gnlvcode('var0'),
+            ['lw $t0, -4($sp)', 'lw $t0, -4($t0)', 'add $t0, $t0, -4'])
         tbl.get_current_nesting_level.assert_called_once()
         tbl.lookup.assert_called_once_with('var0')
 
@@ -507,6 +522,1897 @@ class FinalCodeHelpersTest(unittest.TestCase):
             gen.storerv(5, 'inout_par0'),
             gen.gnlvcode('inout_par0') + ['lw $t0, ($t0)', 'sw $t5, ($t0)'])
 
+    def test_init_call_of_child_passes_own_frame(self):
+        tbl = SymbolTable()
+        tbl.get_current_nesting_level = MagicMock(return_value=1)
+        tbl.lookup = MagicMock(
+            return_value=LookupResult(FunctionEntity('child', 4), 1))
+
+        gen = FinalGen(tbl)
+
+        self.assertEqual(gen.init_call('child'), ['sw $sp, -4($fp)'])
+
+    def test_init_call_of_sibling_passes_own_static_link(self):
+        tbl = SymbolTable()
+        tbl.get_current_nesting_level = MagicMock(return_value=2)
+        tbl.lookup = MagicMock(
+            return_value=LookupResult(FunctionEntity('sibling', 4), 1))
+
+        gen = FinalGen(tbl)
+
+        self.assertEqual(
+            gen.init_call('sibling'), ['lw $t0, -4($sp)', 'sw $t0, -4($fp)'])
+
+    def test_init_call_of_outer_function_walks_static_links(self):
+        tbl = SymbolTable()
+        tbl.get_current_nesting_level = MagicMock(return_value=3)
+        tbl.lookup = MagicMock(
+            return_value=LookupResult(FunctionEntity('outer', 4), 1))
+
+        gen = FinalGen(tbl)
+
+        self.assertEqual(
+            gen.init_call('outer'),
+            ['lw $t0, -4($sp)', 'lw $t0, -4($t0)', 'sw $t0, -4($fp)'])
+
+
+class RegisterCallingConventionTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = SymbolTable()
+        self.tbl.create_scope()
+        self.tbl.add_entity(VariableEntity('x'))
+        self.tbl.add_entity(FunctionEntity('fn', 42))
+        self.tbl.add_argument(Argument('a', 'cv'))
+        self.tbl.add_argument(Argument('b', 'ref'))
+        self.tbl.add_argument(Argument('c', 'cv'))
+        self.tbl.create_scope()
+        self.tbl.add_entity(VariableEntity('y'))
+        self.tbl.add_entity(ParameterEntity('T_0', 'ret'))
+
+        self.gen = FinalGen(
+            self.tbl, options=CompileOptions(calling_convention='registers'))
+
+    def test_in_arguments_go_to_argument_registers(self):
+        quads = [
+            Quad(1, 'par', 'y', 'cv', '_'),
+            Quad(2, 'par', 'y', 'ref', '_'),
+            Quad(3, 'par', '7', 'cv', '_'),
+            Quad(4, 'par', 'T_0', 'ret', '_')
+        ]
+
+        self.assertEqual(
+            self.gen.setup_parameters(quads), [
+                'lw $a0, -24($sp)', 'add $t0, $sp, -24', 'sw $t0, -16($fp)',
+                'li $a1, 7'
+            ])
+
+    def test_arguments_are_homed_on_entry(self):
+        self.assertEqual(self.gen.home_arguments(),
+                         ['sw $a0, -12($sp)', 'sw $a1, -20($sp)'])
+
+    def test_return_value_goes_to_v0(self):
+        self.assertEqual(self.gen.return_value('y'), ['lw $v0, -24($sp)'])
+
+    def test_stack_convention_returns_through_pointer(self):
+        gen = FinalGen(self.tbl)
+
+        self.assertEqual(
+            gen.return_value('y'),
+            ['lw $t1, -24($sp)', 'lw $t0, -8($sp)', 'sw $t1, ($t0)'])
+
+
+def compile_eel(source, options=None):
+    syntax_anal = SyntaxAnal(Lexer(source).tokenize(), options)
+    syntax_anal.check_syntax()
+    return syntax_anal
+
+
+def block_of(final, name):
+    lines = final.formatted().split('\n')
+    start = lines.index('%s:' % name)
+    end = next(i for i in range(start, len(lines))
+               if lines[i].strip() in ('jr $ra', 'syscall'))
+    return [
+        line.strip() for line in lines[start + 1:end + 1]
+        if not line.endswith(':')
+    ]
+
+
+class FrameTrimmingTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare g enddeclare
+            function outer(in a)
+                function inner(in b)
+                    return a + b
+                endfunction
+                return inner(in a)
+            endfunction
+            function leaf(in x)
+                return x + g
+            endfunction
+            g := leaf(in outer(in 1))
+        endprogram
+    '''
+
+    def test_frame_info(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertEqual(
+            sorted(final.frame_info.values(),
+                   key=lambda info: info.reach or 0),
+            [
+                FrameInfo(is_leaf=False, reach=None),
+                FrameInfo(is_leaf=True, reach=None),
+                FrameInfo(is_leaf=True, reach=1),
+            ])
+
+    def test_leaf_does_not_save_return_address(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertEqual(
+            block_of(final, 'leaf'), [
+                'add $sp, $sp, 20', 'lw $t1, -12($sp)', 'lw $t2, -12($s0)',
+                'add $t1, $t1, $t2', 'sw $t1, -16($sp)', 'lw $t1, -16($sp)',
+                'lw $t0, -8($sp)', 'sw $t1, ($t0)', 'jr $ra'
+            ])
+
+    def test_static_link_only_set_up_when_used(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertNotIn('sw $sp, -4($fp)', block_of(final, 'p'))
+        self.assertIn('sw $sp, -4($fp)', block_of(final, 'outer'))
+
+    def test_inout_globals_are_passed_from_s0(self):
+        final = compile_eel('''
+            program p
+                declare g enddeclare
+                procedure inc(inout x)
+                    x := x + 1
+                endprocedure
+                procedure outer()
+                    call inc(inout g)
+                endprocedure
+                call outer()
+            endprogram
+        ''', CompileOptions(tail_calls=False)).final
+
+        self.assertIn('add $t0, $s0, -12', block_of(final, 'outer'))
+
+    def test_untrimmed_frames(self):
+        final = compile_eel(self.SOURCE,
+                            CompileOptions(trim_frames=False)).final
+
+        self.assertEqual(block_of(final, 'leaf')[:2],
+                         ['add $sp, $sp, 20', 'sw $ra, ($sp)'])
+        self.assertIn('sw $sp, -4($fp)', block_of(final, 'p'))
+
+
+class BufferedIoTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare x enddeclare
+            procedure show(in a)
+                print a
+            endprocedure
+            input x;
+            call show(in x)
+        endprogram
+    '''
+
+    def test_print_and_input_call_the_runtime(self):
+        final = compile_eel(self.SOURCE,
+                            CompileOptions(buffered_io=True)).final
+
+        self.assertEqual(
+            block_of(final, 'show'), [
+                'add $sp, $sp, 16', 'sw $ra, ($sp)', 'lw $t1, -12($sp)',
+                'move $a0, $t1', 'jal __eel_print_int', 'lw $ra, ($sp)',
+                'jr $ra'
+            ])
+        self.assertEqual(
+            block_of(final, 'p')[2:4], ['jal __eel_read_int', 'move $t3, $v0'])
+
+    def test_output_is_flushed_at_halt(self):
+        final = compile_eel(self.SOURCE,
+                            CompileOptions(buffered_io=True)).final
+        lines = [line.strip() for line in final.formatted().split('\n')]
+        exit_call = lines.index('li $v0, 10')
+
+        self.assertEqual(lines[exit_call - 1], 'jal __eel_flush')
+        self.assertIn('__eel_flush:', lines)
+        self.assertIn('__eel_out_buf:', final.data)
+
+    def test_unbuffered_by_default(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertNotIn('jal __eel_print_int', block_of(final, 'show'))
+        self.assertEqual(final.data, [])
+
+
+class InlinerTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare x enddeclare
+            function addx(in v)
+                return v + x
+            endfunction
+            procedure bump(inout a)
+                a := a + 1
+            endprocedure
+            function shadow(in n)
+                declare x enddeclare
+                x := 100;
+                return addx(in n) + x
+            endfunction
+            function fact(in n)
+                if n < 2 then
+                    return 1
+                endif;
+                return n * fact(in n - 1)
+            endfunction
+            call bump(inout x);
+            x := addx(in 2) + shadow(in 3) + fact(in 4)
+        endprogram
+    '''
+
+    def compile(self, budget=10):
+        return compile_eel(self.SOURCE,
+                           CompileOptions(inline_budget=budget)).final
+
+    def test_small_calls_are_replaced_by_the_body(self):
+        main = block_of(self.compile(), 'p')
+
+        self.assertNotIn('jal bump', main)
+        self.assertNotIn('jal shadow', main)
+        # the one left comes from the copy of shadow
+        self.assertEqual(main.count('jal addx'), 1)
+
+    def test_inout_parameters_become_the_argument(self):
+        self.assertEqual(
+            block_of(self.compile(), 'p')[2:8], [
+                'lw $t1, -12($s0)', 'li $t2, 1', 'add $t1, $t1, $t2',
+                'sw $t1, -16($s0)', 'lw $t1, -16($s0)', 'sw $t1, -12($s0)'
+            ])
+
+    def test_recursive_functions_are_not_inlined(self):
+        final = self.compile(budget=100)
+
+        self.assertIn('jal fact', block_of(final, 'p'))
+        self.assertEqual(final.inliner.inlined_calls, 3)
+
+    def test_shadowed_names_prevent_inlining(self):
+        final = compile_eel(
+            self.SOURCE,
+            CompileOptions(
+                inline_budget=10, eliminate_dead_subprograms=False)).final
+
+        self.assertIn('jal addx', block_of(final, 'shadow'))
+
+    def test_budget(self):
+        final = self.compile(budget=2)
+
+        self.assertIn('jal shadow', block_of(final, 'p'))
+        self.assertNotIn('jal addx', block_of(final, 'p'))
+
+
+class CallGraphTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare x enddeclare
+            function outer(in n)
+                function inner(in m)
+                    return outer(in m - 1)
+                endfunction
+                if n < 1 then
+                    return 0
+                endif;
+                return inner(in n)
+            endfunction
+            function fact(in n)
+                if n < 2 then
+                    return 1
+                endif;
+                return n * fact(in n - 1)
+            endfunction
+            procedure unused(in a)
+                switch a
+                    case 1: x := 1
+                    case 2: x := 2
+                    case 3: x := 3
+                    case 4: x := 4
+                endswitch
+            endprocedure
+            x := outer(in 3) + fact(in 3)
+        endprogram
+    '''
+
+    def test_recursive_components(self):
+        call_graph = compile_eel(self.SOURCE).final.call_graph
+
+        self.assertEqual([[call_graph.names[start_quad] for start_quad in c]
+                          for c in call_graph.recursive_components()],
+                         [['outer', 'inner'], ['fact']])
+
+    def test_unreachable_subprograms_are_not_emitted(self):
+        final = compile_eel(self.SOURCE).final
+        call_graph = final.call_graph
+
+        self.assertEqual(
+            [call_graph.names[q] for q in call_graph.unreachable()],
+            ['unused'])
+        self.assertNotIn('unused:', final.formatted())
+        self.assertNotIn('.data', final.formatted())
+
+    def test_dead_subprograms_can_be_kept(self):
+        final = compile_eel(
+            self.SOURCE,
+            CompileOptions(eliminate_dead_subprograms=False)).final
+
+        self.assertIn('unused:', final.formatted())
+        self.assertIn('.data', final.formatted())
+
+    def test_dot(self):
+        dot = compile_eel(self.SOURCE).final.call_graph.to_dot()
+
+        self.assertIn('q0 [label="p", shape=box];', dot)
+        self.assertIn('q3 [label="inner", peripheries=2];', dot)
+        self.assertIn('q31 [label="unused", style=dashed];', dot)
+        self.assertIn('q2 -> q3 [style=dotted, arrowhead=none];', dot)
+        self.assertIn('q3 -> q2;', dot)
+
+
+class MemoizationTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare g enddeclare
+            function fib(in n)
+                if n < 2 then
+                    return n
+                endif;
+                return fib(in n - 1) + fib(in n - 2)
+            endfunction
+            function double(in n)
+                return n + n
+            endfunction
+            function sum(in n)
+                if n < 1 then
+                    return 0
+                endif;
+                return double(in n) + sum(in n - 1)
+            endfunction
+            function scaled(in n)
+                if n < 1 then
+                    return 0
+                endif;
+                return g + scaled(in n - 1)
+            endfunction
+            function noisy(in n)
+                print n;
+                if n < 1 then
+                    return 0
+                endif;
+                return noisy(in n - 1)
+            endfunction
+            g := fib(in 10) + sum(in 3) + scaled(in 2) + noisy(in 1)
+        endprogram
+    '''
+
+    def compile(self, **options):
+        return compile_eel(self.SOURCE,
+                           CompileOptions(memoize=True, **options)).final
+
+    def memoized(self, final):
+        return sorted(line[:-1] for line in final.data
+                      if line.startswith('M_'))
+
+    def test_purity(self):
+        final = self.compile()
+
+        self.assertEqual(sorted(final.pure.values()),
+                         [False, False, True, True, True])
+
+    def test_only_pure_recursive_functions_are_memoized(self):
+        final = self.compile()
+
+        self.assertEqual(self.memoized(final), ['M_2', 'M_22'])
+        self.assertIn('.space 3072', final.data)
+
+    def test_memo_size(self):
+        self.assertIn('.space 48', self.compile(memo_size=4).data)
+
+    def test_lookup_returns_from_the_prologue(self):
+        final = self.compile()
+        fib = block_of(final, 'fib')
+
+        self.assertEqual(fib[:4], [
+            'add $sp, $sp, 32', 'sw $ra, ($sp)', 'li $t1, 0',
+            'lw $t2, -12($sp)'
+        ])
+        self.assertEqual(fib[-5:], [
+            'lw $t1, 8($t1)', 'lw $t0, -8($sp)', 'sw $t1, ($t0)',
+            'lw $ra, ($sp)', 'jr $ra'
+        ])
+
+    def test_off_by_default(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertEqual(self.memoized(final), [])
+        self.assertNotIn('M_2', final.formatted())
+
+
+class TailCallTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare r enddeclare
+            function swp(in a, in b, in n)
+                if n = 0 then
+                    return a
+                endif;
+                return swp(in b, in a, in n - 1)
+            endfunction
+            function twice(in x)
+                return x + x
+            endfunction
+            function viaother(in x)
+                declare y enddeclare
+                y := x + 1;
+                return twice(in y)
+            endfunction
+            function big(in x)
+                declare a, b, c, d enddeclare
+                return x
+            endfunction
+            function small(in x)
+                return big(in x)
+            endfunction
+            procedure count(inout c, in n)
+                if n > 0 then
+                    c := c + 1;
+                    call count(inout c, in n - 1)
+                endif
+            endprocedure
+            call count(inout r, in 3);
+            r := swp(in 1, in 2, in 3) + viaother(in 1) + small(in 2)
+        endprogram
+    '''
+
+    def formatted(self, **options):
+        return compile_eel(self.SOURCE,
+                           CompileOptions(**options)).final.formatted()
+
+    def test_self_tail_calls_become_loops(self):
+        lines = self.formatted().split('\n')
+
+        self.assertEqual(lines.count('\tjal swp'), 1)
+        self.assertEqual(lines.count('\tjal count'), 1)
+        self.assertIn('\tj L_3', lines)
+        self.assertIn('\tj L_42', lines)
+
+    def test_swapped_arguments_are_staged(self):
+        lines = [
+            line.strip() for line in self.formatted().split('\n')
+        ]
+        loop = lines.index('j L_3')
+
+        self.assertEqual(lines[loop - 16:loop - 1], [
+            'L_12_0:', 'lw $t1, -16($sp)', 'sw $t1, -28($sp)', 'L_12_1:',
+            'lw $t1, -12($sp)', 'sw $t1, -32($sp)', 'L_12_2:',
+            'lw $t1, -28($sp)', 'sw $t1, -12($sp)', 'L_12_3:',
+            'lw $t1, -32($sp)', 'sw $t1, -16($sp)', 'L_12_4:',
+            'lw $t1, -24($sp)', 'sw $t1, -20($sp)'
+        ])
+
+    def test_other_tail_calls_reuse_the_frame(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertEqual(block_of(final, 'viaother')[-8:], [
+            'lw $t1, -16($sp)', 'move $fp, $sp', 'sw $t1, -12($fp)',
+            'lw $ra, ($sp)', 'add $sp, $sp, -20', 'j twice', 'lw $ra, ($sp)',
+            'jr $ra'
+        ])
+
+    def test_callees_with_larger_frames_are_called(self):
+        self.assertIn('\tjal big', self.formatted())
+
+    def test_loops_skip_nested_subprograms(self):
+        final = compile_eel('''
+            program p
+                function count(in n, in acc)
+                    function twice(in x)
+                        return x * 2
+                    endfunction
+                    if n = 0 then return acc endif;
+                    return count(in n - 1, in acc + twice(in 1))
+                endfunction
+                print count(in 5, in 0)
+            endprogram
+        ''').final.formatted()
+        stdout = io.StringIO()
+        MipsSimulator(final).run(io.StringIO(), stdout)
+
+        self.assertIn('\tj L_6', final.split('\n'))
+        self.assertEqual(stdout.getvalue(), '10\n')
+
+    def test_disabled(self):
+        formatted = self.formatted(tail_calls=False)
+
+        self.assertIn('\tjal twice', formatted)
+        self.assertEqual(formatted.count('\tjal swp'), 2)
+        self.assertEqual(formatted.count('\tjal count'), 2)
+
+
+class LoopUnrollingTest(unittest.TestCase):
+    def compile(self, body, **options):
+        return compile_eel(
+            '''
+            program p
+                declare i, n, s enddeclare
+                s := 0;
+                %s;
+                print s
+            endprogram
+        ''' % body, CompileOptions(**options)).final
+
+    def lines(self, final):
+        return [line.strip() for line in final.formatted().split('\n')]
+
+    def branches(self, final):
+        return [
+            line for line in self.lines(final)
+            if line.split(' ')[0] in ('beq', 'bne', 'blt', 'ble', 'bgt', 'bge')
+        ]
+
+    def test_small_loops_are_unrolled_completely(self):
+        final = self.compile(
+            '''
+            i := 0;
+            while i < 3
+                s := s + i;
+                i := i + 1
+            endwhile
+        ''', unroll_factor=4)
+
+        self.assertEqual(final.unroller.unrolled_loops, 1)
+        self.assertEqual(self.branches(final), [])
+        # s is loaded once by each copy and once by print
+        self.assertEqual(self.lines(final).count('lw $t1, -20($s0)'), 4)
+
+    def test_repeat_loops_are_unrolled(self):
+        final = self.compile(
+            '''
+            i := 10;
+            repeat
+                s := s + i;
+                i := i - 4;
+                if i <= 0 then
+                    exit
+                endif
+            endrepeat
+        ''', unroll_factor=4)
+
+        self.assertEqual(final.unroller.unrolled_loops, 1)
+        self.assertEqual(self.branches(final), [])
+
+    def test_large_loops_are_unrolled_by_the_factor(self):
+        final = self.compile(
+            '''
+            i := 0;
+            while i < 100
+                s := s + i;
+                i := i + 1
+            endwhile
+        ''', unroll_factor=4)
+        lines = self.lines(final)
+
+        self.assertEqual(self.branches(final), ['blt $t1, $t2, L_8_u0'])
+        self.assertEqual(lines.count('lw $t1, -20($s0)'), 5)
+        self.assertIn('j L_6_u0', lines)
+
+    def test_leftover_iterations_are_peeled(self):
+        final = self.compile('''
+            i := 0;
+            while i < 11
+                s := s + i;
+                i := i + 1
+            endwhile
+        ''',
+                             unroll_factor=2,
+                             unroll_max_quads=30)
+
+        self.assertEqual(self.branches(final), ['blt $t1, $t2, L_8_u1'])
+        self.assertEqual(self.lines(final).count('lw $t1, -20($s0)'), 4)
+        self.assertIn('j L_6_u1', self.lines(final))
+
+    def test_loops_without_a_known_trip_count_are_kept(self):
+        for body in [
+                'input n; i := 0; while i < n i := i + 1 endwhile',
+                'i := 0; while i < 5 if s > 2 then i := i + 1 endif endwhile',
+                'i := 0; while i < 5 i := i + 1; i := i + 1 endwhile',
+                'input i; while i < 5 i := i + 1 endwhile',
+                'i := 0; while i < 5 i := i * 2 endwhile',
+                'i := 1; while i > 0 i := i + 1 endwhile'
+        ]:
+            final = self.compile(body, unroll_factor=4)
+
+            self.assertEqual(final.unroller.unrolled_loops, 0, body)
+
+    def test_disabled_by_default(self):
+        final = self.compile('i := 0; while i < 3 i := i + 1 endwhile')
+
+        self.assertIsNone(final.unroller)
+        self.assertEqual(len(self.branches(final)), 1)
+
+
+class SpecializationTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare r enddeclare
+            function scale(in x, in mode)
+                if mode = 0 then
+                    return x
+                endif;
+                return x * mode
+            endfunction
+            function shown(in x)
+                print x;
+                return x
+            endfunction
+            function countdown(in n)
+                n := n - 1;
+                if n > 0 then
+                    return n
+                endif;
+                return 0
+            endfunction
+            function down(in n)
+                if n < 1 then
+                    return 0
+                endif;
+                return down(in n - 1)
+            endfunction
+            r := scale(in r, in 0) + scale(in r, in 2) + scale(in 1, in 0) +
+                scale(in r, in 0) + shown(in 1) + countdown(in 3) +
+                down(in 3)
+        endprogram
+    '''
+
+    def compile(self, max_clones=8):
+        return compile_eel(self.SOURCE,
+                           CompileOptions(max_clones=max_clones)).final
+
+    def test_calls_with_literals_use_a_clone(self):
+        final = self.compile()
+        main = block_of(final, 'p')
+
+        self.assertEqual([line for line in main if line.startswith('jal')], [
+            'jal S_2_0', 'jal S_2_1', 'jal S_2_2', 'jal S_2_0', 'jal shown',
+            'jal countdown', 'jal down'
+        ])
+        self.assertEqual(block_of(final, 'S_2_0')[-4:],
+                         ['lw $t1, -12($sp)', 'lw $t0, -8($sp)',
+                          'sw $t1, ($t0)', 'jr $ra'])
+        self.assertEqual(block_of(final, 'S_2_2'),
+                         ['add $sp, $sp, 20', 'li $t1, 1',
+                          'lw $t0, -8($sp)', 'sw $t1, ($t0)', 'jr $ra'])
+
+    def test_clones_are_named_after_their_literals(self):
+        dot = self.compile().call_graph.to_dot()
+
+        self.assertIn('qS_2_0 [label="scale(mode=0)"];', dot)
+        self.assertIn('qS_2_2 [label="scale(mode=0, x=1)"];', dot)
+        # every call to scale goes to a clone, so it is left out
+        self.assertIn('q2 [label="scale", style=dashed];', dot)
+
+    def test_limit(self):
+        final = self.compile(max_clones=1)
+        main = block_of(final, 'p')
+
+        self.assertEqual(final.specializer.cloned(), 1)
+        self.assertEqual(main.count('jal S_2_0'), 2)
+        self.assertEqual(main.count('jal scale'), 2)
+
+    def test_nothing_to_fold(self):
+        # shown only prints x, countdown assigns n and down calls itself
+        self.assertEqual(self.compile().specializer.cloned(), 3)
+
+    def test_parameters_nested_subprograms_assign(self):
+        final = compile_eel('''
+            program p
+                function f(in a)
+                    procedure bump()
+                        a := a + 10
+                    endprocedure
+                    call bump();
+                    return a + 1
+                endfunction
+                print f(in 1)
+            endprogram
+        ''', CompileOptions(max_clones=8)).final
+        stdout = io.StringIO()
+        MipsSimulator(final.formatted()).run(io.StringIO(), stdout)
+
+        self.assertEqual(final.specializer.cloned(), 0)
+        self.assertEqual(stdout.getvalue(), '12\n')
+
+    def test_disabled_by_default(self):
+        final = compile_eel(self.SOURCE).final
+
+        self.assertIsNone(final.specializer)
+        self.assertNotIn('S_2_0', final.formatted())
+
+
+class StackSlotSharingTest(unittest.TestCase):
+    SOURCE = '''
+        program p
+            declare r enddeclare
+            function g(in x)
+                return x * 2
+            endfunction
+            function f(in x)
+                declare a enddeclare
+                a := (x + 1) * (x + 2);
+                a := a + (x + 3) * (x + 4);
+                return g(in a) + g(in x) + g(in 1)
+            endfunction
+            function big(in x)
+                declare a, b, c, d enddeclare
+                return x
+            endfunction
+            function small(in x)
+                return big(in x + x + x + x + x)
+            endfunction
+            r := f(in 2) + small(in 1);
+            print r
+        endprogram
+    '''
+
+    def compile(self, **options):
+        return compile_eel(self.SOURCE, CompileOptions(**options)).final
+
+    def test_temporaries_with_disjoint_lifetimes_share_a_slot(self):
+        f = block_of(self.compile(), 'f')
+
+        self.assertEqual(f[0], 'add $sp, $sp, 28')
+        self.assertEqual(f[2:6], [
+            'lw $t1, -12($sp)', 'li $t2, 1', 'add $t1, $t1, $t2',
+            'sw $t1, -20($sp)'
+        ])
+        # the result of the first call is still live during the second one
+        self.assertEqual(
+            [line for line in f if line.startswith('add $t0, $sp')],
+            ['add $t0, $sp, -20', 'add $t0, $sp, -24', 'add $t0, $sp, -24'])
+
+    def test_variables_keep_their_slots(self):
+        for share in (True, False):
+            f = block_of(self.compile(share_stack_slots=share), 'f')
+            self.assertIn('sw $t1, -16($sp)', f)
+
+    def test_disabled(self):
+        f = block_of(self.compile(share_stack_slots=False), 'f')
+
+        self.assertEqual(f[0], 'add $sp, $sp, 68')
+
+    def test_frame_reused_by_a_tail_call_is_not_shrunk(self):
+        final = self.compile()
+        small = block_of(final, 'small')
+
+        self.assertEqual(block_of(final, 'big')[0], 'add $sp, $sp, 32')
+        self.assertEqual(small[0], 'add $sp, $sp, 32')
+        self.assertIn('j big', small)
+
+
+def run_eel(source, stdin='', runner=QuadVM):
+    vm = runner(compile_eel(source).quad_gen)
+    stdout = io.StringIO()
+    vm.run(io.StringIO(stdin), stdout)
+    return [int(line) for line in stdout.getvalue().split()], vm
+
+
+class QuadVMTest(unittest.TestCase):
+    runner = QuadVM
+
+    def run_eel(self, source, stdin=''):
+        return run_eel(source, stdin, self.runner)
+
+    def test_recursive_functions(self):
+        output, vm = self.run_eel('''
+            program p
+                function fact(in n)
+                    if n < 2 then
+                        return 1
+                    endif;
+                    return n * fact(in n - 1)
+                endfunction
+                print fact(in 5);
+                print fact(in 1)
+            endprogram
+        ''')
+
+        self.assertEqual(output, [120, 1])
+
+    def test_inout_parameters_alias_the_argument(self):
+        output, vm = self.run_eel('''
+            program p
+                declare g enddeclare
+                procedure bump(inout x)
+                    x := x + 1
+                endprocedure
+                procedure twice(inout y)
+                    call bump(inout y);
+                    call bump(inout y)
+                endprocedure
+                procedure local()
+                    declare z enddeclare
+                    z := 10;
+                    call twice(inout z);
+                    print z
+                endprocedure
+                g := 1;
+                call twice(inout g);
+                call local();
+                print g
+            endprogram
+        ''')
+
+        self.assertEqual(output, [12, 3])
+
+    def test_nested_subprograms_use_the_frame_around_them(self):
+        output, vm = self.run_eel('''
+            program p
+                declare g enddeclare
+                function outer(in n)
+                    declare v enddeclare
+                    function inner(in k)
+                        g := g + v;
+                        return v + k
+                    endfunction
+                    v := n * 10;
+                    if n > 0 then
+                        return outer(in n - 1) + inner(in n)
+                    endif;
+                    return inner(in 100)
+                endfunction
+                g := 0;
+                print outer(in 2);
+                print g
+            endprogram
+        ''')
+
+        self.assertEqual(output, [133, 30])
+
+    def test_input(self):
+        output, vm = self.run_eel('''
+            program p
+                declare a, b, c enddeclare
+                input a;
+                input b;
+                input c;
+                print a - b;
+                print c
+            endprogram
+        ''', stdin='7  2\n')
+
+        # like the read_int syscall, the end of the input reads as 0
+        self.assertEqual(output, [5, 0])
+
+    def test_jump_tables(self):
+        output, vm = self.run_eel('''
+            program p
+                declare x, y enddeclare
+                x := 0;
+                while x < 6
+                    y := 0;
+                    switch x
+                        case 1: y := 10
+                        case 2: y := 20
+                        case 3: y := 30
+                        case 4: y := 40
+                    endswitch;
+                    print y;
+                    x := x + 1
+                endwhile
+            endprogram
+        ''')
+
+        self.assertEqual(output, [0, 10, 20, 30, 40, 0])
+
+    def test_arithmetic_is_32_bit(self):
+        output, vm = self.run_eel('''
+            program p
+                print (0 - 7) / 2;
+                print 32767 * 32767 * 4
+            endprogram
+        ''')
+
+        self.assertEqual(output, [-3, -262140])
+
+    def test_division_by_zero(self):
+        with self.assertRaises(VMError):
+            self.run_eel('''
+                program p
+                    declare z enddeclare
+                    print 1 / z
+                endprogram
+            ''')
+
+    def test_quad_counts(self):
+        source = '''
+            program p
+                declare i enddeclare
+                function id(in x)
+                    return x
+                endfunction
+                i := 0;
+                while i < 3
+                    i := i + id(in 1)
+                endwhile
+            endprogram
+        '''
+        output, vm = run_eel(
+            source, runner=lambda quad_gen: QuadVM(quad_gen, count_quads=True))
+        counts = dict((quad.op, count) for count, quad in vm.profile())
+
+        self.assertEqual(counts['retv'], 3)
+        self.assertEqual(counts['par'], 3)
+        self.assertEqual(counts['<'], 4)
+        self.assertEqual(vm.profile()[-1][1].op, 'halt')
+        self.assertIsNone(run_eel(source)[1].counts)
+
+
+class PythonGenTest(QuadVMTest):
+    runner = PythonGen
+
+    def test_code_cache_is_bounded(self):
+        with patch('compiler.PYTHON_CODE_CACHE', {}) as cache, \
+                patch('compiler.PYTHON_CODE_CACHE_ENTRIES', 2):
+            for i in range(4):
+                self.run_eel('program p print %d endprogram' % i)
+
+        self.assertEqual(len(cache), 2)
+
+    def test_loops_become_python_loops(self):
+        output, python_gen = self.run_eel('''
+            program p
+                declare i, j, s enddeclare
+                i := 0;
+                s := 0;
+                while i < 10
+                    j := 0;
+                    while j < i
+                        s := s + j;
+                        j := j + 1
+                    endwhile;
+                    i := i + 1
+                endwhile;
+                print s
+            endprogram
+        ''')
+
+        self.assertEqual(output, [120])
+        # one for each EEL loop, inside the one that dispatches basic blocks
+        self.assertEqual(python_gen.source().count('<= pc <='), 2)
+
+    def test_inout_variables_are_boxed(self):
+        output, python_gen = self.run_eel('''
+            program p
+                declare a, b enddeclare
+                procedure set(inout x)
+                    x := 5
+                endprocedure
+                a := 1;
+                b := 2;
+                call set(inout a);
+                print a + b
+            endprogram
+        ''')
+
+        self.assertEqual(output, [7])
+        self.assertIn('v_a[0] = 1', python_gen.source())
+        self.assertIn('v_b = 2', python_gen.source())
+
+    def test_deep_recursion(self):
+        output, python_gen = self.run_eel('''
+            program p
+                function down(in n)
+                    if n = 0 then
+                        return 0
+                    endif;
+                    return down(in n - 1) + 1
+                endfunction
+                print down(in 20000)
+            endprogram
+        ''')
+
+        self.assertEqual(output, [20000])
+
+    def test_code_is_cached(self):
+        source = '''
+            program p
+                print 1
+            endprogram
+        '''
+
+        self.assertIs(run_eel(source, runner=PythonGen)[1].code(),
+                      run_eel(source, runner=PythonGen)[1].code())
+
+
+class NativeC:
+    """Runs a program translated to C and compiled with gcc."""
+
+    def __init__(self, quad_gen):
+        self.c_gen = CGen(quad_gen)
+
+    def run(self, stdin, stdout):
+        with tempfile.TemporaryDirectory() as directory:
+            c_file = os.path.join(directory, 'program.c')
+            executable = os.path.join(directory, 'program')
+            with open(c_file, 'w') as f:
+                f.write(self.c_gen.source())
+            subprocess.run(['gcc', '-O2', c_file, '-o', executable],
+                           check=True)
+            result = subprocess.run([executable],
+                                    input=stdin.read(),
+                                    capture_output=True,
+                                    text=True)
+        stdout.write(result.stdout)
+        if result.returncode != 0:
+            raise VMError(result.stderr)
+
+
+@unittest.skipIf(shutil.which('gcc') is None, 'needs gcc')
+class CGenTest(QuadVMTest):
+    runner = NativeC
+
+    def test_nested_subprograms_follow_static_links(self):
+        output, native = self.run_eel('''
+            program p
+                declare g enddeclare
+                procedure outer()
+                    declare v enddeclare
+                    procedure inner(inout x)
+                        x := g + v
+                    endprocedure
+                    v := 2;
+                    call inner(inout g)
+                endprocedure
+                g := 1;
+                call outer();
+                print g
+            endprogram
+        ''')
+        source = native.c_gen.source()
+
+        self.assertEqual(output, [3])
+        self.assertIn('*v_x = ', source)
+        self.assertIn('link->link->v_g', source)
+        self.assertIn('link->v_v', source)
+        self.assertIn('&frame', source)
+
+
+@unittest.skipIf(
+    shutil.which('gcc') is None or platform.machine() != 'x86_64' or
+    sys.platform != 'linux', 'needs gcc on x86-64 Linux')
+class X86GenTest(QuadVMTest):
+    def run_eel(self, source, stdin=''):
+        syntax_anal = compile_eel(source, CompileOptions(target='x86-64'))
+        with tempfile.TemporaryDirectory() as directory:
+            s_file = os.path.join(directory, 'program.s')
+            executable = os.path.join(directory, 'program')
+            with open(s_file, 'w') as f:
+                f.write(syntax_anal.final.formatted())
+            subprocess.run(
+                ['gcc', '-nostdlib', '-static', s_file, '-o', executable],
+                check=True)
+            result = subprocess.run([executable],
+                                    input=stdin,
+                                    capture_output=True,
+                                    text=True)
+        if result.returncode != 0:
+            raise VMError(result.stderr)
+        return [int(line) for line in result.stdout.split()], syntax_anal
+
+    def test_static_links_are_followed(self):
+        output, syntax_anal = self.run_eel('''
+            program p
+                procedure outer()
+                    declare v enddeclare
+                    procedure middle()
+                        procedure inner()
+                            v := v + 1
+                        endprocedure
+                        call inner()
+                    endprocedure
+                    v := 41;
+                    call middle();
+                    print v
+                endprocedure
+                call outer()
+            endprogram
+        ''')
+        lines = syntax_anal.final.formatted().split('\n')
+
+        self.assertEqual(output, [42])
+        self.assertIn('\tmovq -8(%rcx), %rcx', lines)
+
+
+class MipsSimulatorTest(QuadVMTest):
+    def run_eel(self, source, stdin='', options=None):
+        syntax_anal = compile_eel(source, options)
+        simulator = MipsSimulator(syntax_anal.final.formatted())
+        stdout = io.StringIO()
+        result = simulator.run(io.StringIO(stdin), stdout)
+        return [int(line) for line in stdout.getvalue().split()], result
+
+    def test_buffered_io(self):
+        output, result = self.run_eel('''
+            program p
+                declare a, b enddeclare
+                input a;
+                input b;
+                print a - b;
+                print 0 - 32000 * 64
+            endprogram
+        ''',
+                                      stdin='5\n-7\n',
+                                      options=CompileOptions(buffered_io=True))
+
+        self.assertEqual(output, [12, -2048000])
+
+    def test_label_hits(self):
+        output, result = self.run_eel('''
+            program p
+                declare i enddeclare
+                procedure noop()
+                endprocedure
+                i := 0;
+                while i < 5
+                    call noop();
+                    i := i + 1
+                endwhile
+            endprogram
+        ''')
+
+        self.assertEqual(result.label_hits['noop'], 5)
+        self.assertEqual(result.label_hits['L_0'], 1)
+        self.assertEqual(result.exit_code, 0)
+
+    def test_cycles_count_stalls(self):
+        simulator = MipsSimulator('\n'.join([
+            'li $t1, 6', 'li $t2, 7', 'mul $t3, $t1, $t2', 'move $a0, $t3',
+            'li $v0, 17', 'syscall'
+        ]))
+        result = simulator.run(io.StringIO(), io.StringIO())
+
+        self.assertEqual(result.exit_code, 42)
+        self.assertEqual(result.instructions, 6)
+        # move waits a cycle for the result of mul
+        self.assertEqual(result.cycles, 7)
+
+    def test_data(self):
+        simulator = MipsSimulator('\n'.join([
+            '.data', 'table:', '.word 3, 4', '.text', 'la $t0, table',
+            'lw $t1, 4($t0)', 'sw $t1, ($t0)', 'lw $a0, table', 'li $v0, 1',
+            'syscall'
+        ]))
+        stdout = io.StringIO()
+        simulator.run(io.StringIO(), stdout)
+
+        self.assertEqual(stdout.getvalue(), '4')
+
+    def test_jumps_outside_the_code(self):
+        simulator = MipsSimulator('\n'.join(['li $t0, 5', 'jr $t0']))
+
+        with self.assertRaises(VMError):
+            simulator.run(io.StringIO(), io.StringIO())
+
+    def test_labels_defined_twice(self):
+        with self.assertRaises(VMError):
+            MipsSimulator('\n'.join(['h:', 'nop', 'h:', 'nop']))
+
+    def test_writes_to_zero_are_discarded(self):
+        simulator = MipsSimulator('\n'.join(
+            ['li $zero, 5', 'move $a0, $zero', 'li $v0, 17', 'syscall']))
+        result = simulator.run(io.StringIO(), io.StringIO())
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(simulator.registers[0], 0)
+
+    def test_invalid_strings(self):
+        for address in ['0', '0x7fffffff']:
+            simulator = MipsSimulator('\n'.join(
+                ['li $a0, %s' % address, 'li $v0, 4', 'syscall']))
+
+            with self.assertRaises(VMError):
+                simulator.run(io.StringIO(), io.StringIO())
+
+
+class StreamedMipsTest(MipsSimulatorTest):
+    def run_eel(self, source, stdin='', options=None):
+        options = (options or CompileOptions())._replace(
+            eliminate_dead_subprograms=False)
+        sink = io.StringIO()
+        syntax_anal = SyntaxAnal(Lexer(source).tokenize(), options,
+                                 final_sink=sink)
+        syntax_anal.check_syntax()
+        self.assertEqual(syntax_anal.final.generated, [])
+        simulator = MipsSimulator(sink.getvalue())
+        stdout = io.StringIO()
+        result = simulator.run(io.StringIO(stdin), stdout)
+        return [int(line) for line in stdout.getvalue().split()], result
+
+
+class StreamTest(unittest.TestCase):
+    source = """program p
+    declare x enddeclare
+    function f(in a)
+        function g(in b)
+            return b + 1
+        endfunction
+        return g(in a) * 2
+    endfunction
+    x := f(in 3);
+    print x
+endprogram"""
+
+    def stream(self, generate_final):
+        sink = io.StringIO()
+        syntax_anal = SyntaxAnal(
+            Lexer(self.source).tokenize(),
+            CompileOptions(eliminate_dead_subprograms=False),
+            generate_final=generate_final,
+            quad_sink=sink)
+        syntax_anal.check_syntax()
+        return syntax_anal, sink.getvalue()
+
+    def test_quads_are_written_as_blocks_end(self):
+        syntax_anal, streamed = self.stream(True)
+        ids = [int(line.split(':')[0]) for line in streamed.split('\n')[:-1]]
+
+        self.assertEqual(ids[:5], [3, 4, 5, 6, 2])
+        self.assertEqual(sorted(streamed.split('\n')[:-1],
+                                key=lambda line: int(line.split(':')[0])),
+                         compile_source(self.source).intermediate.split('\n'))
+        self.assertEqual(syntax_anal.quad_gen.quad_list, {})
+
+    def test_memory_follows_the_nesting(self):
+        source = 'program p\n%s\ncall p0()\nendprogram' % '\n'.join(
+            'procedure p%d()\n    print %d\nendprocedure' % (i, i)
+            for i in range(200))
+        sizes = []
+
+        class Sink(io.StringIO):
+            def write(self, text):
+                sizes.append(len(syntax_anal.quad_gen.quad_list))
+                return super().write(text)
+
+        syntax_anal = SyntaxAnal(
+            Lexer(source).tokenize(),
+            CompileOptions(eliminate_dead_subprograms=False),
+            quad_sink=Sink())
+        syntax_anal.check_syntax()
+
+        self.assertEqual(syntax_anal.quad_gen.quad_id, 604)
+        # the main program's begin_block and the block being written
+        self.assertLessEqual(max(sizes), 5)
+        self.assertEqual(syntax_anal.quad_gen.quad_list, {})
+        self.assertIsNone(syntax_anal.quad_gen.marked)
+
+    def test_quads_stream_without_final_code(self):
+        self.assertEqual(self.stream(False)[1], self.stream(True)[1])
+
+    def test_dead_subprograms_need_the_whole_program(self):
+        with self.assertRaises(ValueError):
+            SyntaxAnal(Lexer(self.source).tokenize(), final_sink=io.StringIO())
+
+
+class BinaryIRTest(unittest.TestCase):
+    source = StreamTest.source
+
+    def setUp(self):
+        self.syntax_anal = compile_eel(self.source)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'p.eeli')
+        self.write(encode_ir(self.syntax_anal.quad_gen))
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_round_trip(self):
+        with IRReader(self.path) as reader:
+            quad_gen = reader.quad_generator()
+
+        self.assertEqual(quad_gen.quad_list,
+                         self.syntax_anal.quad_gen.quad_list)
+        self.assertEqual(quad_gen.parameters[2][0].name, 'a')
+        self.assertEqual(quad_gen.parameters[3][0].mode, 'cv')
+        stdout = io.StringIO()
+        QuadVM(quad_gen).run(io.StringIO(), stdout)
+        self.assertEqual(stdout.getvalue(), '8\n')
+
+    def test_subprograms_are_read_on_their_own(self):
+        with IRReader(self.path) as reader:
+            f = reader.subprograms[reader.find('f')[0]]
+            quads = reader.quads(f.start_quad)
+
+        self.assertEqual((f.end_quad, f.level, f.parent), (12, 1, 0))
+        self.assertEqual([quad.id for quad in quads], [2, 7, 8, 9, 10, 11, 12])
+        self.assertEqual(quads[3].op, 'call')
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for bad in [b'', data[:4] + b'\x63\x00' + data[6:],
+                    b'1: (halt, _, _, _)' * 4, data[:40], data[:60],
+                    data[:len(data) // 2], data[:-4]]:
+            self.write(bad)
+            with self.assertRaises(IRFormatError):
+                IRReader(self.path)
+
+    def test_corrupt_quads_are_rejected(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        quads_offset = int.from_bytes(data[28:32], 'little')
+        # the op of the first quad, an index past the end of the strings
+        self.write(data[:quads_offset] + b'\xff\xff\xff\x7f' +
+                   data[quads_offset + 4:])
+
+        with IRReader(self.path) as reader:
+            with self.assertRaises(IRFormatError):
+                reader.quad(0)
+
+
+class CompileBatchTest(unittest.TestCase):
+    def test_compiles_every_file_and_reports_failures(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sources = os.path.join(directory, 'sources')
+            output_dir = os.path.join(directory, 'out')
+            os.mkdir(sources)
+            os.mkdir(output_dir)
+            for name, text in [('good', 'program good print 1 endprogram'),
+                               ('bad', 'program bad print endprogram'),
+                               ('notes', 'not EEL')]:
+                extension = '.txt' if name == 'notes' else '.eel'
+                with open(os.path.join(sources, name + extension), 'w') as f:
+                    f.write(text)
+
+            source_files = find_sources([sources])
+            reports = compile_batch(source_files, CompileOptions(),
+                                    output_dir, jobs=2)
+            outputs = sorted(os.listdir(output_dir))
+
+        self.assertEqual([os.path.basename(path) for path in source_files],
+                         ['bad.eel', 'good.eel'])
+        self.assertEqual([report.source_file for report in reports],
+                         source_files)
+        self.assertIn('bad.eel:', reports[0].error)
+        self.assertIsNone(reports[1].error)
+        self.assertEqual(outputs, ['good.eeli', 'good.s'])
+
+    def test_sources_with_the_same_output_are_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_batch(['a/x.eel', 'b/x.eel'], CompileOptions(), 'out')
+
+    def test_output_filenames_follow_the_target(self):
+        self.assertEqual(
+            output_filenames('dir/demo.eel', CompileOptions(target='c'),
+                             'out'), ('out/demo.eeli', 'out/demo.c'))
+
+
+class EmitTest(unittest.TestCase):
+    # the tail call swaps the parameters through a temporary of FinalGen
+    source = """program p
+    function gcd(in a, in b)
+        if b = 0 then return a endif;
+        return gcd(in b, in a - a / b * b)
+    endfunction
+    print gcd(in 12, in 18) + 1
+endprogram"""
+
+    def test_tokens_alone_are_not_parsed(self):
+        with patch('compiler.SyntaxAnal') as syntax_anal:
+            result = compile_source(self.source, emit=['tokens'])
+
+        syntax_anal.assert_not_called()
+        self.assertEqual(format_token(result.tokens[1]), '1:9\tid\tp')
+        self.assertIsNone(result.intermediate)
+
+    def test_checking_does_not_generate_final_code(self):
+        with patch('compiler.FinalGen') as final_gen:
+            result = compile_source(self.source, emit=[])
+            error = compile_source('program p print endprogram', emit=[])
+
+        final_gen.assert_not_called()
+        self.assertEqual((result.intermediate, result.final, result.error),
+                         (None, None, None))
+        self.assertIsNotNone(error.error)
+
+    def test_quads_do_not_depend_on_the_final_code(self):
+        quads = compile_source(self.source, emit=['quads'])
+        everything = compile_source(self.source)
+
+        self.assertIsNone(quads.final)
+        self.assertEqual(quads.intermediate, everything.intermediate)
+
+    def test_compile_file_writes_what_is_emitted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_file = os.path.join(directory, 'demo.eel')
+            with open(source_file, 'w') as f:
+                f.write(self.source)
+            report = compile_file(source_file, CompileOptions(), directory,
+                                  emit=['tokens', 'quads'])
+            outputs = sorted(os.listdir(directory))
+            with open(os.path.join(directory, 'demo.eeli')) as f:
+                intermediate = f.read()
+
+        self.assertIsNone(report.error)
+        self.assertEqual(outputs, ['demo.eel', 'demo.eeli', 'demo.tokens'])
+        self.assertEqual(intermediate,
+                         compile_source(self.source).intermediate)
+
+
+class CompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.source_file = os.path.join(self.directory.name, 'demo.eel')
+        with open(self.source_file, 'w') as f:
+            f.write('program demo print 1 + 2 endprogram')
+
+    def test_hits_skip_compiling(self):
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        first = compile_file(self.source_file, CompileOptions(),
+                             self.directory.name, cache)
+        with open(os.path.join(self.directory.name, 'demo.s')) as f:
+            final = f.read()
+        os.remove(os.path.join(self.directory.name, 'demo.s'))
+        with patch('compiler.compile_entry') as compile_entry:
+            second = compile_file(self.source_file, CompileOptions(),
+                                  self.directory.name, cache)
+        with open(os.path.join(self.directory.name, 'demo.s')) as f:
+            cached_final = f.read()
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        compile_entry.assert_not_called()
+        self.assertEqual(cached_final, final)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_options_are_part_of_the_key(self):
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        source = 'program demo print 1 endprogram'
+
+        self.assertEqual(cache.key(source, CompileOptions()),
+                         cache.key(source, CompileOptions()))
+        self.assertNotEqual(cache.key(source, CompileOptions()),
+                            cache.key(source, CompileOptions(schedule=True)))
+        self.assertNotEqual(cache.key(source, CompileOptions()),
+                            cache.key(source + ' ', CompileOptions()))
+
+    def test_errors_are_cached(self):
+        with open(self.source_file, 'w') as f:
+            f.write('program demo print endprogram')
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        first = compile_file(self.source_file, CompileOptions(),
+                             self.directory.name, cache)
+        second = compile_file(self.source_file, CompileOptions(),
+                              self.directory.name, cache)
+
+        self.assertTrue(second.cached)
+        self.assertIsNotNone(first.error)
+        self.assertEqual(second.error, first.error)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        entry = CacheEntry(intermediate='x' * 40, final='y' * 40, error=None)
+        for i, key in enumerate(['a', 'b', 'c', 'd']):
+            cache.put(key, entry)
+            os.utime(cache.path(key), (i, i))
+        # room for four entries, and evicting goes down to three and a half
+        cache.max_bytes = 4 * os.path.getsize(cache.path('a'))
+        cache.get('a')
+        cache.put('e', entry)
+
+        self.assertEqual(sorted(os.listdir(cache.directory)),
+                         ['a.json', 'd.json', 'e.json'])
+        self.assertEqual(cache.size, 3 * os.path.getsize(cache.path('a')))
+
+    def test_batch_hits_are_counted(self):
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        for _ in range(2):
+            compile_batch([self.source_file], CompileOptions(),
+                          self.directory.name, jobs=2, cache=cache)
+
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_directory_is_only_listed_when_full(self):
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        entry = CacheEntry(intermediate='x' * 40, final='y' * 40, error=None)
+        cache.put('a', entry)
+        with patch('os.listdir') as listdir:
+            for key in ['b', 'c', 'd']:
+                cache.put(key, entry)
+
+        listdir.assert_not_called()
+        self.assertEqual(cache.size, 4 * os.path.getsize(cache.path('a')))
+
+    def test_outputs_are_written_when_the_cache_is_not(self):
+        with open(self.source_file, 'w') as f:
+            f.write('program demo print 1 endprogram')
+        cache = CompileCache(os.path.join(self.directory.name, 'cache'))
+        # a file where the cache directory was
+        shutil.rmtree(cache.directory)
+        open(cache.directory, 'w').close()
+        report = compile_file(self.source_file, CompileOptions(),
+                              self.directory.name, cache)
+
+        self.assertIsNone(report.error)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory.name, 'demo.s')))
+
+
+INCREMENTAL_PROGRAM = """program demo
+declare total enddeclare
+%s
+function square(in x)
+    declare y enddeclare
+    y := x * x;
+    return y
+endfunction
+procedure show(in n)
+    procedure twice()
+        print n + n
+    endprocedure
+    call twice();
+    while n > 0 n := n - 1 endwhile;
+    print n
+endprocedure
+total := square(in 3);
+call show(in total)
+endprogram"""
+
+
+class SubprogramCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = SubprogramCache(directory.name)
+
+    def compile(self, source, options=None):
+        syntax_anal = SyntaxAnal(Lexer(source).tokenize(), options, self.cache)
+        syntax_anal.check_syntax()
+        return syntax_anal
+
+    def assertSameCode(self, syntax_anal, source, options=None):
+        fresh = compile_eel(source, options)
+        self.assertEqual(str(syntax_anal.quad_gen), str(fresh.quad_gen))
+        self.assertEqual(syntax_anal.quad_gen.parameters,
+                         fresh.quad_gen.parameters)
+        self.assertEqual(syntax_anal.final.formatted(),
+                         fresh.final.formatted())
+        self.assertEqual(syntax_anal.final.call_graph.to_dot(),
+                         fresh.final.call_graph.to_dot())
+
+    def test_unchanged_subprograms_are_moved_into_place(self):
+        first = self.compile(INCREMENTAL_PROGRAM % '')
+        # shifts the quads, temporaries and labels of everything after it
+        source = INCREMENTAL_PROGRAM % '''procedure hello()
+    print 1 + 2
+endprocedure'''
+        second = self.compile(source)
+
+        self.assertEqual(first.reused_subprograms, 0)
+        self.assertEqual(second.reused_subprograms, 2)
+        self.assertSameCode(second, source)
+
+    def test_callers_of_changed_subprograms_are_compiled_again(self):
+        self.compile(INCREMENTAL_PROGRAM % '')
+        # square's frame grows, which its callers set up
+        source = (INCREMENTAL_PROGRAM % '').replace('declare y enddeclare',
+                                                    'declare y, z enddeclare')
+        syntax_anal = self.compile(source)
+
+        self.assertEqual(syntax_anal.reused_subprograms, 1)
+        self.assertSameCode(syntax_anal, source)
+
+    def test_options_are_part_of_the_fingerprint(self):
+        options = CompileOptions(schedule=True, unroll_factor=2)
+        self.compile(INCREMENTAL_PROGRAM % '')
+        syntax_anal = self.compile(INCREMENTAL_PROGRAM % '', options)
+        again = self.compile(INCREMENTAL_PROGRAM % '', options)
+
+        self.assertEqual(syntax_anal.reused_subprograms, 0)
+        self.assertEqual(again.reused_subprograms, 2)
+        self.assertSameCode(again, INCREMENTAL_PROGRAM % '', options)
+        self.assertEqual(again.final.scheduler.cycles_saved(),
+                         syntax_anal.final.scheduler.cycles_saved())
+
+    def test_not_used_when_callees_are_copied(self):
+        options = CompileOptions(inline_budget=8)
+        self.compile(INCREMENTAL_PROGRAM % '', options)
+        syntax_anal = self.compile(INCREMENTAL_PROGRAM % '', options)
+
+        self.assertEqual(syntax_anal.reused_subprograms, 0)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class CompileSourceTest(unittest.TestCase):
+    def programs(self):
+        sources = [INCREMENTAL_PROGRAM % '',
+                   switch_program([1, 2, 3, 4, 5, 6]),
+                   switch_program([1, 100, 10000, 3, 7]),
+                   'program p declare a enddeclare a := 1; '
+                   'if false or [a = 1 and not [true]] then print 1 '
+                   'else print 2 endif endprogram',
+                   'program p print endprogram']
+        options = [CompileOptions(),
+                   CompileOptions(schedule=True, unroll_factor=2),
+                   CompileOptions(inline_budget=8, max_clones=2),
+                   CompileOptions(target='c')]
+        return [(source, option) for source in sources for option in options]
+
+    def test_matches_the_compiler(self):
+        source = INCREMENTAL_PROGRAM % ''
+        result = compile_source(source)
+        syntax_anal = compile_eel(source)
+
+        self.assertEqual(result.tokens, Lexer(source).tokenize())
+        self.assertEqual(result.intermediate, str(syntax_anal.quad_gen))
+        self.assertEqual(result.final, syntax_anal.final.formatted())
+        self.assertIsNone(result.error)
+
+    def test_returns_the_error(self):
+        result = compile_source('program p print endprogram')
+
+        self.assertEqual(len(result.tokens), 4)
+        self.assertIsNone(result.final)
+        self.assertEqual((result.error.pos.row, result.error.pos.col), (1, 17))
+
+    def test_truncated_sources_return_the_error(self):
+        truncated = compile_source('program p declare a enddeclare a := 1')
+        trailing = compile_source('program p print 1 endprogram print')
+
+        self.assertEqual(truncated.error.msg, 'Unexpected end of file.')
+        self.assertEqual(truncated.error.pos.col, 37)
+        self.assertEqual(trailing.error.pos.col, 30)
+
+    def test_conditions_start_with_empty_lists(self):
+        compile_source('program p if false or true then print 1 endif '
+                       'endprogram')
+
+        self.assertEqual((TrueFalse().true, TrueFalse().false), ([], []))
+
+    def test_concurrent_compilations_agree_with_sequential_ones(self):
+        programs = self.programs()
+        expected = [compile_source(*program) for program in programs]
+        # every program several times, in an order that mixes them up
+        jobs = [i for i in range(len(programs))] * 4
+        jobs = jobs[::3] + jobs[1::3] + jobs[2::3]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(lambda i: compile_source(*programs[i]), jobs))
+
+        for i, result in zip(jobs, results):
+            # errors are told apart by their message
+            self.assertEqual(
+                result._replace(error=str(result.error)),
+                expected[i]._replace(error=str(expected[i].error)))
+
+    def test_async(self):
+        programs = self.programs()
+
+        async def compile_all():
+            return await asyncio.gather(*[
+                compile_source_async(source, options)
+                for source, options in programs
+            ])
+
+        results = asyncio.run(compile_all())
+
+        self.assertEqual([result.final for result in results],
+                         [compile_source(*program).final
+                          for program in programs])
+
+
+class CompileServerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, 'compiler.sock')
+        self.cache = CompileCache(os.path.join(directory.name, 'cache'))
+        self.server = CompileServer(self.socket_path, jobs=2,
+                                    cache=self.cache)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def test_sends_back_what_is_asked_for(self):
+        source = 'program demo print 1 + 2 endprogram'
+        options = CompileOptions(schedule=True)
+        response = request_compile(self.socket_path, source,
+                                   {'schedule': True},
+                                   ['tokens', 'quads', 'asm'])
+        syntax_anal = compile_eel(source, options)
+
+        self.assertIsNone(response['error'])
+        self.assertEqual(response['diagnostics'], [])
+        self.assertEqual(response['tokens'][:2],
+                         [['program', 'program', 1, 1], ['id', 'demo', 1, 9]])
+        self.assertEqual(response['quads'], str(syntax_anal.quad_gen))
+        self.assertEqual(response['asm'], syntax_anal.final.formatted())
+
+    def test_reports_diagnostics(self):
+        response = request_compile(self.socket_path,
+                                   'program demo\nprint endprogram')
+
+        self.assertEqual(response['diagnostics'], [{
+            'row': 2,
+            'col': 7,
+            'message': 'Expected token of type `int`, got `endprogram` '
+            '(`endprogram`).',
+            'suggestion': None
+        }])
+        self.assertNotIn('asm', response)
+
+    def test_rejects_invalid_requests(self):
+        for options in [{'no_such_option': True}, {'target': 'arm'},
+                        {'calling_convention': 'foo'}, {'memo_size': 0},
+                        {'memo_size': -4}, {'memo_size': 3},
+                        {'max_clones': -1}]:
+            response = request_compile(self.socket_path,
+                                       'program demo endprogram', options)
+
+            self.assertIn('Invalid request', response['error'])
+
+    def test_cache_lookups_of_the_processes_are_counted(self):
+        request_compile(self.socket_path, INCREMENTAL_PROGRAM % '')
+        request_compile(
+            self.socket_path, INCREMENTAL_PROGRAM %
+            'procedure hello()\n    print 1 + 2\nendprocedure')
+
+        self.assertEqual(self.cache.hits, 2)
+        self.assertGreater(self.cache.misses, 0)
+
+    def test_reports_connections_closed_without_an_answer(self):
+        def fail(request):
+            raise RuntimeError('the pool broke')
+
+        self.server.respond = fail
+        self.server.handle_error = lambda request, client_address: None
+        response = request_compile(self.socket_path, 'program demo endprogram')
+
+        self.assertIn('no valid answer', response['error'])
+
+    def test_serves_concurrent_clients(self):
+        sources = ['program demo print %d endprogram' % i for i in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(
+                executor.map(lambda source: request_compile(
+                    self.socket_path, source), sources))
+        again = request_compile(self.socket_path, sources[0])
+
+        self.assertEqual(
+            [response['asm'] for response in responses],
+            [compile_eel(source).final.formatted() for source in sources])
+        self.assertEqual(again, responses[0])
+        self.assertEqual((self.server.requests, self.server.hits), (9, 1))
+
+
+class MipsSchedulerTest(unittest.TestCase):
+    def test_loads_are_separated_from_their_uses(self):
+        scheduler = MipsScheduler()
+
+        self.assertEqual(
+            scheduler.schedule([
+                'lw $t1, -12($sp)', 'sw $t1, -16($sp)', 'lw $t2, -20($sp)',
+                'sw $t2, -24($sp)'
+            ]), [
+                'lw $t0, -12($sp)', 'lw $t3, -20($sp)', 'sw $t0, -16($sp)',
+                'sw $t3, -24($sp)'
+            ])
+        self.assertEqual(scheduler.cycles_saved(), 2)
+
+    def test_load_after_store_to_same_slot_keeps_its_place(self):
+        lines = [
+            'lw $t1, -12($sp)', 'sw $t1, -16($sp)', 'lw $t2, -16($sp)',
+            'sw $t2, -24($sp)'
+        ]
+        scheduler = MipsScheduler()
+
+        self.assertEqual(scheduler.schedule(lines), lines)
+        self.assertEqual(scheduler.cycles_saved(), 0)
+
+    def test_only_jump_targets_split_regions(self):
+        scheduler = MipsScheduler()
+        lines = [
+            'L_1:', 'lw $t1, -12($sp)', 'L_2:', 'sw $t1, -16($sp)', 'L_3:',
+            'lw $t2, -20($sp)', 'sw $t2, -24($sp)', 'j L_3'
+        ]
+
+        self.assertEqual(
+            scheduler.schedule(lines, keep_labels=['L_1']), [
+                'L_1:', 'lw $t1, -12($sp)', 'sw $t1, -16($sp)', 'L_3:',
+                'lw $t2, -20($sp)', 'sw $t2, -24($sp)', 'j L_3'
+            ])
+
+    def test_latency_model_is_pluggable(self):
+        class NoDelays(LatencyModel):
+            def latency(self, instruction):
+                return 1
+
+        lines = [
+            'lw $t1, -12($sp)', 'sw $t1, -16($sp)', 'lw $t2, -20($sp)',
+            'sw $t2, -24($sp)'
+        ]
+        scheduler = MipsScheduler(NoDelays())
+
+        self.assertEqual(scheduler.schedule(lines), lines)
+        self.assertEqual(scheduler.cycles_saved(), 0)
+
+
+def switch_program(values, subject='x'):
+    cases = '\n'.join('case %s: y := %s' % (value, i)
+                      for i, value in enumerate(values))
+    return '''program p
+        declare x, y enddeclare
+        switch %s
+        %s
+        endswitch
+    endprogram''' % (subject, cases)
+
+
+class SwitchLoweringTest(unittest.TestCase):
+    def ops(self, syntax_anal):
+        return [quad.op for quad in syntax_anal.quad_gen.quad_list]
+
+    def test_dense_cases_use_a_jump_table(self):
+        syntax_anal = compile_eel(switch_program([1, 2, 3, 5]))
+        quads = syntax_anal.quad_gen.quad_list
+        table = [quad for quad in quads if quad.op == 'jtarget']
+
+        self.assertEqual(quads[3], Quad(3, 'jump', '_', '_', 15))
+        self.assertEqual([quad.op for quad in quads[15:18]],
+                         ['<', '>', 'jtable'])
+        self.assertEqual([quad.target for quad in table], [4, 7, 10, 23, 13])
+        self.assertIn('JT_17:', syntax_anal.final.data)
+
+    def test_first_duplicate_case_wins(self):
+        syntax_anal = compile_eel(switch_program([1, 2, 2, 3]))
+        table = [
+            quad for quad in syntax_anal.quad_gen.quad_list
+            if quad.op == 'jtarget'
+        ]
+
+        self.assertEqual([quad.target for quad in table], [4, 7, 13])
+
+    def test_sparse_cases_use_a_decision_tree(self):
+        syntax_anal = compile_eel(switch_program([1, 100, 1000, 10000, 20000]))
+        dispatch = syntax_anal.quad_gen.quad_list[18:]
+
+        self.assertNotIn('jtable', self.ops(syntax_anal))
+        self.assertEqual(
+            [(quad.op, quad.term1) for quad in dispatch[:4]],
+            [('<', '1000'), ('=', '1000'), ('=', '10000'), ('=', '20000')])
+        self.assertEqual(dispatch[0].target, dispatch[5].id)
+
+    def test_non_constant_cases_keep_the_linear_chain(self):
+        syntax_anal = compile_eel(switch_program([1, 2, 'y', 3]))
+
+        self.assertEqual(self.ops(syntax_anal).count('<>'), 4)
+        self.assertNotIn('jtable', self.ops(syntax_anal))
+
+    def test_lowering_can_be_disabled(self):
+        syntax_anal = compile_eel(
+            switch_program([1, 2, 3, 5]),
+            CompileOptions(lower_switches=False))
+
+        self.assertEqual(self.ops(syntax_anal).count('<>'), 4)
+        self.assertEqual(syntax_anal.final.data, [])
+
 
 if __name__ == '__main__':
     unittest.main()